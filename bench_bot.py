@@ -0,0 +1,711 @@
+"""Benchmarks for bot_combined.py.
+
+Every benchmark runs against a throw-away SQLite database in a temp directory,
+never against students_data.db.
+
+    python bench_bot.py db-latency --users 500
+    python bench_bot.py webhook --users 1000 --rounds 3
+    python bench_bot.py --output after.json load --form-users 1000 --search-users 1000
+    python bench_bot.py dispatch --handlers 10 50 100 200
+    python bench_bot.py merge --students 20000 --change-ratio 0.01
+    python bench_bot.py compare before.json after.json
+"""
+import argparse
+import asyncio
+import collections
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import aiohttp
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, types
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from openpyxl import Workbook
+
+import bot_combined as bc
+
+BENCH_TOKEN = "123456:BENCH"
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(max(samples, default=0.0) * 1000, 3),
+    }
+
+
+def use_temp_database(directory, name="bench.db"):
+    """Points the bot's connection pool at a fresh database file and creates the schema."""
+    bc.db_pool.close()
+    bc.db_pool = bc.ConnectionPool(os.path.join(directory, name))
+    bc.create_database()
+
+
+def seed_students(count):
+    names = [f"طالب تجريبي رقم {i}" for i in range(count)]
+    with bc.get_db_connection() as conn:
+        conn.executemany("INSERT INTO Students (full_name, name_key) VALUES (?, ?)",
+                         [(name, bc.normalize_arabic_name(name)) for name in names])
+        conn.commit()
+    return names
+
+
+def hold_write_lock(seconds):
+    """Simulates a slow writer (e.g. an admin import) that keeps the write lock busy."""
+    with bc.get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        time.sleep(seconds)
+        conn.commit()
+
+
+class FakeTelegramSession(BaseSession):
+    """Answers Bot API calls locally after `latency` seconds and counts them by method.
+
+    Downloads return the local file registered in `files` under the file_id,
+    or a few placeholder bytes.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.files = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is types.Message:
+            chat_id = getattr(method, "chat_id", 0)
+            return types.Message(message_id=next(self._message_ids), date=datetime.now(),
+                                 chat=types.Chat(id=int(chat_id), type="private"), text=getattr(method, "text", None))
+        if method.__returning__ is types.File:
+            path = self.files.get(method.file_id, f"{method.file_id}.jpg")
+            return types.File(file_id=method.file_id, file_unique_id=method.file_id,
+                              file_path=f"files/{os.path.basename(path)}")
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        path = self.files.get(os.path.splitext(url.rsplit("/", 1)[-1])[0])
+        if path is None:
+            yield b"\xff\xd8 fake file content"
+            return
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    async def close(self):
+        pass
+
+
+def message_update(update_id, user_id, text):
+    """A private-chat text message update, as Telegram would POST it."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "طالب"},
+            "text": text,
+        },
+    }
+
+
+def user_json(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "طالب"}
+
+
+def photo_update(update_id, user_id, file_id):
+    update = message_update(update_id, user_id, None)
+    del update["message"]["text"]
+    update["message"]["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]
+    return update
+
+
+def document_update(update_id, user_id, file_id, file_name):
+    update = message_update(update_id, user_id, None)
+    del update["message"]["text"]
+    update["message"]["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name}
+    return update
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user_json(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message_update(update_id, user_id, "")["message"],
+        },
+    }
+
+
+# --- db-latency ---
+
+async def simulated_update(user_id, arrival, mode, names, args, latencies):
+    await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+
+    roll = random.random()
+    if roll < args.slow_ratio:
+        call = (hold_write_lock, args.lock_hold_ms / 1000)
+    elif roll < args.slow_ratio + args.write_ratio:
+        call = (bc.save_student_form, user_id, {"full_name": f"مستخدم جديد {user_id}"})
+    else:
+        call = (bc.search_students, random.choice(names))
+
+    if mode == "inline":
+        call[0](*call[1:])
+    else:
+        await bc.run_db(*call)
+    await asyncio.sleep(args.api_ms / 1000)  # message.answer round trip
+
+    # Measured from the scheduled arrival, so time spent waiting for a blocked loop counts
+    latencies.append(time.perf_counter() - arrival)
+
+
+async def bench_db_latency(args):
+    results = {}
+    for mode in ("inline", "run_db"):
+        random.seed(args.seed)
+        with tempfile.TemporaryDirectory() as directory:
+            use_temp_database(directory)
+            names = seed_students(args.students)
+            latencies = []
+            start = time.perf_counter()
+            arrivals = sorted(start + random.uniform(0, args.ramp) for _ in range(args.users))
+            await asyncio.gather(*(
+                simulated_update(1_000_000 + i, arrival, mode, names, args, latencies)
+                for i, arrival in enumerate(arrivals)
+            ))
+            results[mode] = summarize(latencies)
+            bc.db_pool.close()
+        print(f"{mode:>7}: " + ", ".join(f"{key}={value}" for key, value in results[mode].items()))
+    return results
+
+
+# --- webhook ---
+
+async def post_burst(client, url, secret, updates, accept_latencies):
+    statuses = collections.Counter()
+
+    async def post(update):
+        start = time.perf_counter()
+        async with client.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as response:
+            statuses[response.status] += 1
+        accept_latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(post(update) for update in updates))
+    return statuses
+
+
+async def bench_webhook(args):
+    """Replays bursts of /start -> search -> name conversations through a local webhook server."""
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_database(directory)
+        names = seed_students(args.students)
+        session = FakeTelegramSession(args.api_ms / 1000)
+        bot = Bot(BENCH_TOKEN, session=session)
+        server = bc.WebhookServer(bc.create_dispatcher(bot, throttle_rules=None), bot, secret="bench",
+                                  queue_size=args.queue_size, workers=args.workers)
+        await server.start("127.0.0.1", args.port)
+        url = f"http://127.0.0.1:{args.port}{server.path}"
+
+        update_ids = itertools.count(1)
+        accept_latencies, burst_times, statuses = [], [], collections.Counter()
+        start = time.perf_counter()
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.connections)) as client:
+            for _ in range(args.rounds):
+                for step in ("/start", "البحث عن اسمي", None):
+                    updates = [
+                        message_update(next(update_ids), 1_000_000 + user, step or random.choice(names))
+                        for user in range(args.users)
+                    ]
+                    burst_start = time.perf_counter()
+                    statuses += await post_burst(client, url, "bench", updates, accept_latencies)
+                    await server.queue.join()
+                    burst_times.append(time.perf_counter() - burst_start)
+        elapsed = time.perf_counter() - start
+        await server.stop()
+        await bot.session.close()
+        bc.db_pool.close()
+
+    processed = statuses[200]
+    results = {
+        "updates": sum(statuses.values()),
+        "processed": processed,
+        "rejected_503": statuses[503],
+        "updates_per_second": round(processed / elapsed, 1),
+        "accept": summarize(accept_latencies),
+        "burst": summarize(burst_times),
+        "api_calls": dict(session.calls),
+    }
+    print(f"{processed} updates in {elapsed:.2f}s ({results['updates_per_second']}/s), "
+          f"{statuses[503]} rejected with 503")
+    print("accept: " + ", ".join(f"{key}={value}" for key, value in results["accept"].items()))
+    print(" burst: " + ", ".join(f"{key}={value}" for key, value in results["burst"].items()))
+    return results
+
+
+# --- load ---
+
+# The handler and DB time of the update being processed, set by HandlerTimer
+current_db_time = contextvars.ContextVar("current_db_time", default=None)
+
+
+class HandlerTimer(BaseMiddleware):
+    """Inner middleware recording each handler's latency and the time it spent awaiting run_db()."""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.db_times = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        db_time = [0.0]
+        token = current_db_time.set(db_time)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors[name] += 1
+            raise
+        finally:
+            self.latencies[name].append(time.perf_counter() - start)
+            self.db_times[name].append(db_time[0])
+            current_db_time.reset(token)
+
+
+def timed_run_db(run_db):
+    @functools.wraps(run_db)
+    async def wrapper(func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await run_db(func, *args, **kwargs)
+        finally:
+            db_time = current_db_time.get()
+            if db_time is not None:
+                db_time[0] += time.perf_counter() - start
+    return wrapper
+
+
+def timed_submit(submit, job_times):
+    """Wraps JobManager.submit so the run time of every background job is recorded by function name."""
+    def wrapper(owner_id, description, func, *args, **kwargs):
+        @functools.wraps(func)
+        def timed(*func_args, **func_kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*func_args, **func_kwargs)
+            finally:
+                job_times[func.__name__].append(time.perf_counter() - start)
+        return submit(owner_id, description, timed, *args, **kwargs)
+    return wrapper
+
+
+def write_import_file(path, rows):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(["الاسم الرباعي", "الصف"])
+    for i in range(rows):
+        sheet.append([f"طالب مستورد {os.path.basename(path)} {i}", "الرابع"])
+    workbook.save(path)
+
+
+class LoadTest:
+    """Drives synthetic users through the real dispatcher, one coroutine per user."""
+
+    def __init__(self, args, bot, dp, names):
+        self.args = args
+        self.bot = bot
+        self.dp = dp
+        self.names = names
+        self.update_ids = itertools.count(1)
+        self.student_numbers = iter(random.sample(range(1, 1001), 1000))
+        self.updates = 0
+        self.flows = collections.Counter()
+
+    async def send(self, update):
+        await asyncio.sleep(random.expovariate(1000 / self.args.think_ms) if self.args.think_ms else 0)
+        self.updates += 1
+        await self.dp.feed_update(self.bot, types.Update.model_validate(update, context={"bot": self.bot}))
+
+    async def text(self, user_id, text):
+        await self.send(message_update(next(self.update_ids), user_id, text))
+
+    async def state(self, user_id):
+        return await self.dp.storage.get_state(StorageKey(bot_id=self.bot.id, chat_id=user_id, user_id=user_id))
+
+    async def form_user(self, user_id):
+        await self.text(user_id, "تسجيل طالب جديد")
+        for text in (f"مستخدم تجريبي {user_id}", "2008-03-14", "الرابع", "أ"):
+            await self.text(user_id, text)
+        while await self.state(user_id) in (None, bc.Form.student_number.state):
+            number = next(self.student_numbers, None)
+            if number is None: # Form only accepts numbers 1-1000
+                self.flows["form_abandoned"] += 1
+                return
+            await self.text(user_id, str(number))
+        for text in ("07700000000", "07800000000", "متوسطة المجتبى", "لا يوجد", "حي تجريبي"):
+            await self.text(user_id, text)
+        for kind in ("personal", "student_card", "father_card", "mother_card"):
+            await self.send(photo_update(next(self.update_ids), user_id, f"{kind}-{user_id}"))
+        for text in ("ناجح", "أول", "2024-2025"):
+            await self.text(user_id, text)
+        await self.send(callback_update(next(self.update_ids), user_id, "submit_form"))
+        self.flows["form"] += 1
+
+    async def search_user(self, user_id):
+        await self.text(user_id, "البحث عن اسمي")
+        name = random.choice(self.names)
+        if random.random() < self.args.typo_ratio:
+            name = name.replace("طالب", "طالبب", 1)
+        await self.text(user_id, name)
+        self.flows["search"] += 1
+
+    async def admin_user(self, user_id):
+        await self.text(user_id, "مشرف")
+        await self.text(user_id, bc.ADMIN_PASSWORD)
+        await self.text(user_id, "عرض إحصائيات الطلاب")
+        await self.text(user_id, "تصدير بيانات الطلاب")
+        await self.text(user_id, random.choice(("تصدير CSV", "تصدير Excel")))
+        self.flows["admin"] += 1
+
+    async def import_user(self, user_id, file_id):
+        await self.text(user_id, "رفع ملف بيانات")
+        await self.send(document_update(next(self.update_ids), user_id, file_id, f"{file_id}.xlsx"))
+        self.flows["import"] += 1
+
+    async def user(self, arrival, flow, *args):
+        await asyncio.sleep(arrival)
+        await flow(*args)
+
+
+async def bench_load(args):
+    random.seed(args.seed)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory) # photos/, downloads/ and exports/ are relative to the working directory
+        try:
+            use_temp_database(directory)
+            names = seed_students(args.students)
+            session = FakeTelegramSession(args.api_ms / 1000)
+            bot = Bot(BENCH_TOKEN, session=session)
+            dp = bc.create_dispatcher(bot, throttle_rules=bc.THROTTLE_RULES if args.throttle else None)
+            timer = HandlerTimer()
+            dp.message.middleware(timer)
+            dp.callback_query.middleware(timer)
+            job_times = collections.defaultdict(list)
+            original_run_db, original_submit = bc.run_db, bc.job_manager.submit
+            bc.run_db = timed_run_db(original_run_db)
+            bc.job_manager.submit = timed_submit(original_submit, job_times)
+
+            test = LoadTest(args, bot, dp, names)
+            users = itertools.count(2_000_000)
+            flows = [(test.form_user, next(users)) for _ in range(args.form_users)]
+            flows += [(test.search_user, next(users)) for _ in range(args.search_users)]
+            flows += [(test.admin_user, next(users)) for _ in range(args.admins)]
+            for i in range(args.imports):
+                file_id = f"import-{i}"
+                session.files[file_id] = os.path.join(directory, f"{file_id}.xlsx")
+                write_import_file(session.files[file_id], args.import_rows)
+                flows.append((test.import_user, next(users), file_id))
+            random.shuffle(flows)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(test.user(random.uniform(0, args.ramp), *flow) for flow in flows))
+            handlers_done = time.perf_counter() - start
+            while bc.job_manager.active_jobs():
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - start
+            await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        finally:
+            bc.run_db = original_run_db
+            bc.job_manager.submit = original_submit
+            bc.db_pool.close()
+            os.chdir(cwd)
+
+    results = {
+        "updates": test.updates,
+        "updates_per_second": round(test.updates / handlers_done, 1),
+        "elapsed_s": round(elapsed, 3),
+        "flows": dict(test.flows),
+        "errors": dict(timer.errors),
+        "handlers": {
+            name: {**summarize(samples), "db": summarize(timer.db_times[name])}
+            for name, samples in sorted(timer.latencies.items())
+        },
+        "jobs": {name: summarize(samples) for name, samples in sorted(job_times.items())},
+        "api_calls": dict(session.calls),
+    }
+    print(f"{test.updates} updates in {handlers_done:.2f}s ({results['updates_per_second']}/s), "
+          f"all jobs done after {elapsed:.2f}s; flows: {dict(test.flows)}")
+    print(f"{'handler':<40} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'db p95':>9}")
+    for name, stats in results["handlers"].items():
+        print(f"{name:<40} {stats['count']:>6} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9} "
+              f"{stats['db']['p95_ms']:>9}")
+    for name, stats in results["jobs"].items():
+        print(f"{'job ' + name:<40} {stats['count']:>6} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+    if timer.errors:
+        print(f"handler errors: {dict(timer.errors)}")
+    return results
+
+
+# --- dispatch ---
+
+class MenuStates(StatesGroup):
+    menu = State()
+
+
+async def ignore_update(message: types.Message):
+    pass
+
+
+def menu_dispatcher(handlers, exact_index):
+    """A dispatcher with `handlers` menu-button handlers, half of them tied to a state, plus one catch-all."""
+    dp = Dispatcher(storage=MemoryStorage())
+    if exact_index:
+        bc.use_exact_match_dispatch(dp)
+    for i in range(handlers):
+        filters = (MenuStates.menu, F.text == f"زر {i}") if i % 2 else (F.text == f"زر {i}",)
+        dp.message(*filters)(ignore_update)
+    dp.message(F.photo)(ignore_update) # a handler that still needs its filters run
+    return dp
+
+
+async def time_dispatch(dp, bot, updates):
+    start = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - start) / len(updates)
+
+
+async def bench_dispatch(args):
+    random.seed(args.seed)
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING) # one log line per update would dominate
+    bot = Bot(BENCH_TOKEN, session=FakeTelegramSession())
+    user_id = 1000
+    results = {}
+    print(f"{'handlers':>8} {'chain us':>10} {'indexed us':>11} {'speed-up':>9} {'miss chain':>11} {'miss indexed':>13}")
+    for handlers in args.handlers:
+        hits = [types.Update.model_validate(message_update(i, user_id, f"زر {random.randrange(handlers)}"),
+                                            context={"bot": bot}) for i in range(args.updates)]
+        misses = [types.Update.model_validate(message_update(i, user_id, "نص حر"), context={"bot": bot})
+                  for i in range(args.updates)]
+        row = {}
+        for name, exact_index in (("chain", False), ("indexed", True)):
+            dp = menu_dispatcher(handlers, exact_index)
+            await dp.storage.set_state(StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id), MenuStates.menu)
+            await time_dispatch(dp, bot, hits[:100]) # warm up
+            row[f"{name}_us"] = round(await time_dispatch(dp, bot, hits) * 1e6, 1)
+            row[f"{name}_miss_us"] = round(await time_dispatch(dp, bot, misses) * 1e6, 1)
+        results[handlers] = row
+        print(f"{handlers:>8} {row['chain_us']:>10} {row['indexed_us']:>11} {row['chain_us'] / row['indexed_us']:>8.1f}x "
+              f"{row['chain_miss_us']:>11} {row['indexed_miss_us']:>13}")
+    return results
+
+
+# --- merge ---
+
+ROSTER_GRADES = ("الرابع", "الخامس", "السادس")
+
+
+def write_roster_file(path, students):
+    """Writes a full roster sheet, headed like the registration form, for merge_excel_file()."""
+    columns = ("full_name", "student_number", "grade", "section", "phone_number", "dob", "academic_year")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([bc.MERGE_COLUMNS[column] for column in columns])
+    for i in range(students):
+        sheet.append([f"طالب القائمة رقم {i}", i + 1, random.choice(ROSTER_GRADES), random.choice("أبجد"),
+                      f"0770{i:07d}", f"{random.randint(2005, 2010)}-0{random.randint(1, 9)}-1{random.randint(0, 9)}",
+                      "2024-2025"])
+    workbook.save(path)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_merge(args):
+    """Times reading a roster, merging it into an empty table, re-merging it unchanged, and merging small edits."""
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_database(directory)
+        path = os.path.join(directory, "roster.xlsx")
+        write_roster_file(path, args.students)
+
+        read_times = []
+        for _ in range(args.rounds):
+            elapsed, records = timed(lambda: [chunk for chunk in bc.iter_excel_records(path)])
+            read_times.append(elapsed)
+        rows = [row for chunk in records for row in chunk]
+
+        insert_time, report = timed(bc.merge_student_rows, records)
+        print(f"first merge: {insert_time:.2f}s ({report.inserted} inserted)")
+        unchanged_times, changed_times = [], []
+        for round_number in range(args.rounds):
+            elapsed, report = timed(bc.merge_student_rows, records)
+            unchanged_times.append(elapsed)
+            assert report.unchanged == len(rows), report.summary()
+
+            edited = [(number, dict(cells)) for number, cells in rows]
+            for _, cells in random.sample(edited, int(len(edited) * args.change_ratio)):
+                cells["grade"] = f"{random.choice(ROSTER_GRADES)} {round_number}"
+            elapsed, report = timed(bc.merge_student_rows, [edited])
+            changed_times.append(elapsed)
+            records = [edited]
+            rows = edited
+
+    results = {
+        "read": summarize(read_times),
+        "insert": summarize([insert_time]),
+        "unchanged": summarize(unchanged_times),
+        "changed": summarize(changed_times),
+    }
+    print(f"{'phase':<10} {'p50 ms':>10} {'max ms':>10}")
+    for phase, summary in results.items():
+        print(f"{phase:<10} {summary['p50_ms']:>10} {summary['max_ms']:>10}")
+    return results
+
+
+# --- compare ---
+
+def flatten_latencies(results, prefix=""):
+    """Maps "path.p95_ms" style names to values for every latency percentile in a results tree."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_latencies(value, f"{name}."))
+        elif key in ("p50_ms", "p95_ms", "p99_ms", "updates_per_second"):
+            flat[name] = value
+    return flat
+
+
+def compare_results(before_path, after_path, threshold):
+    """Prints every percentile of two result files side by side; returns the names that regressed."""
+    with open(before_path, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)
+    if before.get("command") != after.get("command"):
+        raise SystemExit(f"can't compare a {before.get('command')} run with a {after.get('command')} run")
+
+    before, after = flatten_latencies(before["results"]), flatten_latencies(after["results"])
+    regressions = []
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if name.endswith("updates_per_second") else change
+        regressed = worse > threshold and not name.endswith("p50_ms")
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<60} {old:>10} {new:>10} {change:>+8.1f}%{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--seed", type=int, default=1)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    db_latency = commands.add_parser("db-latency", help="handler latency with inline sqlite3 vs. run_db()")
+    db_latency.add_argument("--users", type=int, default=500, help="concurrent simulated users")
+    db_latency.add_argument("--students", type=int, default=20000, help="rows seeded into Students")
+    db_latency.add_argument("--ramp", type=float, default=1.0, help="seconds over which the users arrive")
+    db_latency.add_argument("--write-ratio", type=float, default=0.05, help="share of form submissions")
+    db_latency.add_argument("--slow-ratio", type=float, default=0.01, help="share of slow writers holding the lock")
+    db_latency.add_argument("--lock-hold-ms", type=float, default=50.0)
+    db_latency.add_argument("--api-ms", type=float, default=5.0, help="simulated Bot API round trip")
+
+    webhook = commands.add_parser("webhook", help="update throughput of the webhook server against a fake Telegram")
+    webhook.add_argument("--users", type=int, default=1000, help="simulated users, one update each per burst")
+    webhook.add_argument("--rounds", type=int, default=3, help="times each user repeats /start -> search -> name")
+    webhook.add_argument("--students", type=int, default=20000, help="rows seeded into Students")
+    webhook.add_argument("--workers", type=int, default=bc.WEBHOOK_WORKERS)
+    webhook.add_argument("--queue-size", type=int, default=bc.WEBHOOK_QUEUE_SIZE)
+    webhook.add_argument("--connections", type=int, default=100, help="concurrent HTTP connections, like max_connections")
+    webhook.add_argument("--api-ms", type=float, default=5.0, help="simulated Bot API round trip")
+    webhook.add_argument("--port", type=int, default=18080)
+
+    load = commands.add_parser("load", help="synthetic users through the full dispatcher with a fake Telegram")
+    load.add_argument("--form-users", type=int, default=1000, help="users filling the whole registration form")
+    load.add_argument("--search-users", type=int, default=1000, help="users searching for their name")
+    load.add_argument("--admins", type=int, default=5, help="admins viewing statistics and exporting")
+    load.add_argument("--imports", type=int, default=2, help="Excel files uploaded for import")
+    load.add_argument("--import-rows", type=int, default=5000)
+    load.add_argument("--students", type=int, default=20000, help="rows seeded into Students")
+    load.add_argument("--typo-ratio", type=float, default=0.2, help="share of searches with a misspelled name")
+    load.add_argument("--ramp", type=float, default=10.0, help="seconds over which the users arrive")
+    load.add_argument("--think-ms", type=float, default=20.0, help="mean pause before each update of a user")
+    load.add_argument("--api-ms", type=float, default=5.0, help="simulated Bot API round trip")
+    load.add_argument("--throttle", action="store_true",
+                      help="keep the inbound throttling rules (off by default: users here type far faster than people)")
+
+    dispatch = commands.add_parser("dispatch", help="per-update routing cost as the number of menu handlers grows")
+    dispatch.add_argument("--handlers", type=int, nargs="+", default=[10, 25, 50, 100, 200])
+    dispatch.add_argument("--updates", type=int, default=300, help="updates fed per handler count and variant")
+
+    merge = commands.add_parser("merge", help="roster merge import: reading, first import, unchanged and edited re-imports")
+    merge.add_argument("--students", type=int, default=20000, help="rows in the roster file")
+    merge.add_argument("--rounds", type=int, default=3, help="re-imports timed per phase")
+    merge.add_argument("--change-ratio", type=float, default=0.01, help="share of rows edited before each edited re-import")
+
+    compare = commands.add_parser("compare", help="compare two --output files of the same benchmark")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.add_argument("--threshold", type=float, default=10.0,
+                         help="percent change in a p95/p99 (or drop in throughput) reported as a regression")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(1 if compare_results(args.before, args.after, args.threshold) else 0)
+    if args.command == "db-latency":
+        results = asyncio.run(bench_db_latency(args))
+    elif args.command == "webhook":
+        results = asyncio.run(bench_webhook(args))
+    elif args.command == "load":
+        results = asyncio.run(bench_load(args))
+    elif args.command == "dispatch":
+        results = asyncio.run(bench_dispatch(args))
+    elif args.command == "merge":
+        results = bench_merge(args)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"command": args.command, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,60 @@
 import os
+import queue
+import asyncio
+import bisect
 import logging
+import math
+import operator
+import multiprocessing
+import re
+import csv
+import difflib
 import sqlite3
+import tempfile
+import zipfile
+import functools
+import hashlib
+import hmac
+import inspect
+import itertools
+import json
+import secrets
+import shutil
+import signal
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime
+from xml.etree import ElementTree
+from aiohttp import web
 from openpyxl import load_workbook, Workbook
-
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart
+try:
+    from PIL import Image
+except ImportError: # thumbnails are skipped without Pillow
+    Image = None
+
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
+from aiogram.exceptions import (
+    DataNotDictLikeError, TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED, SkipHandler
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.dispatcher.flags import get_flag
+from aiogram.dispatcher.router import Router
+from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from magic_filter import MagicFilter
+from magic_filter.operations import ComparatorOperation, FunctionOperation, GetAttributeOperation
+from magic_filter.util import in_op
 
 # --- bot_states.py content ---
 class Form(StatesGroup):
@@ -33,6 +80,7 @@ class Form(StatesGroup):
 
 class Search(StatesGroup):
     search_name = State()
+    pick = State() # choosing among the offered candidates, whose ids are kept in the FSM data
 
 class AdmissionForm(StatesGroup):
     full_name = State()
@@ -66,284 +114,3654 @@ class Admin(StatesGroup):
     add_admin_id = State()
     remove_admin_id = State()
     allow_deny_student_data_view = State()
+    export_options = State()
+    toggle_view_data_name = State()
+    supervisor_management = State()
+    add_supervisor_telegram_id = State()
+    add_supervisor_username = State()
+    add_supervisor_full_name = State()
+    add_supervisor_password = State()
+    remove_supervisor_telegram_id = State()
 
 # --- End bot_states.py content ---
 
-# --- utils.py content ---
-# Database connection (redefined here for combined file)
-def get_db_connection():
-    conn = sqlite3.connect("students_data.db")
-    conn.row_factory = sqlite3.Row
-    return conn
-
-async def download_photo(file_id: str, destination_folder: str, bot: Bot) -> str:
-    """Downloads a photo from Telegram and saves it to a specified folder."""
-    if not os.path.exists(destination_folder):
-        os.makedirs(destination_folder)
-
-    file_info = await bot.get_file(file_id)
-    file_path = file_info.file_path
-    
-    file_extension = file_path.split(".")[-1]
-    destination_path = os.path.join(destination_folder, f"{file_id}.{file_extension}")
-
-    await bot.download_file(file_path, destination_path)
-    return destination_path
-
-def process_excel_file(file_path: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    workbook = load_workbook(file_path)
-    sheet = workbook.active
-
-    # Assuming the first column contains full names
-    for row in sheet.iter_rows(min_row=1, values_only=True):
-        full_name = row[0] # Assuming full name is in the first column
-        if not full_name:
-            continue
+# --- metrics.py content ---
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # 0 disables the /metrics endpoint
+METRICS_FILE = os.getenv("METRICS_FILE") # when set, the metrics are also written here periodically
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "60"))
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_QUERY_LABEL_LIMIT = int(os.getenv("DB_QUERY_LABEL_LIMIT", "200")) # statements beyond this share the "other" label
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricsRegistry:
+    """Counters and latency histograms kept in memory and rendered in the Prometheus text format.
+
+    Labels are passed as a tuple of (name, value) pairs. Safe to update from
+    the DB and job threads. Counters kept elsewhere (e.g. by the caches) are
+    read at render time through the functions given to add_collector().
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._descriptions = {} # name -> (type, help)
+        self._counters = {} # (name, labels) -> value
+        self._histograms = {} # (name, labels) -> [count per bucket..., count above the last bucket, sum]
+        self._collectors = [] # functions returning [(name, labels, value)] counters
+
+    def add_collector(self, collector) -> None:
+        self._collectors.append(collector)
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._descriptions[name] = (kind, help_text)
+
+    def inc(self, name: str, labels: tuple = (), amount: float = 1) -> None:
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        key = (name, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def render(self) -> str:
+        collected = [((name, labels), value) for collector in self._collectors for name, labels, value in collector()]
+        with self._lock:
+            counters = sorted([*self._counters.items(), *collected])
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+
+        lines, described = [], set()
+
+        def header(name):
+            if name not in described and name in self._descriptions:
+                described.add(name)
+                kind, help_text = self._descriptions[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), values in histograms:
+            header(name)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-1]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+metrics = MetricsRegistry()
+metrics.describe("bot_handler_seconds", "histogram", "Time spent in each handler")
+metrics.describe("bot_handler_errors_total", "counter", "Exceptions raised by each handler")
+metrics.describe("bot_fsm_transitions_total", "counter", "FSM state changes made by handlers")
+metrics.describe("bot_db_query_seconds", "histogram", "Time to execute each SQL statement (up to its first row)")
+metrics.describe("bot_db_fetch_seconds_total", "counter", "Time spent fetching the remaining rows of each SQL statement")
+metrics.describe("bot_db_rows_total", "counter", "Rows returned or changed by each SQL statement")
+metrics.describe("bot_db_slow_queries_total", "counter", "SQL statements slower than DB_SLOW_QUERY_MS")
+metrics.describe("bot_cache_hits_total", "counter", "Lookups answered from each in-memory cache")
+metrics.describe("bot_cache_misses_total", "counter", "Lookups that had to load each cache from the database")
+metrics.describe("bot_cache_invalidations_total", "counter", "Times each cache was invalidated")
+
+PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_query_labels = set()
+_query_labels_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1024)
+def query_label(sql: str) -> str:
+    """The statement's metric label: its text with `IN (?, ?, ...)` lists folded, so the label set stays bounded.
+
+    Once DB_QUERY_LABEL_LIMIT distinct labels exist, further statements are
+    counted under "other" rather than growing the exported series.
+    """
+    label = PLACEHOLDER_LIST.sub("?, ...", " ".join(sql.split()))[:160]
+    with _query_labels_lock:
+        if label not in _query_labels:
+            if len(_query_labels) >= DB_QUERY_LABEL_LIMIT:
+                return "other"
+            _query_labels.add(label)
+    return label
+
+def record_query(sql: str, elapsed: float, rows: int) -> None:
+    label = (("query", query_label(sql)),)
+    metrics.observe("bot_db_query_seconds", label, elapsed)
+    if rows > 0:
+        metrics.inc("bot_db_rows_total", label, rows)
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        metrics.inc("bot_db_slow_queries_total", label)
+        logging.warning("Slow query (%.1f ms, %d rows): %s", elapsed * 1000, max(rows, 0), " ".join(sql.split())[:500])
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times every statement and counts the rows it changes or returns."""
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(sql, time.perf_counter() - start, self.rowcount)
 
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(sql, time.perf_counter() - start, self.rowcount)
+
+    def _record_fetch(self, start: float, rows: int) -> None:
+        if self._sql is not None:
+            label = (("query", query_label(self._sql)),)
+            metrics.inc("bot_db_fetch_seconds_total", label, time.perf_counter() - start)
+            if rows:
+                metrics.inc("bot_db_rows_total", label, rows)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._record_fetch(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._record_fetch(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._record_fetch(start, len(rows))
+        return rows
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors (including conn.execute()) report to `metrics`."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class MetricsMiddleware(BaseMiddleware):
+    """Inner middleware recording each handler's latency, errors and the FSM transition it made."""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        start = time.perf_counter()
         try:
-            # Check if student already exists by full_name
-            cursor.execute("SELECT * FROM Students WHERE full_name = ?", (full_name,))
-            existing_student = cursor.fetchone()
+            result = await handler(event, data)
+        except Exception as e:
+            metrics.inc("bot_handler_errors_total", (("handler", name), ("error", type(e).__name__)))
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", (("handler", name),), time.perf_counter() - start)
+        state = data.get("state")
+        if state is not None:
+            new_state = await state.get_state()
+            old_state = data.get("raw_state")
+            if new_state != old_state:
+                metrics.inc("bot_fsm_transitions_total", (("from", old_state or "none"), ("to", new_state or "none")))
+        return result
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> web.AppRunner:
+    """Serves GET /metrics for Prometheus; returns the runner to clean up on shutdown."""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Metrics available at http://%s:%d/metrics", host, port)
+    return runner
+
+def dump_metrics(path: str) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(metrics.render())
+    os.replace(temp_path, path)
+
+async def dump_metrics_periodically(path: str = METRICS_FILE, interval: float = METRICS_DUMP_INTERVAL) -> None:
+    """Rewrites `path` with the current metrics every `interval` seconds, and once more when cancelled."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            dump_metrics(path)
+    finally:
+        dump_metrics(path)
+
+async def start_metrics_exporters(port: int = METRICS_PORT, path: str = METRICS_FILE):
+    """Starts whichever of the /metrics endpoint and the dump file are configured; returns a coroutine function stopping them."""
+    runner = await start_metrics_server(port) if port else None
+    dump = asyncio.ensure_future(dump_metrics_periodically(path)) if path else None
+
+    async def stop():
+        if dump is not None:
+            dump.cancel()
+            await asyncio.gather(dump, return_exceptions=True)
+        if runner is not None:
+            await runner.cleanup()
+    return stop
+# --- End metrics.py content ---
+
+# --- throttling.py content ---
+# Inbound limits, per handler flag: name -> (tokens per second, burst, per user).
+# Every update also spends a token of "default". Handlers opt into more with
+# flags={"throttle": "name"} or a tuple of names.
+THROTTLE_RULES = {
+    "default": (2.0, 10, True),
+    "search": (0.5, 5, True),
+    "upload": (1 / 60, 3, True),
+    "upload_all": (0.2, 5, False), # file downloads and imports across all users
+    "contact": (1 / 60, 2, True),
+    "export": (1 / 30, 2, True),
+    "login": (1 / 60, 5, True),
+}
+THROTTLE_MAX_BUCKETS = 10000 # full buckets are dropped beyond this many
+# Outbound Bot API limits published by Telegram
+TELEGRAM_GLOBAL_RATE = 30.0 # messages per second overall
+TELEGRAM_CHAT_RATE = 1.0 # messages per second to one private chat
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_GROUP_RATE = 20 / 60 # messages per second to one group
+TELEGRAM_RETRY_AFTER_ATTEMPTS = 3
+# Bot API methods that post or change a message, which is what Telegram's limits count
+TELEGRAM_LIMITED_METHODS = frozenset({
+    "sendMessage", "sendPhoto", "sendDocument", "sendVideo", "sendAudio", "sendVoice", "sendAnimation",
+    "sendSticker", "sendVideoNote", "sendMediaGroup", "sendLocation", "sendVenue", "sendContact", "sendPoll",
+    "sendDice", "sendInvoice", "copyMessage", "copyMessages", "forwardMessage", "forwardMessages",
+    "editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup", "editMessageLiveLocation",
+})
+
+class TokenBucket:
+    """Allows `rate` events per second on average, with bursts of up to `capacity`."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def try_take(self) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is available without taking it."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        """Takes a token even if that puts the bucket in debt; returns how long to wait before using it."""
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def block(self, seconds: float) -> None:
+        """Makes the next reservation wait at least `seconds`."""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+class _BucketMap(dict):
+    """Buckets by key, forgetting full (idle) ones once there are more than `limit`."""
+
+    def __init__(self, limit: int = THROTTLE_MAX_BUCKETS):
+        super().__init__()
+        self.limit = limit
+
+    def get_or_create(self, key, rate: float, capacity: float) -> TokenBucket:
+        bucket = self.get(key)
+        if bucket is None:
+            if len(self) >= self.limit:
+                for idle_key in [k for k, b in self.items() if b.is_full()]:
+                    del self[idle_key]
+                self.limit = max(self.limit, 2 * len(self))
+            bucket = self[key] = TokenBucket(rate, capacity)
+        return bucket
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Drops updates from users who exceed the "default" rule or a rule named in the handler's throttle flag.
+
+    The user is told once how long to wait; further updates in that stretch
+    are dropped silently. Users in `exempt_ids` are never throttled.
+    """
+
+    def __init__(self, rules: dict = THROTTLE_RULES, exempt_ids=()):
+        self.rules = rules
+        self.exempt_ids = set(exempt_ids)
+        self._buckets = _BucketMap()
+        self._warned_until = {} # user id -> monotonic time
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id in self.exempt_ids:
+            return await handler(event, data)
+
+        names = get_flag(data, "throttle", default=())
+        for name in ("default",) + ((names,) if isinstance(names, str) else tuple(names)):
+            rate, burst, per_user = self.rules[name]
+            wait = self._buckets.get_or_create((name, user.id if per_user else None), rate, burst).try_take()
+            if wait:
+                metrics.inc("bot_throttled_total", (("rule", name),))
+                await self._warn(event, user.id, wait)
+                return None
+        return await handler(event, data)
+
+    async def _warn(self, event, user_id: int, wait: float) -> None:
+        now = time.monotonic()
+        if self._warned_until.get(user_id, 0) > now:
+            return
+        if len(self._warned_until) >= THROTTLE_MAX_BUCKETS:
+            self._warned_until = {uid: until for uid, until in self._warned_until.items() if until > now}
+        self._warned_until[user_id] = now + wait
+        text = f"لقد أرسلت طلبات كثيرة. يرجى المحاولة بعد {math.ceil(wait)} ثانية."
+        if isinstance(event, types.CallbackQuery):
+            await event.answer(text)
+        elif isinstance(event, types.Message):
+            await event.answer(text)
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """Bot API request middleware that keeps sends under Telegram's global and per-chat limits.
+
+    Only the message methods in TELEGRAM_LIMITED_METHODS are limited;
+    getFile, answerCallbackQuery, sendChatAction and the like go straight through.
+    Message requests wait for a token of the global bucket and of their
+    chat's bucket. A RetryAfter from Telegram blocks the chat (or, for
+    requests without a chat, every message) for the requested time and the
+    request is queued again, up to `retries` times.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 chat_burst: float = TELEGRAM_CHAT_BURST, group_rate: float = TELEGRAM_GROUP_RATE,
+                 retries: int = TELEGRAM_RETRY_AFTER_ATTEMPTS):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.retries = retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = _BucketMap()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        if isinstance(chat_id, int) and chat_id > 0:
+            return self._chats.get_or_create(chat_id, self.chat_rate, self.chat_burst)
+        return self._chats.get_or_create(chat_id, self.group_rate, self.chat_burst) # groups and channels
+
+    async def __call__(self, make_request, bot, method):
+        if method.__api_method__ not in TELEGRAM_LIMITED_METHODS:
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        for attempt in range(self.retries + 1):
+            delay = self._global.reserve()
+            if chat_id is not None:
+                delay = max(delay, self._chat_bucket(chat_id).reserve())
+            if delay:
+                metrics.observe("bot_outbound_wait_seconds", (), delay)
+                await asyncio.sleep(delay)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                logging.warning("Telegram asked to retry %s after %d seconds", type(method).__name__, e.retry_after)
+                metrics.inc("bot_outbound_retry_after_total")
+                (self._chat_bucket(chat_id) if chat_id is not None else self._global).block(e.retry_after)
+
+metrics.describe("bot_throttled_total", "counter", "Updates dropped by a throttling rule")
+metrics.describe("bot_outbound_wait_seconds", "histogram", "Time Bot API requests waited for the outbound rate limit")
+metrics.describe("bot_outbound_retry_after_total", "counter", "RetryAfter answers from Telegram that were retried")
+# --- End throttling.py content ---
+
+# --- db_pool.py content ---
+DB_PATH = os.getenv("DB_PATH", "students_data.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "30"))
+
+# Applied to every pooled connection once, when it is opened
+DB_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("mmap_size", 268435456),  # 256 MiB
+    ("cache_size", -16000),  # ~16 MiB of page cache
+    ("temp_store", "MEMORY"),
+)
+
+class ConnectionPool:
+    """A fixed-size pool of long-lived SQLite connections.
+
+    Connections are opened lazily, up to `size`, and handed out through the
+    `connection()` context manager. Any transaction left open by a caller is
+    rolled back before the connection goes back to the pool.
+    """
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE, pragmas=DB_PRAGMAS, timeout: float = DB_TIMEOUT):
+        if size < 1:
+            raise ValueError("Connection pool size must be at least 1")
+        self.db_path = db_path
+        self.size = size
+        self.pragmas = pragmas
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                               factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
 
-            if existing_student:
-                print(f"Student {full_name} already exists. Skipping insertion.")
-                continue
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection became free within {self.timeout} seconds") from None
 
-            # Insert only full_name initially, other fields will be null
-            cursor.execute("INSERT INTO Students (full_name) VALUES (?) ", (full_name,))
-            conn.commit()
-        except Exception as e:
-            print(f"Error inserting row: {full_name} - {e}")
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
             conn.rollback()
-    conn.close()
-
-def process_word_file(file_path: str):
-    doc = Document(file_path)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    for para in doc.paragraphs:
-        full_name = para.text.strip()
-        if not full_name:
-            continue
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
         try:
-            # Check if student already exists by full_name
-            cursor.execute("SELECT * FROM Students WHERE full_name = ?", (full_name,))
-            existing_student = cursor.fetchone()
+            yield conn
+        finally:
+            self.release(conn)
 
-            if existing_student:
-                print(f"Student {full_name} already exists. Skipping insertion.")
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+db_pool = ConnectionPool(DB_PATH)
+
+def get_db_connection():
+    """Checks a connection out of the shared pool: `with get_db_connection() as conn:`."""
+    return db_pool.connection()
+# --- End db_pool.py content ---
+
+# --- search.py content ---
+SEARCH_RESULT_LIMIT = 5
+SEARCH_CANDIDATE_LIMIT = 50
+
+_ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]") # harakat and tatweel
+_ARABIC_LETTER_VARIANTS = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ة": "ه",
+    "ى": "ي", "ئ": "ي",
+    "ؤ": "و",
+})
+
+def normalize_arabic_name(name: str) -> str:
+    """Builds the search key for a name: no diacritics or tatweel, one spelling for hamza/alef,
+    taa marbuta and alef maqsura variants, "عبد ال..." joined, and single spaces."""
+    if not name:
+        return ""
+    key = _ARABIC_DIACRITICS.sub("", name).translate(_ARABIC_LETTER_VARIANTS).lower()
+    key = re.sub(r"\s+", " ", key).strip()
+    return re.sub(r"\bعبد ال", "عبدال", key)
+
+def ensure_search_schema(cursor):
+    """Adds Students.name_key with its B-tree index, and the trigram FTS5 index kept in sync by triggers."""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(Students)")}
+    if "name_key" not in columns:
+        cursor.execute("ALTER TABLE Students ADD COLUMN name_key TEXT")
+    # (name_key, telegram_id) also serves submit_form's "same name, not yet claimed" lookup
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_name_key_telegram_id ON Students(name_key, telegram_id)")
+
+    missing = cursor.execute("SELECT id, full_name FROM Students WHERE name_key IS NULL").fetchall()
+    cursor.executemany("UPDATE Students SET name_key = ? WHERE id = ?",
+                       [(normalize_arabic_name(full_name), student_id) for student_id, full_name in missing])
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Students_fts'")
+    if cursor.fetchone():
+        return
+    cursor.execute("""
+        CREATE VIRTUAL TABLE Students_fts USING fts5(
+            name_key, content='Students', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS students_fts_insert AFTER INSERT ON Students BEGIN
+            INSERT INTO Students_fts (rowid, name_key) VALUES (new.id, new.name_key);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS students_fts_delete AFTER DELETE ON Students BEGIN
+            INSERT INTO Students_fts (Students_fts, rowid, name_key) VALUES ('delete', old.id, old.name_key);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS students_fts_update AFTER UPDATE OF name_key ON Students BEGIN
+            INSERT INTO Students_fts (Students_fts, rowid, name_key) VALUES ('delete', old.id, old.name_key);
+            INSERT INTO Students_fts (rowid, name_key) VALUES (new.id, new.name_key);
+        END
+    """)
+    cursor.execute("INSERT INTO Students_fts (Students_fts) VALUES ('rebuild')")
+
+def search_students(query: str, limit: int = SEARCH_RESULT_LIMIT) -> list:
+    """Returns up to `limit` students whose name matches `query`, best match first.
+
+    An exact match on the normalised name key is answered from its B-tree
+    index. Otherwise the trigram index is asked for names containing every
+    word of the query, then any of them, and the candidates are ranked by
+    similarity to the query.
+    """
+    name_key = normalize_arabic_name(query)
+    if not name_key:
+        return []
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT id, full_name, name_key FROM Students WHERE name_key = ? LIMIT ?",
+                            (name_key, limit)).fetchall()
+        if rows:
+            return [dict(row) for row in rows]
+
+        # The trigram tokenizer can't match fragments shorter than three characters
+        words = ['"' + word.replace('"', '""') + '"' for word in name_key.split() if len(word) >= 3]
+        if not words:
+            return []
+        for match in (" AND ".join(words), " OR ".join(words)):
+            rows = conn.execute("""
+                SELECT s.id, s.full_name, s.name_key FROM Students_fts
+                JOIN Students s ON s.id = Students_fts.rowid
+                WHERE Students_fts MATCH ? ORDER BY rank LIMIT ?
+            """, (match, SEARCH_CANDIDATE_LIMIT)).fetchall()
+            if rows:
+                break
+
+    rows.sort(key=lambda row: difflib.SequenceMatcher(None, name_key, row["name_key"]).ratio(), reverse=True)
+    return [dict(row) for row in rows[:limit]]
+
+def search_results_keyboard(candidates: list, callback_prefix: str) -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup(
+        inline_keyboard=[
+            [types.InlineKeyboardButton(text=candidate["full_name"], callback_data=f"{callback_prefix}{candidate['id']}")]
+            for candidate in candidates
+        ]
+    )
+# --- End search.py content ---
+
+# --- photo_store.py content ---
+PHOTO_STORE_DIR = os.getenv("PHOTO_STORE_DIR", "photos/store")
+PHOTO_THUMBNAIL_DIR = os.getenv("PHOTO_THUMBNAIL_DIR", "photos/thumbnails")
+PHOTO_THUMBNAIL_SIZE = 320 # pixels, longest side
+PHOTO_THUMBNAIL_QUALITY = 70
+PHOTO_GC_INTERVAL = float(os.getenv("PHOTO_GC_INTERVAL", str(24 * 3600)))
+PHOTO_GC_GRACE_DAYS = 7 # an unreferenced photo may still sit in an unfinished form for this long
+PHOTO_TABLES = ("Students", "Admission_Requests")
+PHOTO_COLUMNS = ("personal_photo_path", "student_card_photo_path", "father_card_photo_path", "mother_card_photo_path")
+_thumbnail_failures = set() # digests make_thumbnail() couldn't read, so place_photo() doesn't try them again
+
+def photo_store_path(digest: str, extension: str = ".jpg", root: str = PHOTO_STORE_DIR) -> str:
+    """Photos are sharded two levels deep by their SHA-256 so no directory grows past 256 entries."""
+    return os.path.join(root, digest[:2], digest[2:4], f"{digest}{extension}")
+
+def photo_thumbnail_path(digest: str) -> str:
+    return photo_store_path(digest, ".jpg", PHOTO_THUMBNAIL_DIR)
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_thumbnail(source: str, destination: str) -> bool:
+    """Writes a small JPEG of the photo for admin review. Returns False if Pillow is missing or the file isn't an image."""
+    if Image is None:
+        return False
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    temp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with Image.open(source) as image:
+            image.thumbnail((PHOTO_THUMBNAIL_SIZE, PHOTO_THUMBNAIL_SIZE))
+            image.convert("RGB").save(temp_path, "JPEG", quality=PHOTO_THUMBNAIL_QUALITY, optimize=True)
+        os.replace(temp_path, destination)
+        return True
+    except OSError as e:
+        logging.warning("No thumbnail for %s: %s", source, e)
+        return False
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def place_photo(temp_path: str, digest: str, extension: str) -> str:
+    """Moves a downloaded file to its place in the store, or drops it if the same content is already there."""
+    path = photo_store_path(digest, extension)
+    if os.path.exists(path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+    thumbnail = photo_thumbnail_path(digest)
+    if digest not in _thumbnail_failures and not os.path.exists(thumbnail):
+        if not make_thumbnail(path, thumbnail):
+            _thumbnail_failures.add(digest)
+    return path
+
+def register_photo(digest: str, path: str, size: int) -> None:
+    """Records a stored photo, or marks it as just used again so the garbage collector leaves it alone."""
+    with get_db_connection() as conn:
+        conn.execute("""
+            INSERT INTO Photos (digest, path, size) VALUES (?, ?, ?)
+            ON CONFLICT(digest) DO UPDATE SET touched_at = CURRENT_TIMESTAMP
+        """, (digest, path, size))
+        conn.commit()
+
+def touch_stored_photo(path: str) -> bool:
+    """Re-registers a photo that is still in the store, so it counts as just used. False if it is gone."""
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return False
+    register_photo(os.path.splitext(os.path.basename(path))[0], path, size)
+    return True
+
+def get_photo_thumbnail(path: str) -> str:
+    """The thumbnail of a stored photo if there is one, else the photo itself."""
+    digest = os.path.splitext(os.path.basename(path))[0]
+    thumbnail = photo_thumbnail_path(digest)
+    return thumbnail if os.path.exists(thumbnail) else path
+
+def _photo_refcount_sql(row: str, sign: str, changed_only: bool = False) -> str:
+    statements = []
+    for column in PHOTO_COLUMNS:
+        condition = f"path = {row}.{column}"
+        if changed_only:
+            condition += f" AND OLD.{column} IS NOT NEW.{column}"
+        statements.append(f"UPDATE Photos SET refcount = refcount {sign} 1, touched_at = CURRENT_TIMESTAMP "
+                          f"WHERE {condition};")
+    return " ".join(statements)
+
+def ensure_photo_store_schema(cursor):
+    """Creates Photos, moves the photos the tables point at into the store and adds the reference-counting triggers.
+
+    Photos has one row per distinct file. refcount is the number of photo
+    columns in Students and Admission_Requests that hold its path; the
+    triggers keep it current, and collect_photo_garbage() removes files that
+    stayed at zero past the grace period.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Photos (
+            digest TEXT PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            touched_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_photos_unreferenced ON Photos(touched_at) WHERE refcount <= 0")
+
+    # Photos saved per folder before the store existed: hash each once and point every row at the stored copy
+    moved, refcounts = {}, {}
+    for table in PHOTO_TABLES:
+        for row in cursor.execute(f"SELECT id, {', '.join(PHOTO_COLUMNS)} FROM {table}").fetchall():
+            changes = {}
+            for column in PHOTO_COLUMNS:
+                old_path = row[column]
+                if not old_path:
+                    continue
+                if old_path not in moved:
+                    moved[old_path] = None
+                    if os.path.exists(old_path):
+                        digest = hash_file(old_path)
+                        new_path = photo_store_path(digest, os.path.splitext(old_path)[1] or ".jpg")
+                        size = os.path.getsize(old_path)
+                        if not os.path.exists(new_path):
+                            # Linked, not moved: a failed migration is rolled back and the rows still point here
+                            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                            try:
+                                os.link(old_path, new_path)
+                            except OSError:
+                                shutil.copy2(old_path, new_path)
+                        cursor.execute("INSERT OR IGNORE INTO Photos (digest, path, size) VALUES (?, ?, ?)",
+                                       (digest, new_path, size))
+                        moved[old_path] = new_path
+                new_path = moved[old_path]
+                if new_path:
+                    changes[column] = new_path
+                    refcounts[new_path] = refcounts.get(new_path, 0) + 1
+            if changes:
+                assignments = ", ".join(f"{column} = ?" for column in changes)
+                cursor.execute(f"UPDATE {table} SET {assignments} WHERE id = ?", (*changes.values(), row["id"]))
+    cursor.executemany("UPDATE Photos SET refcount = ? WHERE path = ?",
+                       [(count, path) for path, count in refcounts.items()])
+    if moved:
+        logging.info("Copied %d photos into %s; the old per-type photo folders can be deleted", len(moved), PHOTO_STORE_DIR)
+
+    for table in PHOTO_TABLES:
+        name = table.lower()
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_photos_insert AFTER INSERT ON {table}
+            BEGIN {_photo_refcount_sql("NEW", "+")} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_photos_delete AFTER DELETE ON {table}
+            BEGIN {_photo_refcount_sql("OLD", "-")} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_photos_update AFTER UPDATE OF {", ".join(PHOTO_COLUMNS)} ON {table}
+            BEGIN {_photo_refcount_sql("OLD", "-", True)} {_photo_refcount_sql("NEW", "+", True)} END
+        """)
+
+def collect_photo_garbage(grace_days: int = PHOTO_GC_GRACE_DAYS) -> tuple:
+    """Deletes photos no row has referenced for `grace_days`, and files the store doesn't know about.
+
+    Files are removed inside the write transaction that drops their Photos
+    rows. A download registers its photo before placing the file, so it
+    either lands before the collection (and the photo counts as just used)
+    or waits for it to commit (and places the file again). Returns
+    (files removed, bytes freed).
+    """
+    # Leftovers of interrupted downloads, and thumbnails of photos deleted by hand; the tree is walked
+    # before taking the lock, and whether they are still unknown is decided under it
+    cutoff = time.time() - grace_days * 86400
+    strays = []
+    for root in (PHOTO_STORE_DIR, PHOTO_THUMBNAIL_DIR):
+        for directory, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        strays.append((name.split(".", 1)[0], path))
+                except FileNotFoundError:
+                    pass
+
+    removed, freed = 0, 0
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute("""
+            DELETE FROM Photos WHERE refcount <= 0 AND touched_at < datetime('now', ?) RETURNING digest, path, size
+        """, (f"-{grace_days} days",)).fetchall()
+        known = {row[0] for row in conn.execute("SELECT digest FROM Photos")}
+        for row in rows:
+            for path in (row["path"], photo_thumbnail_path(row["digest"])):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+            freed += row["size"]
+        for digest, path in strays:
+            if digest in known:
                 continue
+            try:
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        conn.commit()
+    return removed, freed
 
+class PhotoCollector:
+    """Runs collect_photo_garbage() every `interval` seconds."""
+
+    def __init__(self, interval: float = PHOTO_GC_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                removed, freed = await run_db(collect_photo_garbage)
+                if removed:
+                    logging.info("Photo store: removed %d unreferenced files (%.1f MiB)", removed, freed / 2 ** 20)
+            except Exception:
+                logging.exception("Collecting unreferenced photos failed")
+            await asyncio.sleep(self.interval)
+# --- End photo_store.py content ---
+
+# --- downloads.py content ---
+PHOTO_DOWNLOAD_CONCURRENCY = int(os.getenv("PHOTO_DOWNLOAD_CONCURRENCY", "8"))
+PHOTO_DOWNLOAD_RETRIES = int(os.getenv("PHOTO_DOWNLOAD_RETRIES", "3"))
+PHOTO_DOWNLOAD_BACKOFF = 0.5 # seconds, doubled after every failed attempt
+PHOTO_SAVED_CACHE_SIZE = int(os.getenv("PHOTO_SAVED_CACHE_SIZE", "10000")) # file_unique_ids remembered per process
+
+class PhotoDownloader:
+    """Downloads Telegram photos into the photo store with bounded concurrency, de-duplicated by file_unique_id.
+
+    At most `concurrency` downloads talk to the Bot API at once. A photo that
+    was stored recently (or is being downloaded right now) is not fetched
+    again, and a file whose content is already in the store is dropped in
+    favour of the stored copy. The last `cache_size` stored photos are
+    remembered; a remembered file that the garbage collector has removed
+    since is downloaded again. Failed attempts are retried with exponential
+    backoff, and files are written under a temporary name, so a half-written
+    file is never visible.
+    """
+
+    def __init__(self, concurrency: int = PHOTO_DOWNLOAD_CONCURRENCY, retries: int = PHOTO_DOWNLOAD_RETRIES,
+                 backoff: float = PHOTO_DOWNLOAD_BACKOFF, cache_size: int = PHOTO_SAVED_CACHE_SIZE):
+        self.retries = retries
+        self.backoff = backoff
+        self.cache_size = cache_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._saved = {} # file_unique_id -> path, least recently used first
+        self._in_flight = {} # file_unique_id -> Task
+        self._store_ready = False
+
+    async def start(self) -> None:
+        """Creates the store directory, once per process rather than on every download."""
+        if not self._store_ready:
+            os.makedirs(PHOTO_STORE_DIR, exist_ok=True)
+            self._store_ready = True
+
+    async def download(self, bot: Bot, photo: types.PhotoSize):
+        """Returns the local path of the photo, or None if it couldn't be downloaded."""
+        key = photo.file_unique_id
+        path = self._saved.get(key)
+        if path is not None:
+            if await run_db(touch_stored_photo, path):
+                self._remember(key, path)
+                return path
+            self._saved.pop(key, None) # collected since we stored it: fetch it again
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._download(bot, photo))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def _remember(self, key: str, path: str) -> None:
+        self._saved.pop(key, None)
+        self._saved[key] = path
+        while len(self._saved) > self.cache_size:
+            del self._saved[next(iter(self._saved))]
+
+    async def _download(self, bot: Bot, photo: types.PhotoSize):
+        loop = asyncio.get_running_loop()
+        await self.start()
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                temp_path = None
+                try:
+                    file_info = await bot.get_file(photo.file_id)
+                    file_extension = os.path.splitext(file_info.file_path)[1] or ".jpg"
+                    temp_path = os.path.join(PHOTO_STORE_DIR, f"{photo.file_unique_id}.{os.getpid()}.{id(photo)}.part")
+                    await bot.download_file(file_info.file_path, temp_path)
+                    digest = await loop.run_in_executor(None, hash_file, temp_path)
+                    # Registered before the file is placed, so the garbage collector never sees it unaccounted for
+                    await run_db(register_photo, digest, photo_store_path(digest, file_extension),
+                                 os.path.getsize(temp_path))
+                    destination_path = await loop.run_in_executor(None, place_photo, temp_path, digest, file_extension)
+                    temp_path = None
+                    self._remember(photo.file_unique_id, destination_path)
+                    return destination_path
+                except TelegramRetryAfter as e:
+                    delay = e.retry_after
+                except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, OSError) as e:
+                    logging.warning("Downloading photo %s failed (attempt %d): %s", photo.file_unique_id, attempt + 1, e)
+                    delay = self.backoff * 2 ** attempt
+                finally:
+                    if temp_path and os.path.exists(temp_path):
+                        os.remove(temp_path)
+                if attempt < self.retries:
+                    await asyncio.sleep(delay)
+        return None
+
+photo_downloader = PhotoDownloader()
+
+async def download_photo(photo: types.PhotoSize, bot: Bot):
+    """Downloads a photo from Telegram into the photo store and returns its path (None on failure)."""
+    return await photo_downloader.download(bot, photo)
+# --- End downloads.py content ---
+
+# --- utils.py content ---
+
+MAX_NAME_LENGTH = 200
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "2000"))
+
+@dataclass
+class ImportReport:
+    """Outcome of a roster import: how many names were inserted, skipped and which rows failed."""
+    inserted: int = 0
+    skipped: int = 0 # names already in Students or repeated in the file
+    failed: list = field(default_factory=list) # (value, reason) pairs
+
+    def summary(self) -> str:
+        lines = [
+            f"تمت إضافة {self.inserted} طالب.",
+            f"تم تخطي {self.skipped} اسم مكرر أو موجود مسبقاً.",
+        ]
+        if self.failed:
+            lines.append(f"تعذرت إضافة {len(self.failed)} صف:")
+            lines.extend(f"  {value}: {reason}" for value, reason in self.failed[:10])
+        return "\n".join(lines)
+
+def chunked(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def import_student_names(name_chunks, progress=None) -> ImportReport:
+    """Inserts full names into Students with one executemany in a single transaction.
+
+    `name_chunks` is an iterable of lists of cell values, as produced by
+    iter_excel_names(). The file is read and checked first, keeping only the
+    new names; the existing names are then loaded once inside a BEGIN
+    IMMEDIATE transaction, so a name costs no extra query, and everything is
+    committed together: an error anywhere leaves Students untouched.
+    `progress`, if given, is called with a short status line after every chunk.
+    """
+    report = ImportReport()
+    rows_read = 0
+    names = {} # name_key -> full_name, first spelling in the file wins
+    for chunk in name_chunks:
+        rows_read += len(chunk)
+        for value in chunk:
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                report.failed.append((value, "القيمة ليست اسماً"))
+                continue
+            full_name = value.strip()
+            if not full_name:
+                continue
+            if len(full_name) > MAX_NAME_LENGTH:
+                report.failed.append((full_name[:50], "الاسم أطول من المسموح"))
+                continue
+            name_key = normalize_arabic_name(full_name)
+            if name_key in names:
+                report.skipped += 1
+                continue
+            names[name_key] = full_name
+        if progress:
+            progress(f"تمت قراءة {rows_read} صف؛ تُضاف الأسماء الجديدة دفعة واحدة بعد قراءة الملف كاملاً.")
+
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = {row[0] for row in conn.execute("SELECT name_key FROM Students")}
             # Insert only full_name initially, other fields will be null
-            cursor.execute("INSERT INTO Students (full_name) VALUES (?) ", (full_name,))
+            new_rows = [(full_name, name_key) for name_key, full_name in names.items() if name_key not in existing]
+            conn.executemany("INSERT INTO Students (full_name, name_key) VALUES (?, ?)", new_rows)
             conn.commit()
-        except Exception as e:
-            print(f"Error inserting row: {full_name} - {e}")
+        except sqlite3.Error as e:
             conn.rollback()
-    conn.close()
-
-def get_student_statistics():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    stats = {}
+            logging.error("Roster import rolled back: %s", e)
+            report.failed.append(("الملف كاملاً", f"لم يُضف أي اسم: {e}"))
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            report.inserted = len(new_rows)
+            report.skipped += len(names) - len(new_rows)
+
+    logging.info("Roster import: %d inserted, %d skipped, %d failed",
+                 report.inserted, report.skipped, len(report.failed))
+    return report
+
+def iter_excel_names(file_path: str, sheet_name: str = None, column: str = None, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """Streams the names column of a workbook in lists of at most `chunk_size` values.
+
+    The workbook is opened read-only and only the names column is materialised,
+    so memory stays flat however many rows and unused columns the sheet has.
+    With `column`, the first row is a header and the column with that header is
+    read; otherwise column A is read from the first row on.
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet_name:
+            if sheet_name not in workbook.sheetnames:
+                raise ValueError(f"الورقة \"{sheet_name}\" غير موجودة. الأوراق المتوفرة: {'، '.join(workbook.sheetnames)}")
+            sheet = workbook[sheet_name]
+        else:
+            sheet = workbook.active
+
+        column_index = 1
+        first_row = 1
+        if column:
+            header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            headers = [str(value).strip() if value is not None else "" for value in header]
+            if column.strip() not in headers:
+                raise ValueError(f"العمود \"{column}\" غير موجود في الصف الأول من الورقة.")
+            column_index = headers.index(column.strip()) + 1
+            first_row = 2
+
+        rows = sheet.iter_rows(min_row=first_row, min_col=column_index, max_col=column_index, values_only=True)
+        yield from chunked((row[0] for row in rows if row), chunk_size)
+    finally:
+        workbook.close()
+
+def process_excel_file(file_path: str, sheet_name: str = None, column: str = None, progress=None) -> ImportReport:
+    return import_student_names(iter_excel_names(file_path, sheet_name, column), progress)
+
+def parse_options(text: str, keys: dict) -> dict:
+    """Reads "key: value" lines, keeping only the keys in `keys` (mapped to their option names)."""
+    options = {}
+    for line in (text or "").splitlines():
+        key, sep, value = line.partition(":")
+        if sep and key.strip().lower() in keys and value.strip():
+            options[keys[key.strip().lower()]] = value.strip()
+    return options
+
+def parse_import_options(caption: str) -> dict:
+    """Reads "الورقة: ...", "العمود: ..." and "الوضع: ..." lines from an uploaded file's caption."""
+    return parse_options(caption, {"الورقة": "sheet_name", "sheet": "sheet_name", "العمود": "column", "column": "column",
+                                   "الوضع": "mode", "mode": "mode"})
+
+IMPORT_MERGE_MODES = ("دمج", "merge")
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+WORD_TABLE_SAMPLE_ROWS = 20 # rows read before deciding which column of a table holds the names
+NAME_HEADERS = ("اسم", "الاسم", "name", "full_name") # whole words, so names like جاسم or باسم don't count
+_LIST_NUMBERING = re.compile(r"^\s*[\d\u0660-\u0669]+\s*[-.):/\u066b]?\s*") # "1- ", "٢) " ...
+_WORD_TABLE_TAG = re.compile(rb"<(?:\w+:)?tbl[\s>]")
+
+def _looks_like_name(text: str) -> bool:
+    return len(text.split()) >= 2 and not any(ch.isdigit() for ch in text)
+
+def _pick_name_column(rows: list, column: str = None):
+    """Returns (index, has_header) of the names column of a table, judged from its first rows; index is None if none fits."""
+    header = [cell.strip() for cell in rows[0]]
+    if column:
+        if column.strip() in header:
+            return header.index(column.strip()), True
+        return None, False
+    for index, cell in enumerate(header):
+        if any(word in NAME_HEADERS for word in normalize_arabic_name(cell).lower().split()):
+            return index, True
+    width = max(len(row) for row in rows)
+    scores = [sum(index < len(row) and _looks_like_name(row[index]) for row in rows) for index in range(width)]
+    best = max(range(width), key=scores.__getitem__)
+    return (best, False) if scores[best] else (None, False)
+
+def _word_text(element) -> str:
+    parts = []
+    for node in element.iter():
+        if node.tag == WORD_NAMESPACE + "t":
+            parts.append(node.text or "")
+        elif node.tag in (WORD_NAMESPACE + "tab", WORD_NAMESPACE + "br"):
+            parts.append(" ")
+    return _LIST_NUMBERING.sub("", "".join(parts)).strip()
+
+def _docx_has_tables(archive: zipfile.ZipFile) -> bool:
+    with archive.open("word/document.xml") as f:
+        tail = b""
+        while block := f.read(1 << 16):
+            if _WORD_TABLE_TAG.search(tail + block):
+                return True
+            tail = block[-8:]
+    return False
+
+def iter_word_lines(file_path: str, column: str = None):
+    """Streams the names of a .docx roster, one string per name.
+
+    A document with tables yields the names column of every table: the
+    column headed `column`, else one whose header mentions a name, else the
+    column that looks most like full names. A document without tables yields
+    every paragraph. List numbering such as "1- " is dropped. document.xml is
+    parsed incrementally and each row is discarded once read.
+    """
+    try:
+        archive = zipfile.ZipFile(file_path)
+    except zipfile.BadZipFile:
+        raise ValueError("الملف ليس مستند Word (.docx) صالحاً.")
+    with archive:
+        if "word/document.xml" not in archive.namelist():
+            raise ValueError("الملف ليس مستند Word (.docx) صالحاً.")
+        has_tables = _docx_has_tables(archive)
+        column_found = False
+        table_depth = 0
+        sample, row, name_index = [], [], None
+
+        def sampled_names():
+            nonlocal name_index, column_found
+            rows = [r for r in sample if any(r)]
+            sample.clear()
+            if not rows:
+                return
+            name_index, has_header = _pick_name_column(rows, column)
+            column_found |= has_header and bool(column)
+            for r in rows[1 if has_header else 0:]:
+                if name_index is not None and name_index < len(r):
+                    yield r[name_index]
+            name_index = name_index if name_index is not None else -1
+
+        with archive.open("word/document.xml") as document:
+            for event, element in ElementTree.iterparse(document, events=("start", "end")):
+                tag = element.tag
+                if event == "start":
+                    if tag == WORD_NAMESPACE + "tbl":
+                        table_depth += 1
+                        if table_depth == 1:
+                            sample, name_index = [], None
+                    elif tag == WORD_NAMESPACE + "tr" and table_depth == 1:
+                        row = []
+                    continue
+
+                if tag == WORD_NAMESPACE + "p" and table_depth == 0:
+                    if not has_tables:
+                        text = _word_text(element)
+                        if text:
+                            yield text
+                    element.clear()
+                elif tag == WORD_NAMESPACE + "tc" and table_depth == 1:
+                    row.append(_word_text(element))
+                    element.clear()
+                elif tag == WORD_NAMESPACE + "tr" and table_depth == 1:
+                    if name_index is None:
+                        sample.append(row)
+                        if len(sample) >= WORD_TABLE_SAMPLE_ROWS:
+                            yield from sampled_names()
+                    elif 0 <= name_index < len(row):
+                        yield row[name_index]
+                    element.clear()
+                elif tag == WORD_NAMESPACE + "tbl":
+                    if table_depth == 1:
+                        if name_index is None:
+                            yield from sampled_names()
+                        element.clear()
+                    table_depth -= 1
+
+    if column and not column_found:
+        raise ValueError(f"العمود \"{column}\" غير موجود في أي جدول من المستند.")
+
+def process_word_file(file_path: str, column: str = None, progress=None) -> ImportReport:
+    return import_student_names(chunked(iter_word_lines(file_path, column), IMPORT_CHUNK_SIZE), progress)
+
+# Students columns a roster may set, with the header they carry in the registration form.
+# Headers are matched against these labels and against the column names themselves, so
+# an export re-imported as is lines up too.
+MERGE_COLUMNS = {
+    "full_name": "الاسم الرباعي",
+    "dob": "تاريخ الميلاد",
+    "grade": "الصف",
+    "section": "الشعبة",
+    "student_number": "الرقم",
+    "phone_number": "رقم الهاتف",
+    "parent_phone_number": "رقم هاتف ولي الأمر",
+    "middle_school": "المدرسة المتوسطة",
+    "location_link": "رابط الموقع الجغرافي",
+    "address_description": "وصف السكن",
+    "status": "الحالة",
+    "role": "الدور",
+    "academic_year": "العام الدراسي",
+}
+MERGE_HEADERS = {
+    **{column: column for column in MERGE_COLUMNS},
+    **{label: column for column, label in MERGE_COLUMNS.items()},
+    "الاسم": "full_name",
+    "رقم الطالب": "student_number",
+}
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+@dataclass
+class MergeReport:
+    """Outcome of a merge import: rows added, rows changed (and which columns), rows already up to date, failures."""
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    changed_columns: dict = field(default_factory=dict) # column -> rows where it changed
+    failed: list = field(default_factory=list) # (row, reason) pairs
+
+    def summary(self) -> str:
+        lines = [
+            f"تمت إضافة {self.inserted} طالب.",
+            f"تم تحديث بيانات {self.updated} طالب.",
+            f"لم تتغير بيانات {self.unchanged} طالب.",
+        ]
+        if self.changed_columns:
+            lines.append("الحقول المحدثة: " + "، ".join(
+                f"{MERGE_COLUMNS[column]} ({count})" for column, count in self.changed_columns.items()))
+        if self.failed:
+            lines.append(f"تعذر دمج {len(self.failed)} صف:")
+            lines.extend(f"  {row}: {reason}" for row, reason in self.failed[:10])
+        return "\n".join(lines)
+
+def merge_cell(column: str, value):
+    """The value a roster cell stores in `column`: None for an empty cell, else text (an int for
+    student_number, a YYYY-MM-DD date for dob). Raises ValueError for a value the column can't take."""
+    if isinstance(value, str):
+        value = value.strip() or None
+    if value is None:
+        return None
+    if column == "student_number":
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError("الرقم غير صحيح")
+        if not number.is_integer() or number < 1:
+            raise ValueError("الرقم غير صحيح")
+        return int(number)
+    if column == "dob":
+        if isinstance(value, datetime):
+            return value.strftime("%Y-%m-%d")
+        value = str(value)
+        try:
+            # fromisoformat is far cheaper than strptime over a whole roster, but also takes other layouts
+            if not _ISO_DATE.fullmatch(value):
+                raise ValueError(value)
+            datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError("صيغة تاريخ الميلاد غير صحيحة")
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value) # phone numbers and grades typed as numbers
+    value = str(value)
+    if column == "full_name" and len(value) > MAX_NAME_LENGTH:
+        raise ValueError("الاسم أطول من المسموح")
+    return value
+
+def iter_excel_records(file_path: str, sheet_name: str = None, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """Streams a roster sheet as lists of (row number, {column: cell}) pairs.
+
+    The first row is the header; columns whose header isn't in MERGE_HEADERS
+    are skipped. Raises ValueError if neither the name nor the number column
+    is there to match rows on.
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet_name:
+            if sheet_name not in workbook.sheetnames:
+                raise ValueError(f"الورقة \"{sheet_name}\" غير موجودة. الأوراق المتوفرة: {'، '.join(workbook.sheetnames)}")
+            sheet = workbook[sheet_name]
+        else:
+            sheet = workbook.active
+
+        header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        columns = {}
+        for index, value in enumerate(header):
+            column = MERGE_HEADERS.get(str(value).strip().lower() if value is not None else "")
+            if column and column not in columns.values():
+                columns[index] = column
+        if not {"full_name", "student_number"} & set(columns.values()):
+            raise ValueError("يجب أن يحتوي الصف الأول على عمود الاسم الرباعي أو عمود الرقم.")
+
+        rows = sheet.iter_rows(min_row=2, values_only=True)
+        records = ((number, {column: row[index] if index < len(row) else None for index, column in columns.items()})
+                   for number, row in enumerate(rows, start=2) if row and any(cell is not None for cell in row))
+        yield from chunked(records, chunk_size)
+    finally:
+        workbook.close()
+
+def merge_student_rows(record_chunks, progress=None) -> MergeReport:
+    """Merges roster rows into Students, writing only the cells that differ from what is stored.
+
+    A row matches the student with its student_number; a row without a
+    number matches the only student with its normalised name, and a row with
+    a new number may claim a same-named student who has none yet. Unmatched
+    rows with a name become new students. Empty cells leave the stored value
+    alone.
+
+    The file is read first, then the current rows are loaded once and diffed
+    in memory, and every insert and update runs as an executemany (one per
+    distinct set of changed columns) in a single transaction, so re-importing
+    an unchanged roster reads the table once and writes nothing.
+    """
+    report = MergeReport()
+    records = []
+    for chunk in record_chunks:
+        records.extend(chunk)
+        if progress:
+            progress(f"تمت قراءة {len(records)} صف.")
+
+    columns = list(MERGE_COLUMNS)
+    updates = {} # changed columns -> [(values..., id)]
+    inserts = {} # filled columns -> [(values..., name_key)]
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        current = {}
+        by_number = {}
+        by_name = {} # name_key -> id, or None if several students share the name
+        for row in conn.execute(f"SELECT id, name_key, {', '.join(columns)} FROM Students"):
+            current[row["id"]] = row
+            if row["student_number"] is not None:
+                by_number[row["student_number"]] = row["id"]
+            by_name[row["name_key"]] = None if row["name_key"] in by_name else row["id"]
+
+        merged = set() # students already matched by an earlier row of the file
+        for row_number, cells in records:
+            try:
+                values = {column: merge_cell(column, value) for column, value in cells.items()}
+            except ValueError as e:
+                report.failed.append((f"الصف {row_number}", str(e)))
+                continue
+            values = {column: value for column, value in values.items() if value is not None}
+            number = values.get("student_number")
+            name_key = normalize_arabic_name(values.get("full_name"))
+            if number is not None:
+                student_id = by_number.get(number)
+                match = by_name.get(name_key) if name_key else None
+                if student_id is None and match and match > 0 and match not in merged \
+                        and current[match]["student_number"] is None:
+                    student_id = match # a student imported by name gets their number
+            elif name_key and name_key in by_name:
+                student_id = by_name[name_key]
+                if student_id is None:
+                    report.failed.append((f"الصف {row_number}", "يوجد أكثر من طالب بهذا الاسم؛ أضف عمود الرقم"))
+                    continue
+            else:
+                student_id = None
+            if student_id is not None and (student_id < 0 or student_id in merged):
+                report.failed.append((f"الصف {row_number}", "الطالب مكرر في الملف"))
+                continue
 
-    # Total students
-    cursor.execute("SELECT COUNT(*) FROM Students")
-    stats["total_students"] = cursor.fetchone()[0]
+            if student_id is not None:
+                merged.add(student_id)
+                stored = current[student_id]
+                changed = {column: value for column, value in values.items() if stored[column] != value}
+                if not changed:
+                    report.unchanged += 1
+                    continue
+                for column in changed:
+                    report.changed_columns[column] = report.changed_columns.get(column, 0) + 1
+                if number is not None:
+                    by_number[number] = student_id
+                if "full_name" in changed:
+                    changed["name_key"] = name_key
+                updates.setdefault(tuple(changed), []).append((*changed.values(), student_id))
+                report.updated += 1
+            elif "full_name" not in values:
+                report.failed.append((f"الصف {row_number}", "لا يوجد طالب بهذا الرقم، ولا اسم لإضافته"))
+            else:
+                report.inserted += 1
+                new_id = -report.inserted # stands in for the id the insert will get
+                if number is not None:
+                    by_number[number] = new_id
+                by_name[name_key] = None if name_key in by_name else new_id
+                inserts.setdefault(tuple(values), []).append((*values.values(), name_key))
 
-    # Students by grade
-    cursor.execute("SELECT grade, COUNT(*) FROM Students GROUP BY grade")
-    stats["students_by_grade"] = dict(cursor.fetchall())
+        try:
+            for changed, params in updates.items():
+                assignments = ", ".join(f"{column} = ?" for column in changed)
+                conn.executemany(f"UPDATE Students SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                                 params)
+            for filled, params in inserts.items():
+                conn.executemany(f"INSERT INTO Students ({', '.join(filled)}, name_key) "
+                                 f"VALUES ({', '.join('?' * (len(filled) + 1))})", params)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    logging.info("Roster merge: %d inserted, %d updated, %d unchanged, %d failed",
+                 report.inserted, report.updated, report.unchanged, len(report.failed))
+    return report
+
+def merge_excel_file(file_path: str, sheet_name: str = None, progress=None) -> MergeReport:
+    return merge_student_rows(iter_excel_records(file_path, sheet_name), progress)
+
+# A registration is complete once the student linked their Telegram account and filled every field
+REQUIRED_STUDENT_FIELDS = (
+    "dob", "grade", "section", "student_number", "phone_number", "parent_phone_number",
+    "middle_school", "location_link", "address_description", "personal_photo_path",
+    "student_card_photo_path", "father_card_photo_path", "mother_card_photo_path",
+    "status", "role", "academic_year"
+)
+STATS_ADMISSION_DAYS = 14
+
+def _student_stats_key(row: str) -> str:
+    """SQL for the Student_Stats key of a Students row (NEW, OLD or the table name)."""
+    complete = " AND ".join(f"{row}.{name} IS NOT NULL" for name in ("telegram_id",) + REQUIRED_STUDENT_FIELDS)
+    return (f"COALESCE({row}.grade, ''), COALESCE({row}.section, ''), COALESCE({row}.academic_year, ''), "
+            f"COALESCE({row}.status, ''), ({complete})")
+
+def ensure_stats_schema(cursor):
+    """Creates the statistics tables, fills them from the current rows and adds the triggers that keep them current.
+
+    Student_Stats holds one counter per (grade, section, academic_year,
+    status, is_complete) combination that occurs, and Admission_Stats one per
+    day, so the admin statistics never scan Students or Admission_Requests.
+    """
+    stats_key = "(grade, section, academic_year, status, is_complete)"
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS Student_Stats (
+            grade TEXT NOT NULL,
+            section TEXT NOT NULL,
+            academic_year TEXT NOT NULL,
+            status TEXT NOT NULL,
+            is_complete INTEGER NOT NULL,
+            students INTEGER NOT NULL,
+            PRIMARY KEY {stats_key}
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Admission_Stats (
+            day TEXT PRIMARY KEY,
+            requests INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("DELETE FROM Student_Stats")
+    cursor.execute(f"""
+        INSERT INTO Student_Stats {stats_key[:-1]}, students)
+        SELECT {_student_stats_key("Students")}, COUNT(*) FROM Students GROUP BY 1, 2, 3, 4, 5
+    """)
+    cursor.execute("DELETE FROM Admission_Stats")
+    cursor.execute("""
+        INSERT INTO Admission_Stats (day, requests)
+        SELECT date(created_at), COUNT(*) FROM Admission_Requests GROUP BY 1
+    """)
 
-    # Students by section
-    cursor.execute("SELECT section, COUNT(*) FROM Students GROUP BY section")
-    stats["students_by_section"] = dict(cursor.fetchall())
+    add_new = f"""
+        INSERT INTO Student_Stats {stats_key[:-1]}, students) VALUES ({_student_stats_key("NEW")}, 1)
+        ON CONFLICT{stats_key} DO UPDATE SET students = students + 1;
+    """
+    remove_old = f"""
+        UPDATE Student_Stats SET students = students - 1 WHERE {stats_key} = ({_student_stats_key("OLD")});
+    """
+    # Every column _student_stats_key() reads, or an update touching only that column would leave the counters stale
+    tracked_columns = ", ".join(dict.fromkeys(("telegram_id", "grade", "section", "academic_year") + REQUIRED_STUDENT_FIELDS))
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS student_stats_insert AFTER INSERT ON Students BEGIN {add_new} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS student_stats_delete AFTER DELETE ON Students BEGIN {remove_old} END")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS student_stats_update AFTER UPDATE OF {tracked_columns} ON Students
+        WHEN ({_student_stats_key("OLD")}) IS NOT ({_student_stats_key("NEW")})
+        BEGIN {remove_old} {add_new} END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS admission_stats_insert AFTER INSERT ON Admission_Requests BEGIN
+            INSERT INTO Admission_Stats (day, requests) VALUES (date(NEW.created_at), 1)
+            ON CONFLICT(day) DO UPDATE SET requests = requests + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS admission_stats_delete AFTER DELETE ON Admission_Requests BEGIN
+            UPDATE Admission_Stats SET requests = requests - 1 WHERE day = date(OLD.created_at);
+        END
+    """)
 
-    conn.close()
+def rebuild_student_stats(cursor):
+    """Recreates student_stats_update with the full column list and recounts Student_Stats from Students."""
+    cursor.execute("DROP TRIGGER IF EXISTS student_stats_update")
+    ensure_stats_schema(cursor)
+
+def get_student_statistics(admission_days: int = STATS_ADMISSION_DAYS):
+    """Builds every breakdown from the few rows of Student_Stats and Admission_Stats."""
+    with get_db_connection() as conn:
+        rows = conn.execute("""
+            SELECT grade, section, academic_year, status, is_complete, students FROM Student_Stats WHERE students > 0
+        """).fetchall()
+        admissions = conn.execute("SELECT day, requests FROM Admission_Stats WHERE day >= date('now', ?) ORDER BY day",
+                                  (f"-{admission_days - 1} days",)).fetchall()
+
+    stats = {
+        "total_students": 0,
+        "complete_students": 0,
+        "students_by_grade": {},
+        "students_by_section": {},
+        "students_by_year": {},
+        "students_by_status": {},
+        "completion_by_grade": {}, # grade -> (complete, total)
+        "students_by_grade_section_year": {}, # (grade, section, year) -> count
+        "admissions_by_day": {day: requests for day, requests in admissions if requests > 0},
+    }
+    for grade, section, year, status, is_complete, count in rows:
+        grade, section, year, status = (value or None for value in (grade, section, year, status))
+        stats["total_students"] += count
+        stats["complete_students"] += count if is_complete else 0
+        for name, value in (("students_by_grade", grade), ("students_by_section", section),
+                            ("students_by_year", year), ("students_by_status", status)):
+            stats[name][value] = stats[name].get(value, 0) + count
+        complete, total = stats["completion_by_grade"].get(grade, (0, 0))
+        stats["completion_by_grade"][grade] = (complete + (count if is_complete else 0), total + count)
+        cell = (grade, section, year)
+        stats["students_by_grade_section_year"][cell] = stats["students_by_grade_section_year"].get(cell, 0) + count
     return stats
 
 
-def export_students_to_excel(file_path: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM Students")
-    rows = cursor.fetchall()
-    conn.close()
+EXPORT_DIR = "exports"
+EXPORT_FETCH_SIZE = 1000
+EXPORT_FORMATS = ("xlsx", "csv")
 
-    if not rows:
-        return False
-
-    workbook = Workbook()
-    sheet = workbook.active
+def export_students(fmt: str = "xlsx", grade: str = None, section: str = None, academic_year: str = None,
+                    directory: str = EXPORT_DIR, progress=None):
+    """Streams the matching Students rows into a new, uniquely named .xlsx or .csv file.
 
-    # Write headers
-    headers = [description[0] for description in cursor.description]
-    sheet.append(headers)
+    Rows are fetched with fetchmany and appended to a write-only workbook (or a
+    CSV writer), so memory use doesn't depend on the table size. Returns the
+    file path, or None if no student matched the filters.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"صيغة التصدير غير مدعومة: {fmt}")
 
-    # Write data
-    for row in rows:
-        sheet.append(list(row))
+    filters = {"grade": grade, "section": section, "academic_year": academic_year}
+    conditions = [f"{column} = ?" for column, value in filters.items() if value is not None]
+    params = [value for value in filters.values() if value is not None]
+    query = "SELECT * FROM Students"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id"
 
-    workbook.save(file_path)
-    return True
+    os.makedirs(directory, exist_ok=True)
+    fd, file_path = tempfile.mkstemp(prefix="students_data_", suffix=f".{fmt}", dir=directory)
+    os.close(fd)
 
-def add_supervisor(telegram_id: int, username: str, full_name: str, password: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    written = 0
     try:
-        cursor.execute("INSERT INTO Supervisors (telegram_id, username, full_name, password) VALUES (?, ?, ?, ?)",
-                       (telegram_id, username, full_name, password))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False # Supervisor with this telegram_id already exists
-    finally:
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.execute(query, params)
+            headers = [description[0] for description in cursor.description]
+            if fmt == "csv":
+                # utf-8-sig so Excel detects the encoding of the Arabic text
+                with open(file_path, "w", newline="", encoding="utf-8-sig") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(headers)
+                    while rows := cursor.fetchmany(EXPORT_FETCH_SIZE):
+                        writer.writerows(rows)
+                        written += len(rows)
+                        if progress:
+                            progress(f"تمت كتابة {written} صف.")
+            else:
+                workbook = Workbook(write_only=True)
+                sheet = workbook.create_sheet()
+                sheet.append(headers)
+                while rows := cursor.fetchmany(EXPORT_FETCH_SIZE):
+                    for row in rows:
+                        sheet.append(list(row))
+                    written += len(rows)
+                    if progress:
+                        progress(f"تمت كتابة {written} صف.")
+                workbook.save(file_path)
+    except BaseException:
+        os.remove(file_path)
+        raise
+
+    if not written:
+        os.remove(file_path)
+        return None
+    return file_path
+
+def parse_export_options(text: str) -> dict:
+    """Reads the export format and the grade/section/academic year filters from an admin's message."""
+    options = parse_options(text, {"الصف": "grade", "الشعبة": "section", "العام الدراسي": "academic_year", "الصيغة": "fmt"})
+    options["fmt"] = "csv" if options.get("fmt", "").lower() == "csv" else "xlsx"
+    return options
+
+def add_supervisor(telegram_id: int, username: str, full_name: str, password_hash: str):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("INSERT INTO Supervisors (telegram_id, username, full_name, password) VALUES (?, ?, ?, ?)",
+                           (telegram_id, username, full_name, password_hash))
+            conn.commit()
+            supervisors_cache.invalidate()
+            return True
+        except sqlite3.IntegrityError:
+            return False # Supervisor with this telegram_id already exists
 
 def remove_supervisor(telegram_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute("DELETE FROM Supervisors WHERE telegram_id = ?", (telegram_id,))
         conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        conn.close()
+    supervisors_cache.invalidate()
+    return cursor.rowcount > 0
 
 def get_all_supervisors():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id, username, full_name FROM Supervisors")
-    supervisors = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT telegram_id, username, full_name FROM Supervisors")
+        supervisors = cursor.fetchall()
     return supervisors
 
-def is_supervisor(telegram_id: int, password: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM Supervisors WHERE telegram_id = ? AND password = ?", (telegram_id, password))
-    supervisor = cursor.fetchone()
-    conn.close()
-    return supervisor is not None
+def get_supervisor_password_hash(telegram_id: int):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT password FROM Supervisors WHERE telegram_id = ?", (telegram_id,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+def set_supervisor_password_hash(telegram_id: int, password_hash: str):
+    with get_db_connection() as conn:
+        conn.execute("UPDATE Supervisors SET password = ? WHERE telegram_id = ?", (password_hash, telegram_id))
+        conn.commit()
+
+def is_student_number_taken(student_number: int):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM Students WHERE student_number = ?", (student_number,))
+        return cursor.fetchone() is not None
+
+def find_student_by_id(student_id: int):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM Students WHERE id = ?", (student_id,))
+        student = cursor.fetchone()
+    return dict(student) if student else None
+
+def find_student_by_telegram_id(telegram_id: int):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM Students WHERE telegram_id = ?", (telegram_id,))
+        student = cursor.fetchone()
+    return dict(student) if student else None
+
+def save_student_form(telegram_id: int, user_data: dict):
+    """Saves a completed registration form. Returns True if an imported student row was completed,
+    False if a new row was inserted. Raises sqlite3.IntegrityError on duplicate telegram_id/student_number."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # Check if student exists by (normalised) full_name and telegram_id is null
+        cursor.execute("SELECT id FROM Students WHERE name_key = ? AND telegram_id IS NULL",
+                       (normalize_arabic_name(user_data.get("full_name")),))
+        student_id_row = cursor.fetchone()
+
+        if student_id_row:
+            student_id = student_id_row[0]
+            cursor.execute("""
+                UPDATE Students SET
+                    telegram_id = ?, dob = ?, grade = ?, section = ?, student_number = ?,
+                    phone_number = ?, parent_phone_number = ?, middle_school = ?, location_link = ?,
+                    address_description = ?, personal_photo_path = ?, student_card_photo_path = ?,
+                    father_card_photo_path = ?, mother_card_photo_path = ?, status = ?, role = ?,
+                    academic_year = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (
+                telegram_id, user_data.get("dob"), user_data.get("grade"),
+                user_data.get("section"), user_data.get("student_number"), user_data.get("phone_number"),
+                user_data.get("parent_phone_number"), user_data.get("middle_school"),
+                user_data.get("location_link"), user_data.get("address_description"),
+                user_data.get("personal_photo_path"), user_data.get("student_card_photo_path"),
+                user_data.get("father_card_photo_path"), user_data.get("mother_card_photo_path"),
+                user_data.get("status"), user_data.get("role"), user_data.get("academic_year"),
+                student_id
+            ))
+        else:
+            # If student does not exist or telegram_id is already set, insert as new
+            cursor.execute("""
+                INSERT INTO Students (
+                    telegram_id, full_name, name_key, dob, grade, section, student_number, phone_number,
+                    parent_phone_number, middle_school, location_link, address_description,
+                    personal_photo_path, student_card_photo_path, father_card_photo_path,
+                    mother_card_photo_path, status, role, academic_year
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                telegram_id, user_data.get("full_name"), normalize_arabic_name(user_data.get("full_name")), user_data.get("dob"),
+                user_data.get("grade"), user_data.get("section"), user_data.get("student_number"),
+                user_data.get("phone_number"), user_data.get("parent_phone_number"),
+                user_data.get("middle_school"), user_data.get("location_link"),
+                user_data.get("address_description"), user_data.get("personal_photo_path"),
+                user_data.get("student_card_photo_path"), user_data.get("father_card_photo_path"),
+                user_data.get("mother_card_photo_path"), user_data.get("status"),
+                user_data.get("role"), user_data.get("academic_year")
+            ))
+        conn.commit()
+    return student_id_row is not None
+
+def save_admission_request(telegram_id: int, user_data: dict):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO Admission_Requests (
+                telegram_id, full_name, dob, phone_number, parent_phone_number,
+                middle_school, location_link, address_description, personal_photo_path,
+                student_card_photo_path, father_card_photo_path, mother_card_photo_path, status
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            telegram_id, user_data.get("full_name"), user_data.get("dob"),
+            user_data.get("phone_number"), user_data.get("parent_phone_number"),
+            user_data.get("middle_school"), user_data.get("location_link"),
+            user_data.get("address_description"), user_data.get("personal_photo_path"),
+            user_data.get("student_card_photo_path"), user_data.get("father_card_photo_path"),
+            user_data.get("mother_card_photo_path"), ADMISSION_PENDING
+        ))
+        conn.commit()
+
+def toggle_student_view_permission(student_id: int):
+    """Flips can_view_data for the student. Returns the new value, or None if not found."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, full_name, can_view_data FROM Students WHERE id = ?", (student_id,))
+        student = cursor.fetchone()
+        if not student:
+            return None
+
+        new_permission = 0 if student["can_view_data"] == 1 else 1 # Toggle 0 (False) or 1 (True)
+        cursor.execute("UPDATE Students SET can_view_data = ? WHERE id = ?", (new_permission, student["id"]))
+        conn.commit()
+    return new_permission
 
 # --- End utils.py content ---
 
-# --- create_db.py content (integrated as a function) ---
-def create_database():
-    conn = sqlite3.connect("students_data.db")
-    cursor = conn.cursor()
+# --- db_async.py content ---
+DB_LOCK_RETRIES = int(os.getenv("DB_LOCK_RETRIES", "5"))
+DB_LOCK_BACKOFF = 0.05 # seconds, doubled after every attempt
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Students (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE,
-            full_name TEXT NOT NULL,
-            dob TEXT,
-            grade TEXT,
-            section TEXT,
-            student_number INTEGER UNIQUE,
-            phone_number TEXT,
-            parent_phone_number TEXT,
-            middle_school TEXT,
-            location_link TEXT,
-            address_description TEXT,
-            personal_photo_path TEXT,
-            student_card_photo_path TEXT,
-            father_card_photo_path TEXT,
-            mother_card_photo_path TEXT,
-            status TEXT,
-            role TEXT,
-            academic_year TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            is_form_locked BOOLEAN DEFAULT FALSE,
-            can_view_data BOOLEAN DEFAULT TRUE
-        )
-    """)
+# Blocking sqlite3 calls run on these threads so a slow query or a lock wait
+# never stalls the aiogram event loop. One thread per pooled connection.
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Admission_Requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER,
-            full_name TEXT NOT NULL,
-            dob TEXT,
-            phone_number TEXT,
-            parent_phone_number TEXT,
-            middle_school TEXT,
-            location_link TEXT,
-            address_description TEXT,
-            personal_photo_path TEXT,
-            student_card_photo_path TEXT,
-            father_card_photo_path TEXT,
-            mother_card_photo_path TEXT,
-            status TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+def is_lock_error(error: Exception) -> bool:
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Settings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            setting_name TEXT UNIQUE NOT NULL,
-            setting_value TEXT
-        )
-    """)
+def call_with_lock_retry(func, *args, **kwargs):
+    """Calls func, calling it again if SQLite reports the database as locked.
 
+    The busy timeout already waits for other writers. SQLite still fails at
+    once when a read transaction must become a write after another process
+    wrote, and a retry is safe because every helper commits or is rolled back
+    as a whole.
+    """
+    for attempt in range(DB_LOCK_RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if attempt == DB_LOCK_RETRIES or not is_lock_error(e):
+                raise
+            logging.warning("%s hit a locked database, retrying (attempt %d)", getattr(func, "__name__", func), attempt + 1)
+            time.sleep(DB_LOCK_BACKOFF * 2 ** attempt)
+
+async def run_db(func, *args, **kwargs):
+    """Runs a blocking database helper on the DB worker threads and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(call_with_lock_retry, func, *args, **kwargs))
+# --- End db_async.py content ---
+
+# --- cache.py content ---
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "60"))
+SUPERVISORS_CACHE_TTL = float(os.getenv("SUPERVISORS_CACHE_TTL", "60"))
+
+class CachedLookup:
+    """Keeps the result of a loader function in memory, for `ttl` seconds (0 means until invalidated).
+
+    Reads of a fresh value take no lock and never touch the database. Writers
+    call invalidate() after changing the underlying rows; a load that was
+    already running when that happened is not stored, so it can't resurrect
+    the old value.
+    """
+
+    def __init__(self, loader, ttl: float = 0, name: str = None):
+        self._loader = loader
+        self.ttl = ttl
+        self._entry = None # (value, loaded_at)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if name is not None: # exported as bot_cache_*_total{cache=name}
+            metrics.add_collector(lambda: [(f"bot_cache_{key}_total", (("cache", name),), value)
+                                           for key, value in self.stats().items()])
+
+    def _fresh_entry(self):
+        entry = self._entry
+        if entry is not None and (not self.ttl or time.monotonic() - entry[1] < self.ttl):
+            return entry
+        return None
+
+    def is_fresh(self) -> bool:
+        return self._fresh_entry() is not None
+
+    def get(self):
+        entry = self._fresh_entry()
+        if entry is None:
+            with self._lock:
+                entry = self._fresh_entry() # another thread may have just loaded it
+                if entry is None:
+                    self.misses += 1
+                    generation = self._generation
+                    value = self._loader()
+                    if generation == self._generation:
+                        self._entry = (value, time.monotonic())
+                    return value
+        self.hits += 1
+        return entry[0]
+
+    async def aget(self):
+        """Like get(), but a miss is loaded on the DB threads so the event loop never blocks."""
+        if self.is_fresh():
+            return self.get()
+        return await run_db(self.get)
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._entry = None
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+supervisors_cache = CachedLookup(get_all_supervisors, SUPERVISORS_CACHE_TTL, name="supervisors")
+
+# With several worker processes each one has its own caches; a write made by one
+# reaches the others through Cache_Versions within CACHE_SYNC_INTERVAL seconds
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "2"))
+CACHE_VERSIONED_TABLES = {"settings": "Settings", "supervisors": "Supervisors"}
+
+def ensure_cache_versions_schema(cursor):
+    """Creates Cache_Versions and the triggers that bump a row whenever its table changes, in any process."""
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Supervisors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE NOT NULL,
-            username TEXT,
-            full_name TEXT,
-            password TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
+        CREATE TABLE IF NOT EXISTS Cache_Versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
     """)
+    for name, table in CACHE_VERSIONED_TABLES.items():
+        cursor.execute("INSERT OR IGNORE INTO Cache_Versions (name) VALUES (?)", (name,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {name}_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE Cache_Versions SET version = version + 1 WHERE name = '{name}';
+                END
+            """)
+
+def read_cache_versions() -> dict:
+    with get_db_connection() as conn:
+        return dict(conn.execute("SELECT name, version FROM Cache_Versions").fetchall())
+
+class CacheSync:
+    """Invalidates this process's caches when another worker process changes the rows behind them.
+
+    Every `interval` seconds the two-row Cache_Versions table is read, and the
+    listeners of each name whose version moved since the last read are
+    called (plain functions or coroutine functions). The first read calls
+    every listener, so nothing loaded before the sync started can linger.
+    """
+
+    def __init__(self, interval: float = CACHE_SYNC_INTERVAL):
+        self.interval = interval
+        self._listeners = {} # name -> [listener]
+        self._versions = {}
+        self._task = None
+
+    def on(self, name: str, listener) -> None:
+        self._listeners.setdefault(name, []).append(listener)
+
+    async def check(self) -> None:
+        versions = await run_db(read_cache_versions)
+        for name, version in versions.items():
+            if version != self._versions.get(name):
+                for listener in self._listeners.get(name, ()):
+                    result = listener()
+                    if inspect.isawaitable(result):
+                        await result
+        self._versions = versions
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                logging.exception("Syncing caches with the other workers failed")
+            await asyncio.sleep(self.interval)
+# --- End cache.py content ---
+
+# --- jobs.py content ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "3"))
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "5"))
+
+class JobLimitError(Exception):
+    pass
+
+@dataclass
+class Job:
+    id: int
+    owner_id: int
+    description: str
+    status: str = "queued" # queued, running, done, failed
+    progress: str = ""
+    result: object = None
+    error: str = None
+    created_at: float = field(default_factory=time.monotonic)
+
+class JobManager:
+    """Runs file imports and exports on their own small thread pool, off the event loop.
+
+    At most `workers` jobs run at once, so long imports can only ever hold that
+    many pooled DB connections, and each user may have at most
+    `per_user_limit` unfinished jobs. A job function receives a `progress`
+    keyword argument that it can call with a status line from its worker thread.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, per_user_limit: int = MAX_JOBS_PER_USER,
+                 progress_interval: float = JOB_PROGRESS_INTERVAL):
+        self.per_user_limit = per_user_limit
+        self.progress_interval = progress_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._ids = itertools.count(1)
+        self._jobs = {}
+
+    def active_jobs(self, owner_id: int = None) -> list:
+        return [job for job in self._jobs.values() if owner_id is None or job.owner_id == owner_id]
+
+    def submit(self, owner_id: int, description: str, func, *args, on_progress=None, on_done=None, **kwargs) -> Job:
+        """Queues `func(*args, progress=..., **kwargs)` and returns its Job right away.
+
+        `on_progress(job)` and `on_done(job)` are coroutine functions awaited on
+        the event loop; progress reports are throttled to one per `progress_interval`.
+        """
+        if len(self.active_jobs(owner_id)) >= self.per_user_limit:
+            raise JobLimitError(f"لديك {self.per_user_limit} مهام قيد التنفيذ بالفعل. يرجى الانتظار حتى تنتهي.")
+
+        job = Job(id=next(self._ids), owner_id=owner_id, description=description)
+        self._jobs[job.id] = job
+        loop = asyncio.get_running_loop()
+        last_report = [0.0]
+
+        def progress(text: str):
+            job.progress = text
+            now = time.monotonic()
+            if on_progress and now - last_report[0] >= self.progress_interval:
+                last_report[0] = now
+                asyncio.run_coroutine_threadsafe(on_progress(job), loop)
+
+        def run():
+            job.status = "running"
+            return func(*args, progress=progress, **kwargs)
+
+        future = loop.run_in_executor(self._executor, run)
+        asyncio.ensure_future(self._finish(job, future, on_done))
+        return job
+
+    async def _finish(self, job: Job, future, on_done):
+        try:
+            job.result = await future
+            job.status = "done"
+        except Exception as e:
+            logging.exception("Job #%d (%s) failed", job.id, job.description)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            self._jobs.pop(job.id, None)
+        if on_done:
+            try:
+                await on_done(job)
+            except Exception:
+                logging.exception("Completion callback of job #%d failed", job.id)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+job_manager = JobManager()
+# --- End jobs.py content ---
+
+# --- fsm_storage.py content ---
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite") # sqlite, memory or a redis:// URL
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+FSM_SESSION_TTL = float(os.getenv("FSM_SESSION_TTL", str(7 * 24 * 3600))) # idle conversations are dropped after this
+FSM_MEMORY_TTL = float(os.getenv("FSM_MEMORY_TTL", "900")) # idle conversations leave memory (not the DB) after this
+FSM_COMPRESS_MIN_SIZE = 512
+
+def encode_fsm_data(data: dict) -> bytes:
+    """Compact JSON; zlib-compressed once it gets big (a finished 17-step form)."""
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(raw) >= FSM_COMPRESS_MIN_SIZE:
+        return b"z" + zlib.compress(raw)
+    return b"j" + raw
+
+def decode_fsm_data(blob: bytes) -> dict:
+    if not blob:
+        return {}
+    raw = zlib.decompress(blob[1:]) if blob[:1] == b"z" else blob[1:]
+    return json.loads(raw)
+
+def load_fsm_record(storage_key: str):
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT state, data, updated_at FROM FSM_Storage WHERE storage_key = ?",
+                           (storage_key,)).fetchone()
+    return tuple(row) if row else None
+
+def write_fsm_records(upserts: list, deletes: list) -> None:
+    """Writes a batch of (storage_key, state, data, updated_at) rows and removes finished conversations."""
+    with get_db_connection() as conn:
+        conn.executemany("""
+            INSERT INTO FSM_Storage (storage_key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(storage_key) DO UPDATE SET
+                state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+        """, upserts)
+        conn.executemany("DELETE FROM FSM_Storage WHERE storage_key = ?", [(key,) for key in deletes])
+        conn.commit()
 
-    # Insert default settings if they don\'t exist
-    cursor.execute("INSERT OR IGNORE INTO Settings (setting_name, setting_value) VALUES (?, ?)", ("form_status", "open"))
+def delete_expired_fsm_records(before: float) -> int:
+    with get_db_connection() as conn:
+        cursor = conn.execute("DELETE FROM FSM_Storage WHERE updated_at < ?", (before,))
+        conn.commit()
+        return cursor.rowcount
+
+class _FSMRecord:
+    __slots__ = ("state", "data", "updated_at", "touched_at")
+
+    def __init__(self, state=None, data=None, updated_at=0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at # wall clock, persisted
+        self.touched_at = time.monotonic() # last access, for evicting it from memory
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage kept in the bot's SQLite file, so a restart doesn't lose half-filled forms.
+
+    Conversations are served from memory: get/set/update_data never wait for
+    the database. Changed conversations are written back in one transaction
+    every `flush_interval` seconds (and on close), so a crash loses at most
+    that much input. A conversation is read from the DB only the first time
+    it is touched after a restart or after it left memory.
+    """
+
+    def __init__(self, flush_interval: float = FSM_FLUSH_INTERVAL, ttl: float = FSM_SESSION_TTL,
+                 memory_ttl: float = FSM_MEMORY_TTL, key_builder: KeyBuilder = None):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.memory_ttl = memory_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._records = {}
+        self._loading = {}
+        self._dirty = set()
+        self._flusher = None
+        self._last_expiry = 0.0
+
+    async def _record(self, key: StorageKey) -> _FSMRecord:
+        storage_key = self.key_builder.build(key)
+        record = self._records.get(storage_key)
+        if record is None:
+            # Concurrent updates from the same user share one DB read
+            loading = self._loading.get(storage_key)
+            if loading is None:
+                loading = self._loading[storage_key] = asyncio.ensure_future(run_db(load_fsm_record, storage_key))
+            try:
+                row = await loading
+            finally:
+                self._loading.pop(storage_key, None)
+            record = self._records.get(storage_key)
+            if record is None:
+                if row and (not self.ttl or row[2] >= time.time() - self.ttl):
+                    record = _FSMRecord(row[0], decode_fsm_data(row[1]), row[2])
+                else:
+                    record = _FSMRecord()
+                self._records[storage_key] = record
+        record.touched_at = time.monotonic()
+        return record
+
+    def _changed(self, key: StorageKey, record: _FSMRecord) -> None:
+        record.updated_at = time.time()
+        self._dirty.add(self.key_builder.build(key))
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._changed(key, record)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = await self._record(key)
+        record.data = data.copy()
+        self._changed(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return (await self._record(key)).data.copy()
+
+    async def set_state_and_data(self, key: StorageKey, state: StateType, data: dict) -> None:
+        """set_state() and set_data() as one change of the conversation."""
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        record.data = dict(data)
+        self._changed(key, record)
+
+    async def _flush_loop(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+                await self._expire()
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self) -> None:
+        """Writes every conversation changed since the last flush."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for storage_key in dirty:
+            record = self._records.get(storage_key)
+            if record is None or (record.state is None and not record.data):
+                deletes.append(storage_key) # finished or cleared conversations take no space
+            else:
+                upserts.append((storage_key, record.state, encode_fsm_data(record.data), record.updated_at))
+        try:
+            await run_db(write_fsm_records, upserts, deletes)
+        except BaseException as e: # cancelled mid-write too: the keys must not be lost
+            self._dirty |= dirty
+            if not isinstance(e, Exception):
+                raise
+            logging.exception("Saving %d FSM conversations failed, retrying on the next flush", len(dirty))
+
+    async def _expire(self) -> None:
+        now = time.monotonic()
+        if now - self._last_expiry < min(self.memory_ttl, 60):
+            return
+        self._last_expiry = now
+        for storage_key, record in list(self._records.items()):
+            if storage_key not in self._dirty and now - record.touched_at > self.memory_ttl:
+                del self._records[storage_key]
+        if self.ttl:
+            try:
+                removed = await run_db(delete_expired_fsm_records, time.time() - self.ttl)
+            except Exception:
+                logging.exception("Removing expired FSM conversations failed")
+            else:
+                if removed:
+                    logging.info("Removed %d FSM conversations idle for over %d seconds", removed, self.ttl)
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            # Let a flush cut short by the cancellation put its keys back before the last one runs
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+def create_fsm_storage(setting: str = FSM_STORAGE) -> BaseStorage:
+    """Builds the storage named by FSM_STORAGE; a redis:// URL needs the optional `redis` package."""
+    if setting == "memory":
+        return MemoryStorage()
+    if setting.startswith(("redis://", "rediss://", "unix://")):
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(setting, state_ttl=int(FSM_SESSION_TTL), data_ttl=int(FSM_SESSION_TTL))
+    return SQLiteStorage()
+# --- End fsm_storage.py content ---
+
+# --- create_db.py content (integrated as a function) ---
+def create_database():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Students (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE,
+                full_name TEXT NOT NULL,
+                dob TEXT,
+                grade TEXT,
+                section TEXT,
+                student_number INTEGER UNIQUE,
+                phone_number TEXT,
+                parent_phone_number TEXT,
+                middle_school TEXT,
+                location_link TEXT,
+                address_description TEXT,
+                personal_photo_path TEXT,
+                student_card_photo_path TEXT,
+                father_card_photo_path TEXT,
+                mother_card_photo_path TEXT,
+                status TEXT,
+                role TEXT,
+                academic_year TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                is_form_locked BOOLEAN DEFAULT FALSE,
+                can_view_data BOOLEAN DEFAULT TRUE
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Admission_Requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER,
+                full_name TEXT NOT NULL,
+                dob TEXT,
+                phone_number TEXT,
+                parent_phone_number TEXT,
+                middle_school TEXT,
+                location_link TEXT,
+                address_description TEXT,
+                personal_photo_path TEXT,
+                student_card_photo_path TEXT,
+                father_card_photo_path TEXT,
+                mother_card_photo_path TEXT,
+                status TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Settings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                setting_name TEXT UNIQUE NOT NULL,
+                setting_value TEXT
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Supervisors (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE NOT NULL,
+                username TEXT,
+                full_name TEXT,
+                password TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Insert default settings if they don\'t exist
+        cursor.execute("INSERT OR IGNORE INTO Settings (setting_name, setting_value) VALUES (?, ?)", ("form_status", "open"))
 
-    conn.commit()
-    conn.close()
+        conn.commit()
+        run_migrations(conn)
 # --- End create_db.py content ---
 
+# --- auth.py content ---
+# Supervisor passwords are stored as salted scrypt hashes, "scrypt$n$r$p$salt$hash".
+# A successful login opens an in-memory session, so the admin menu never touches
+# the database or the hash again until it expires; repeated failures lock the
+# account out before any hashing is done.
+AUTH_SCRYPT_N = int(os.getenv("AUTH_SCRYPT_N", str(2 ** 14))) # ~16 MiB and a few tens of ms per hash
+AUTH_SCRYPT_R = 8
+AUTH_SCRYPT_P = 1
+AUTH_SALT_BYTES = 16
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2")) # hashes computed at once
+AUTH_SESSION_TTL = float(os.getenv("AUTH_SESSION_TTL", str(8 * 3600)))
+AUTH_MAX_FAILURES = int(os.getenv("AUTH_MAX_FAILURES", "5"))
+AUTH_LOCKOUT = float(os.getenv("AUTH_LOCKOUT", "900")) # seconds; failures older than this are forgotten
+AUTH_MAX_TRACKED = 10000 # users with failed logins remembered at once
+PASSWORD_HASH_SCHEME = "scrypt"
+
+def hash_password(password: str, n: int = AUTH_SCRYPT_N) -> str:
+    salt = secrets.token_bytes(AUTH_SALT_BYTES)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=AUTH_SCRYPT_R, p=AUTH_SCRYPT_P,
+                            maxmem=256 * AUTH_SCRYPT_R * n)
+    return "$".join((PASSWORD_HASH_SCHEME, str(n), str(AUTH_SCRYPT_R), str(AUTH_SCRYPT_P), salt.hex(), digest.hex()))
+
+def is_password_hash(value) -> bool:
+    return isinstance(value, str) and value.startswith(PASSWORD_HASH_SCHEME + "$")
+
+def verify_password(password: str, stored: str) -> bool:
+    """Checks `password` against a hash_password() string in constant time. Anything else never matches."""
+    if not is_password_hash(stored):
+        return False
+    try:
+        _, n, r, p, salt, expected = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=n, r=r, p=p,
+                                maxmem=256 * r * n, dklen=len(expected) // 2)
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest.hex(), expected)
+
+def password_needs_rehash(stored: str) -> bool:
+    return stored.split("$")[1:4] != [str(AUTH_SCRYPT_N), str(AUTH_SCRYPT_R), str(AUTH_SCRYPT_P)]
+
+def hash_supervisor_passwords(cursor):
+    """Replaces the plaintext passwords left in Supervisors by their hashes."""
+    rows = cursor.execute("SELECT id, password FROM Supervisors").fetchall()
+    cursor.executemany("UPDATE Supervisors SET password = ? WHERE id = ?",
+                       [(hash_password(password), id) for id, password in rows if not is_password_hash(password)])
+
+class Authenticator:
+    """Logs admins and supervisors in, and remembers who is logged in and who keeps failing.
+
+    The admin logs in with ADMIN_PASSWORD, a supervisor with the password
+    stored for their telegram_id. A login opens a session for `session_ttl`
+    seconds; role() is then a dict lookup. After `max_failures` wrong
+    passwords in a row a user is locked out for `lockout` seconds, and
+    login() refuses them without reading the database or hashing anything.
+    Hashes run on their own small thread pool, so a burst of logins can't
+    take over the DB threads or the event loop.
+    """
+
+    def __init__(self, session_ttl: float = AUTH_SESSION_TTL, max_failures: int = AUTH_MAX_FAILURES,
+                 lockout: float = AUTH_LOCKOUT, workers: int = AUTH_HASH_WORKERS):
+        self.session_ttl = session_ttl
+        self.max_failures = max_failures
+        self.lockout = lockout
+        self._sessions = {} # telegram_id -> (role, monotonic expiry)
+        self._failures = {} # telegram_id -> (consecutive failures, monotonic time they are forgotten)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth")
+
+    def role(self, telegram_id: int):
+        """"admin" or "supervisor" while telegram_id has a live session, else None."""
+        session = self._sessions.get(telegram_id)
+        if session is None:
+            return None
+        if session[1] <= time.monotonic():
+            del self._sessions[telegram_id]
+            return None
+        return session[0]
+
+    def logout(self, telegram_id: int) -> None:
+        self._sessions.pop(telegram_id, None)
+
+    async def drop_removed_supervisors(self) -> None:
+        """Ends the sessions of supervisors who are no longer in Supervisors (removed by another process)."""
+        supervisor_ids = {row[0] for row in await supervisors_cache.aget()}
+        for telegram_id, (role, _) in list(self._sessions.items()):
+            if role == "supervisor" and telegram_id not in supervisor_ids:
+                del self._sessions[telegram_id]
+
+    def locked_for(self, telegram_id: int) -> float:
+        """Seconds until telegram_id may try to log in again; 0 if it may now."""
+        failures, until = self._failures.get(telegram_id, (0, 0))
+        wait = until - time.monotonic()
+        return wait if failures >= self.max_failures and wait > 0 else 0
+
+    async def hash(self, password: str) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, hash_password, password)
+
+    async def login(self, telegram_id: int, password: str):
+        """Opens a session and returns its role if `password` is right, else counts a failure and returns None.
+
+        Callers check locked_for() first; a locked-out user is refused here too.
+        """
+        if self.locked_for(telegram_id):
+            return None
+        role = None
+        if hmac.compare_digest(password.encode(), ADMIN_PASSWORD.encode()):
+            role = "admin"
+        else:
+            stored = await run_db(get_supervisor_password_hash, telegram_id)
+            loop = asyncio.get_running_loop()
+            if stored and not is_password_hash(stored):
+                # Written by hand or restored from a backup after migration 8: hash it on its first login
+                if hmac.compare_digest(password.encode(), stored.encode()):
+                    role = "supervisor"
+                    await run_db(set_supervisor_password_hash, telegram_id, await self.hash(password))
+            elif stored and await loop.run_in_executor(self._executor, verify_password, password, stored):
+                role = "supervisor"
+                if password_needs_rehash(stored):
+                    await run_db(set_supervisor_password_hash, telegram_id, await self.hash(password))
+        if role is None:
+            self._record_failure(telegram_id)
+            return None
+        self._failures.pop(telegram_id, None)
+        self._sessions[telegram_id] = (role, time.monotonic() + self.session_ttl)
+        return role
+
+    def _record_failure(self, telegram_id: int) -> None:
+        now = time.monotonic()
+        failures, until = self._failures.pop(telegram_id, (0, 0))
+        if until <= now:
+            failures = 0
+        if len(self._failures) >= AUTH_MAX_TRACKED:
+            self._failures = {uid: entry for uid, entry in self._failures.items() if entry[1] > now}
+            while len(self._failures) >= AUTH_MAX_TRACKED:
+                del self._failures[next(iter(self._failures))]
+        self._failures[telegram_id] = (failures + 1, now + self.lockout)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+class AuthMiddleware(BaseMiddleware):
+    """Lets updates reach the admin menu's handlers only while their sender has a live login session.
+
+    Every Admin state but the password prompt needs a session; handlers
+    flagged {"auth": "admin"} need the admin's. A user whose session expired
+    (or was lost in a restart) is sent back to the login.
+    """
+
+    def __init__(self, auth: Authenticator):
+        self.auth = auth
+
+    async def __call__(self, handler, event, data):
+        required = get_flag(data, "auth")
+        raw_state = data.get("raw_state") or ""
+        if required is None:
+            if not raw_state.startswith(Admin.__full_group_name__ + ":") or raw_state == Admin.waiting_for_password.state:
+                return await handler(event, data)
+        user = data.get("event_from_user")
+        role = self.auth.role(user.id) if user else None
+        if role is None:
+            await data["state"].clear()
+            await event.answer("انتهت جلسة المشرف. يرجى تسجيل الدخول مجدداً.")
+            return None
+        if required == "admin" and role != "admin":
+            await event.answer("هذا الخيار متاح لمدير النظام فقط.")
+            return None
+        return await handler(event, data)
+# --- End auth.py content ---
+
+# --- migrations.py content ---
+# Ordered schema changes applied on top of the tables in create_database().
+# Each step runs once, in its own transaction, and bumps PRAGMA user_version
+# to its number. Append new steps; never edit or reorder shipped ones.
+MIGRATIONS = [
+    (1, "name search key and trigram index", ensure_search_schema),
+    (2, "indexes for hot lookups", [
+        "DROP INDEX IF EXISTS idx_students_name_key", # superseded by idx_students_name_key_telegram_id
+        "CREATE INDEX IF NOT EXISTS idx_students_grade_section_year ON Students(grade, section, academic_year)",
+        "CREATE INDEX IF NOT EXISTS idx_admission_requests_telegram_id ON Admission_Requests(telegram_id)",
+    ]),
+    (3, "persistent FSM storage", [
+        """CREATE TABLE IF NOT EXISTS FSM_Storage (
+            storage_key TEXT PRIMARY KEY,
+            state TEXT,
+            data BLOB,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON FSM_Storage(updated_at)",
+    ]),
+    (4, "trigger-maintained statistics", ensure_stats_schema),
+    (5, "notification outbox", [
+        """CREATE TABLE IF NOT EXISTS Notification_Outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_notification_outbox_recipient ON Notification_Outbox(recipient_id, id)",
+    ]),
+    (6, "content-addressed photo store", ensure_photo_store_schema),
+    (7, "admission request review", [
+        "ALTER TABLE Admission_Requests ADD COLUMN reviewed_by INTEGER",
+        "ALTER TABLE Admission_Requests ADD COLUMN reviewed_at DATETIME",
+        "CREATE INDEX IF NOT EXISTS idx_admission_requests_review ON Admission_Requests(status, created_at, id)",
+    ]),
+    (8, "hashed supervisor passwords", hash_supervisor_passwords),
+    (9, "student statistics trigger tracks dob", rebuild_student_stats),
+    (10, "cache versions shared by worker processes", ensure_cache_versions_schema),
+]
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations(conn, migrations=MIGRATIONS) -> int:
+    """Applies the migrations newer than the database's user_version. Returns the resulting version.
+
+    The version is re-read under BEGIN IMMEDIATE, so several processes starting
+    at once apply each step exactly once while the others wait on the lock.
+    """
+    for version, description, step in migrations:
+        if version <= get_schema_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version > get_schema_version(conn):
+                cursor = conn.cursor()
+                if callable(step):
+                    step(cursor)
+                else:
+                    for statement in step:
+                        cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                logging.info("Applied migration %d: %s", version, description)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return get_schema_version(conn)
+
+# Every query the bot runs against its tables, with sample parameters, so
+# check_query_plans() can prove each one is answered from an index (no SCAN
+# step at all). test_query_plans.py traces the statements the bot actually
+# issues and fails on any scan not listed in FULL_SCAN_QUERIES.
+INDEXED_QUERIES = {
+    "update_setting": ("UPDATE Settings SET setting_value = ? WHERE setting_name = ?", ("open", "form_status")),
+    "search_students (exact)": ("SELECT id, full_name, name_key FROM Students WHERE name_key = ? LIMIT ?", ("x", 5)),
+    "search_students (fuzzy)": ("""
+        SELECT s.id, s.full_name, s.name_key FROM Students_fts
+        JOIN Students s ON s.id = Students_fts.rowid
+        WHERE Students_fts MATCH ? ORDER BY rank LIMIT ?
+    """, ('"xyz"', 50)),
+    "merge_student_rows (update)": ("UPDATE Students SET grade = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                                    ("x", 1)),
+    "get_student_statistics (admissions)": (
+        "SELECT day, requests FROM Admission_Stats WHERE day >= date('now', ?) ORDER BY day", ("-13 days",)),
+    "export_students (filtered)": ("SELECT * FROM Students WHERE grade = ? AND section = ? ORDER BY id", ("x", "x")),
+    "add_supervisor": ("INSERT INTO Supervisors (telegram_id, username, full_name, password) VALUES (?, ?, ?, ?)",
+                       (1, "x", "x", "x")),
+    "remove_supervisor": ("DELETE FROM Supervisors WHERE telegram_id = ?", (1,)),
+    "get_supervisor_password_hash": ("SELECT password FROM Supervisors WHERE telegram_id = ?", (1,)),
+    "set_supervisor_password_hash": ("UPDATE Supervisors SET password = ? WHERE telegram_id = ?", ("x", 1)),
+    "is_student_number_taken": ("SELECT 1 FROM Students WHERE student_number = ?", (1,)),
+    "find_student_by_id": ("SELECT * FROM Students WHERE id = ?", (1,)),
+    "find_student_by_telegram_id": ("SELECT * FROM Students WHERE telegram_id = ?", (1,)),
+    "save_student_form (lookup)": ("SELECT id FROM Students WHERE name_key = ? AND telegram_id IS NULL", ("x",)),
+    "save_student_form (update)": ("UPDATE Students SET dob = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?", ("x", 1)),
+    "toggle_student_view_permission": ("SELECT id, full_name, can_view_data FROM Students WHERE id = ?", (1,)),
+    "toggle_student_view_permission (update)": ("UPDATE Students SET can_view_data = ? WHERE id = ?", (1, 1)),
+    "student stats triggers": ("""
+        UPDATE Student_Stats SET students = students - 1
+        WHERE (grade, section, academic_year, status, is_complete) = (?, ?, ?, ?, ?)
+    """, ("x", "x", "x", "x", 1)),
+    "admission stats triggers": ("UPDATE Admission_Stats SET requests = requests - 1 WHERE day = date(?)", ("x",)),
+    "cache version triggers": ("UPDATE Cache_Versions SET version = version + 1 WHERE name = ?", ("settings",)),
+    "load_fsm_record": ("SELECT state, data, updated_at FROM FSM_Storage WHERE storage_key = ?", ("fsm:1:1:default",)),
+    "write_fsm_records (upsert)": ("""
+        INSERT INTO FSM_Storage (storage_key, state, data, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(storage_key) DO UPDATE SET
+            state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+    """, ("fsm:1:1:default", "x", b"", 0.0)),
+    "write_fsm_records (delete)": ("DELETE FROM FSM_Storage WHERE storage_key = ?", ("fsm:1:1:default",)),
+    "delete_expired_fsm_records": ("DELETE FROM FSM_Storage WHERE updated_at < ?", (0.0,)),
+    "enqueue_notification": (
+        "INSERT INTO Notification_Outbox (recipient_id, kind, text, created_at) VALUES (?, ?, ?, ?)", (1, "x", "x", 0.0)),
+    "finish_notifications (delete)": ("DELETE FROM Notification_Outbox WHERE id = ?", (1,)),
+    "finish_notifications (retry)": ("UPDATE Notification_Outbox SET attempts = attempts + 1 WHERE id = ?", (1,)),
+    "finish_notifications (give up)": ("DELETE FROM Notification_Outbox WHERE id = ? AND attempts >= ?", (1, 5)),
+    "register_photo": ("""
+        INSERT INTO Photos (digest, path, size) VALUES (?, ?, ?)
+        ON CONFLICT(digest) DO UPDATE SET touched_at = CURRENT_TIMESTAMP
+    """, ("x", "x", 1)),
+    "get_admission_page (first)": ("""
+        SELECT id, full_name, phone_number, middle_school, created_at FROM Admission_Requests
+        WHERE status = ? ORDER BY created_at, id LIMIT ?
+    """, ("x", 10)),
+    "get_admission_page (next)": ("""
+        SELECT id, full_name, phone_number, middle_school, created_at FROM Admission_Requests
+        WHERE status = ? AND (created_at, id) > (?, ?)
+        ORDER BY created_at ASC, id ASC LIMIT ?
+    """, ("x", "x", 1, 10)),
+    "get_admission_page (previous)": ("""
+        SELECT id, full_name, phone_number, middle_school, created_at FROM Admission_Requests
+        WHERE status = ? AND (created_at, id) < (?, ?)
+        ORDER BY created_at DESC, id DESC LIMIT ?
+    """, ("x", "x", 1, 10)),
+    "find_admission_request": ("SELECT * FROM Admission_Requests WHERE id = ?", (1,)),
+    "review_admission_requests (lookup)": (
+        "SELECT * FROM Admission_Requests WHERE id IN (?, ?) AND status = ?", (1, 2, "x")),
+    "review_admission_requests (taken)": ("SELECT telegram_id FROM Students WHERE telegram_id IN (?, ?)", (1, 2)),
+    "review_admission_requests (status)": ("""
+        UPDATE Admission_Requests SET status = ?, reviewed_by = ?, reviewed_at = CURRENT_TIMESTAMP WHERE id = ?
+    """, ("x", 1, 1)),
+    "photo refcount triggers": ("UPDATE Photos SET refcount = refcount + 1 WHERE path = ?", ("x",)),
+    "collect_photo_garbage": (
+        "DELETE FROM Photos WHERE refcount <= 0 AND touched_at < datetime('now', ?) RETURNING digest, path, size",
+        ("-7 days",)),
+}
+
+# Queries that read a whole table (or index) on purpose
+FULL_SCAN_QUERIES = {
+    "import_student_names (prefetch)": ("SELECT name_key FROM Students", ()), # walks the covering name_key index
+    "read_cache_versions": ("SELECT name, version FROM Cache_Versions", ()), # one row per cached table
+    # Everything in the outbox is pending work; the walk follows the recipient index and stops at the LIMIT
+    "fetch_pending_notifications": ("""
+        SELECT id, recipient_id, kind, text, created_at FROM Notification_Outbox
+        ORDER BY recipient_id, id LIMIT ?
+    """, (500,)),
+    "export_students (all)": ("SELECT * FROM Students ORDER BY id", ()),
+    "get_all_supervisors": ("SELECT telegram_id, username, full_name FROM Supervisors", ()),
+    "load_settings": ("SELECT setting_name, setting_value FROM Settings", ()),
+    "get_student_statistics": ( # one row per combination
+        "SELECT grade, section, academic_year, status, is_complete, students FROM Student_Stats WHERE students > 0", ()),
+    "collect_photo_garbage (known)": ("SELECT digest FROM Photos", ()),
+    "merge_student_rows (current)": (f"SELECT id, name_key, {', '.join(MERGE_COLUMNS)} FROM Students", ()),
+}
+
+def explain_query(conn, sql: str, params=()) -> list:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def is_scan_step(step: str) -> bool:
+    """A SCAN step walks a whole table or index, even "USING (COVERING) INDEX". Only a virtual table's
+    own index (an FTS5 MATCH, say) is a lookup."""
+    if not step.startswith("SCAN "):
+        return False
+    return " VIRTUAL TABLE INDEX " not in step or " VIRTUAL TABLE INDEX 0:" in step
+
+def check_query_plans() -> list:
+    """Returns (name, plan) for every query in INDEXED_QUERIES whose plan has a SCAN step.
+
+    Queries that are meant to read everything belong in FULL_SCAN_QUERIES instead.
+    """
+    problems = []
+    with get_db_connection() as conn:
+        for name, (sql, params) in INDEXED_QUERIES.items():
+            plan = explain_query(conn, sql, params)
+            if any(is_scan_step(step) for step in plan):
+                problems.append((name, plan))
+    return problems
+
+def print_query_plans() -> bool:
+    """Prints the plan of every known query; returns False if an indexed query scans a table."""
+    with get_db_connection() as conn:
+        for queries in (INDEXED_QUERIES, FULL_SCAN_QUERIES):
+            for name, (sql, params) in queries.items():
+                print(f"{name}: {' | '.join(explain_query(conn, sql, params))}")
+    problems = check_query_plans()
+    for name, plan in problems:
+        print(f"NOT INDEXED: {name}: {' | '.join(plan)}")
+    return not problems
+# --- End migrations.py content ---
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
 # Admin Telegram ID (replace with actual admin ID)
 ADMIN_TELEGRAM_ID = 1738750806 # TODO: Replace with actual admin Telegram ID
-ADMIN_PASSWORD = "1526374850"
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "1526374850")
+
+def load_settings():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT setting_name, setting_value FROM Settings")
+        return dict(cursor.fetchall())
+
+# The whole Settings table is read once and served from memory until update_setting() changes it
+settings_cache = CachedLookup(load_settings, SETTINGS_CACHE_TTL, name="settings")
 
 # Helper function to get setting from DB
 def get_setting(setting_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT setting_value FROM Settings WHERE setting_name = ?", (setting_name,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+    return settings_cache.get().get(setting_name)
+
+async def get_setting_async(setting_name):
+    return (await settings_cache.aget()).get(setting_name)
 
 # Helper function to update setting in DB
 def update_setting(setting_name, setting_value):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE Settings SET setting_value = ? WHERE setting_name = ?", (setting_value, setting_name))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE Settings SET setting_value = ? WHERE setting_name = ?", (setting_value, setting_name))
+        conn.commit()
+    settings_cache.invalidate()
+
+# --- notifications.py content ---
+NOTIFY_DIGEST_INTERVAL = float(os.getenv("NOTIFY_DIGEST_INTERVAL", "60"))
+NOTIFY_BATCH_SIZE = 500
+NOTIFY_MAX_ATTEMPTS = 5
+TELEGRAM_MESSAGE_LIMIT = 4096
+NOTIFICATION_TITLES = {
+    "contact": "رسائل من المستخدمين",
+    "admission": "طلبات تقديم جديدة",
+}
+
+def notification_recipients() -> list:
+    """The admin and every supervisor, each once."""
+    recipients = [ADMIN_TELEGRAM_ID]
+    for supervisor in supervisors_cache.get():
+        if supervisor[0] not in recipients:
+            recipients.append(supervisor[0])
+    return recipients
+
+def enqueue_notification(kind: str, text: str) -> None:
+    """Stores one copy of the notification per recipient; NotificationQueue delivers them later."""
+    now = time.time()
+    # Resolved before checking out a connection: a cold supervisors_cache loads through a pooled connection of its own
+    rows = [(recipient, kind, text, now) for recipient in notification_recipients()]
+    with get_db_connection() as conn:
+        conn.executemany("INSERT INTO Notification_Outbox (recipient_id, kind, text, created_at) VALUES (?, ?, ?, ?)",
+                         rows)
+        conn.commit()
 
-async def main() -> None:
-    # Ensure database is created before starting the bot
-    create_database()
+def fetch_pending_notifications(limit: int = NOTIFY_BATCH_SIZE) -> list:
+    with get_db_connection() as conn:
+        return conn.execute("""
+            SELECT id, recipient_id, kind, text, created_at FROM Notification_Outbox
+            ORDER BY recipient_id, id LIMIT ?
+        """, (limit,)).fetchall()
+
+def finish_notifications(delivered: list, failed: list, max_attempts: int = NOTIFY_MAX_ATTEMPTS) -> int:
+    """Deletes delivered rows and counts an attempt on failed ones; returns how many were given up on."""
+    with get_db_connection() as conn:
+        conn.executemany("DELETE FROM Notification_Outbox WHERE id = ?", [(id_,) for id_ in delivered])
+        conn.executemany("UPDATE Notification_Outbox SET attempts = attempts + 1 WHERE id = ?",
+                         [(id_,) for id_ in failed])
+        dropped = conn.executemany("DELETE FROM Notification_Outbox WHERE id = ? AND attempts >= ?",
+                                   [(id_, max_attempts) for id_ in failed]).rowcount
+        conn.commit()
+    return dropped
 
-    BOT_TOKEN = os.getenv("BOT_TOKEN")
-    if not BOT_TOKEN:
-        print("Error: BOT_TOKEN environment variable is not set. Please set it to run the bot.")
-        return
+def format_digest(rows: list) -> list:
+    """Groups one recipient's notifications by kind into messages that fit Telegram's length limit."""
+    sections = {}
+    for row in rows:
+        sent_at = datetime.fromtimestamp(row["created_at"]).strftime("%H:%M")
+        sections.setdefault(row["kind"], []).append(f"[{sent_at}] {row['text']}")
+
+    messages, current = [], ""
+    for kind, entries in sections.items():
+        blocks = [f"{NOTIFICATION_TITLES.get(kind, kind)} ({len(entries)}):"] + entries
+        for block in blocks:
+            block = block[:TELEGRAM_MESSAGE_LIMIT - 2]
+            if current and len(current) + len(block) + 2 > TELEGRAM_MESSAGE_LIMIT:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n\n{block}" if current else block
+    if current:
+        messages.append(current)
+    return messages
+
+class NotificationQueue:
+    """Sends the queued notifications as one digest per recipient every `interval` seconds.
+
+    The queue lives in Notification_Outbox, so undelivered notifications
+    survive a restart. Rows for a recipient who blocked the bot are dropped;
+    other failures are retried on later rounds, up to NOTIFY_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, bot: Bot, interval: float = NOTIFY_DIGEST_INTERVAL):
+        self.bot = bot
+        self.interval = interval
+        self._task = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.deliver()
+            except Exception:
+                logging.exception("Delivering notifications failed")
+            await asyncio.sleep(self.interval)
+
+    async def deliver(self) -> None:
+        while True:
+            rows = await run_db(fetch_pending_notifications)
+            if not rows:
+                return
+            by_recipient = {}
+            for row in rows:
+                by_recipient.setdefault(row["recipient_id"], []).append(row)
+
+            delivered, failed = [], []
+            for recipient, recipient_rows in by_recipient.items():
+                ids = [row["id"] for row in recipient_rows]
+                try:
+                    for text in format_digest(recipient_rows):
+                        await self.bot.send_message(recipient, text)
+                    delivered.extend(ids)
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    logging.warning("Dropping %d notifications for %s: %s", len(ids), recipient, e)
+                    delivered.extend(ids)
+                except Exception as e:
+                    logging.warning("Notifications for %s not delivered, will retry: %s", recipient, e)
+                    failed.extend(ids)
+
+            dropped = await run_db(finish_notifications, delivered, failed)
+            if dropped:
+                logging.warning("Gave up on %d notifications after %d attempts", dropped, NOTIFY_MAX_ATTEMPTS)
+            if failed or len(rows) < NOTIFY_BATCH_SIZE:
+                return
+# --- End notifications.py content ---
+
+# --- admission_review.py content ---
+ADMISSION_PENDING = "قيد المراجعة"
+ADMISSION_ACCEPTED = "مقبول"
+ADMISSION_REJECTED = "مرفوض"
+REVIEW_PAGE_SIZE = int(os.getenv("REVIEW_PAGE_SIZE", "10"))
+# Columns an accepted request carries over to its Students row
+ADMISSION_STUDENT_COLUMNS = (
+    "full_name", "dob", "phone_number", "parent_phone_number", "middle_school", "location_link",
+    "address_description", "personal_photo_path", "student_card_photo_path", "father_card_photo_path",
+    "mother_card_photo_path",
+)
+
+# direction -> (comparison with the anchor row, sort order)
+KEYSET_DIRECTIONS = {"from": (">=", "ASC"), "next": (">", "ASC"), "previous": ("<", "DESC")}
+
+def admission_anchor(row: dict) -> list:
+    """The (created_at, id) key of a listed request, kept in the reviewer's FSM data between pages."""
+    return [row["created_at"], row["id"]]
+
+def get_admission_page(status: str = ADMISSION_PENDING, anchor: list = None, direction: str = "from",
+                       limit: int = REVIEW_PAGE_SIZE) -> list:
+    """One page of requests in (created_at, id) order, positioned relative to `anchor`.
+
+    Keyset pagination: the page is found by seeking idx_admission_requests_review
+    to the anchor's key, so every page costs the same however far in it is.
+    The key is carried rather than looked up, so a page whose edge row was
+    just reviewed or deleted can still be redrawn or paged from it.
+    """
+    columns = "id, full_name, phone_number, middle_school, created_at"
+    with get_db_connection() as conn:
+        if anchor is None:
+            return [dict(row) for row in conn.execute(f"""
+                SELECT {columns} FROM Admission_Requests WHERE status = ? ORDER BY created_at, id LIMIT ?
+            """, (status, limit))]
+        comparison, order = KEYSET_DIRECTIONS[direction]
+        rows = conn.execute(f"""
+            SELECT {columns} FROM Admission_Requests
+            WHERE status = ? AND (created_at, id) {comparison} (?, ?)
+            ORDER BY created_at {order}, id {order} LIMIT ?
+        """, (status, *anchor, limit)).fetchall()
+    if order == "DESC":
+        rows.reverse()
+    return [dict(row) for row in rows]
+
+def has_admission_rows(status: str, anchor: list, direction: str) -> bool:
+    """Whether a page exists past the anchor, for drawing the paging buttons."""
+    return bool(get_admission_page(status, anchor, direction, limit=1))
+
+def find_admission_request(request_id: int):
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT * FROM Admission_Requests WHERE id = ?", (request_id,)).fetchone()
+    return dict(row) if row else None
+
+def review_admission_requests(request_ids: list, accept: bool, reviewer_id: int) -> list:
+    """Accepts or rejects the still-pending requests among `request_ids` in one transaction.
+
+    Accepted requests become Students rows. An applicant whose Telegram
+    account already belongs to a student gets a row without telegram_id, like
+    an imported name, instead of failing the whole batch. Returns the
+    (id, telegram_id, full_name) of every request that was reviewed.
+    """
+    if not request_ids:
+        return []
+    placeholders = ", ".join("?" * len(request_ids))
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(f"SELECT * FROM Admission_Requests WHERE id IN ({placeholders}) AND status = ?",
+                            (*request_ids, ADMISSION_PENDING)).fetchall()
+        if accept and rows:
+            telegram_ids = [row["telegram_id"] for row in rows if row["telegram_id"] is not None]
+            taken = {row[0] for row in conn.execute(
+                f"SELECT telegram_id FROM Students WHERE telegram_id IN ({', '.join('?' * len(telegram_ids))})",
+                telegram_ids
+            )} if telegram_ids else set()
+            new_students = []
+            for row in rows:
+                telegram_id = row["telegram_id"]
+                if telegram_id in taken:
+                    telegram_id = None
+                elif telegram_id is not None:
+                    taken.add(telegram_id) # the same applicant may have sent several requests
+                new_students.append((telegram_id, normalize_arabic_name(row["full_name"]),
+                                     *(row[column] for column in ADMISSION_STUDENT_COLUMNS)))
+            conn.executemany(f"""
+                INSERT INTO Students (telegram_id, name_key, {", ".join(ADMISSION_STUDENT_COLUMNS)})
+                VALUES ({", ".join("?" * (len(ADMISSION_STUDENT_COLUMNS) + 2))})
+            """, new_students)
+        conn.executemany("""
+            UPDATE Admission_Requests SET status = ?, reviewed_by = ?, reviewed_at = CURRENT_TIMESTAMP WHERE id = ?
+        """, [(ADMISSION_ACCEPTED if accept else ADMISSION_REJECTED, reviewer_id, row["id"]) for row in rows])
+        conn.commit()
+    return [(row["id"], row["telegram_id"], row["full_name"]) for row in rows]
+
+def format_admission_request(request: dict) -> str:
+    return (
+        f"طلب التقديم #{request['id']} ({request['status']})\n"
+        f"الاسم: {request['full_name']}\n"
+        f"تاريخ الميلاد: {request['dob'] or '-'}\n"
+        f"رقم الهاتف: {request['phone_number'] or '-'}\n"
+        f"رقم هاتف ولي الأمر: {request['parent_phone_number'] or '-'}\n"
+        f"المتوسطة: {request['middle_school'] or '-'}\n"
+        f"الموقع: {request['location_link'] or '-'}\n"
+        f"وصف السكن: {request['address_description'] or '-'}\n"
+        f"تاريخ التقديم: {request['created_at']}"
+    )
+
+# callback_data is limited to 64 bytes, so the buttons carry an action and at most a request id ("ar:t:1234").
+# The page anchor and the selection live in the reviewer's FSM data.
+def admission_page_keyboard(rows: list, selected: set, has_previous: bool, has_next: bool) -> types.InlineKeyboardMarkup:
+    keyboard = [
+        [
+            types.InlineKeyboardButton(text=f"{'☑' if row['id'] in selected else '☐'} {row['full_name']}",
+                                       callback_data=f"ar:t:{row['id']}"),
+            types.InlineKeyboardButton(text="عرض", callback_data=f"ar:v:{row['id']}"),
+        ]
+        for row in rows
+    ]
+    paging = []
+    if has_previous:
+        paging.append(types.InlineKeyboardButton(text="→ السابق", callback_data="ar:b"))
+    if has_next:
+        paging.append(types.InlineKeyboardButton(text="التالي ←", callback_data="ar:n"))
+    if paging:
+        keyboard.append(paging)
+    keyboard.append([types.InlineKeyboardButton(text="تحديد الصفحة", callback_data="ar:all"),
+                     types.InlineKeyboardButton(text="إلغاء التحديد", callback_data="ar:none")])
+    keyboard.append([types.InlineKeyboardButton(text=f"قبول المحدد ({len(selected)})", callback_data="ar:ok"),
+                     types.InlineKeyboardButton(text=f"رفض المحدد ({len(selected)})", callback_data="ar:no")])
+    return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def admission_request_keyboard(request_id: int) -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup(inline_keyboard=[[
+        types.InlineKeyboardButton(text="قبول", callback_data=f"ar:a:{request_id}"),
+        types.InlineKeyboardButton(text="رفض", callback_data=f"ar:r:{request_id}"),
+    ]])
+# --- End admission_review.py content ---
+
+# --- forms.py content ---
+class FieldError(ValueError):
+    """Raised by a field validator; the message is sent to the user as is."""
+
+@dataclass
+class FieldSpec:
+    """One step of a form: the data key it fills, how it asks, and how the answer is checked.
+
+    `validate(text, data)` returns the value to store or raises FieldError; it
+    may be a coroutine function. An answer outside `choices` is rejected with
+    `error`. `keyboard` (default: the choices) is offered as reply buttons;
+    answering `other_choice` asks `other_prompt` and waits for free text.
+    Photo fields store the path of the downloaded photo.
+    """
+    key: str
+    label: str
+    prompt: str
+    state: State
+    choices: tuple = ()
+    error: str = None
+    validate: object = None
+    keyboard: tuple = None
+    other_choice: str = None
+    other_prompt: str = None
+    photo: bool = False
+    in_review: bool = True
+    reply_markup: types.ReplyKeyboardMarkup = field(init=False, default=None)
+
+    def __post_init__(self):
+        buttons = self.keyboard if self.keyboard is not None else self.choices
+        if buttons:
+            self.reply_markup = types.ReplyKeyboardMarkup(
+                keyboard=[[types.KeyboardButton(text=text)] for text in buttons],
+                resize_keyboard=True,
+                one_time_keyboard=True
+            )
 
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
+    async def parse(self, message: types.Message, data: dict, bot: Bot):
+        """The value to store for the message, or None if it only asked for the free-text choice."""
+        if self.photo:
+            if not message.photo:
+                raise FieldError(f"يرجى إرسال {self.label}.")
+            path = await download_photo(message.photo[-1], bot)
+            if not path:
+                raise FieldError(f"حدث خطأ أثناء تحميل {self.label}. يرجى المحاولة مرة أخرى.")
+            return path
+        text = message.text
+        if text is None:
+            raise FieldError(self.error or self.prompt)
+        if self.other_choice is not None and text == self.other_choice:
+            return None
+        if self.choices and text not in self.choices:
+            raise FieldError(self.error)
+        if self.validate is None:
+            return text
+        value = self.validate(text, data)
+        return await value if inspect.isawaitable(value) else value
+
+class _ReviewValues(dict):
+    def __missing__(self, key):
+        return None
+
+class FormSpec:
+    """An ordered list of fields with its review message and keyboards built once.
+
+    Every state of the form is served by the same few handlers (see
+    register_form_handlers), which look the field up by the raw state name.
+    The last field's state doubles as the review state, as it always has.
+    """
+
+    def __init__(self, fields: list, edit_field: State, edit_value: State, review_title: str, edit_callback: str,
+                 submit_callback: str, edit_prompt: str):
+        self.fields = fields
+        self.edit_field = edit_field
+        self.edit_value = edit_value
+        self.review_title = review_title
+        self.edit_callback = edit_callback
+        self.edit_prompt = edit_prompt
+        self.steps = {spec.state.state: (index, spec) for index, spec in enumerate(fields)}
+        # Users answer the edit question with a label from the review; keys keep working too
+        self.by_label = {spec.key: spec for spec in fields}
+        self.by_label.update((spec.label, spec) for spec in fields)
+        self.review_template = "\n".join(f"{spec.label}: {{{spec.key}}}" for spec in fields if spec.in_review)
+        self.review_keyboard = types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [types.InlineKeyboardButton(text="تعديل قبل الإرسال", callback_data=edit_callback)],
+                [types.InlineKeyboardButton(text="تأكيد وإرسال", callback_data=submit_callback)]
+            ]
+        )
+        self.edit_keyboard = types.ReplyKeyboardMarkup(
+            keyboard=[[types.KeyboardButton(text=spec.label)] for spec in fields],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        )
+
+    @property
+    def review_state(self) -> State:
+        return self.fields[-1].state
+
+    async def in_step(self, event, raw_state: str = None) -> bool:
+        """Handler filter: one dict lookup instead of a State filter per field. A coroutine, since aiogram
+        runs plain-function filters in a worker thread."""
+        return raw_state in self.steps
+
+    def render_review(self, data: dict) -> str:
+        return self.review_template.format_map(_ReviewValues(data))
+
+async def save_form_step(state: FSMContext, next_state: State, data: dict) -> None:
+    """Stores the next state and the form data, as a single write where the storage supports it."""
+    if isinstance(state.storage, SQLiteStorage):
+        await state.storage.set_state_and_data(state.key, next_state, data)
+    else:
+        await state.set_data(data)
+        await state.set_state(next_state)
+
+def validate_date(text: str, data: dict) -> str:
+    try:
+        datetime.strptime(text, "%Y-%m-%d")
+    except ValueError:
+        raise FieldError("صيغة تاريخ الميلاد غير صحيحة. يرجى استخدام الصيغة YYYY-MM-DD (مثال: 2005-01-15):")
+    return text
+
+async def validate_student_number(text: str, data: dict) -> int:
+    try:
+        number = int(text)
+    except ValueError:
+        raise FieldError("الرقم غير صحيح. يرجى إدخال رقم:")
+    if not 1 <= number <= 1000:
+        raise FieldError("الرقم يجب أن يكون بين 1 و 1000. يرجى إدخال رقم صحيح:")
+    # A student editing their form may keep their own number
+    if number != data.get("student_number") and await run_db(is_student_number_taken, number):
+        raise FieldError("هذا الرقم مستخدم بالفعل. يرجى إدخال رقم آخر:")
+    return number
+
+MIDDLE_SCHOOLS = ("متوسطة المجتبى", "متوسطة الصناديد", "أخرى")
+
+def applicant_fields(group) -> list:
+    """The fields the registration and admission forms share, bound to the states of `group`."""
+    return [
+        FieldSpec("phone_number", "رقم الهاتف", "يرجى إدخال رقم هاتف الطالب:", group.phone_number),
+        FieldSpec("parent_phone_number", "رقم هاتف ولي الأمر", "يرجى إدخال رقم هاتف ولي الأمر:",
+                  group.parent_phone_number),
+        FieldSpec("middle_school", "المدرسة المتوسطة", "يرجى اختيار المدرسة المتوسطة التي تخرج منها الطالب:",
+                  group.middle_school, keyboard=MIDDLE_SCHOOLS, other_choice="أخرى",
+                  other_prompt="يرجى إدخال اسم المدرسة المتوسطة:"),
+        FieldSpec("location_link", "رابط الموقع الجغرافي", "يرجى إرسال رابط الموقع الجغرافي أو اكتب \"لا يوجد\":",
+                  group.location_link),
+        FieldSpec("address_description", "وصف السكن", "يرجى إدخال وصف السكن:", group.address_description),
+        FieldSpec("personal_photo_path", "الصورة الشخصية",
+                  "يرجى إرسال صورة شخصية واضحة (مباشرة من الكاميرا أو من المعرض):", group.personal_photo,
+                  photo=True, in_review=False),
+        FieldSpec("student_card_photo_path", "صورة بطاقة الطالب", "يرجى إرسال صورة بطاقة الطالب:",
+                  group.student_card_photo, photo=True, in_review=False),
+        FieldSpec("father_card_photo_path", "صورة بطاقة الأب", "يرجى إرسال صورة بطاقة الأب:",
+                  group.father_card_photo, photo=True, in_review=False),
+        FieldSpec("mother_card_photo_path", "صورة بطاقة الأم", "يرجى إرسال صورة بطاقة الأم:",
+                  group.mother_card_photo, photo=True, in_review=False),
+    ]
+
+STUDENT_FORM = FormSpec(
+    [
+        FieldSpec("full_name", "الاسم الرباعي", "أهلاً بك في استمارة تسجيل الطلاب. يرجى إدخال الاسم الرباعي:",
+                  Form.full_name),
+        FieldSpec("dob", "تاريخ الميلاد", "يرجى إدخال تاريخ الميلاد (مثال: 2005-01-15):", Form.dob,
+                  validate=validate_date),
+        FieldSpec("grade", "الصف", "يرجى إدخال الصف (الرابع، الخامس، السادس):", Form.grade,
+                  choices=("الرابع", "الخامس", "السادس"),
+                  error="الصف غير صحيح. يرجى الاختيار من (الرابع، الخامس، السادس):"),
+        FieldSpec("section", "الشعبة", "يرجى إدخال الشعبة (أ، ب، ج، د، هـ):", Form.section,
+                  choices=("أ", "ب", "ج", "د", "هـ"), error="الشعبة غير صحيحة. يرجى الاختيار من (أ، ب، ج، د، هـ):"),
+        FieldSpec("student_number", "الرقم", "يرجى إدخال الرقم (من 1 إلى 1000):", Form.student_number,
+                  validate=validate_student_number),
+        *applicant_fields(Form),
+        FieldSpec("status", "الحالة", "يرجى تحديد حالة الطالب:", Form.status, choices=("ناجح", "راسب", "مكمل"),
+                  error="الحالة غير صحيحة. يرجى الاختيار من (ناجح، راسب، مكمل):"),
+        FieldSpec("role", "الدور", "يرجى تحديد الدور:", Form.role, choices=("أول", "ثاني", "ثالث"),
+                  error="الدور غير صحيح. يرجى الاختيار من (أول، ثاني، ثالث):"),
+        FieldSpec("academic_year", "العام الدراسي", "يرجى إدخال العام الدراسي (مثال: 2024-2025):", Form.academic_year),
+    ],
+    Form.edit_field, Form.edit_value,
+    review_title="يرجى مراجعة بياناتك:",
+    edit_callback="edit_form", submit_callback="submit_form",
+    edit_prompt="ما هو الحقل الذي تود تعديله؟ (مثال: الاسم الرباعي، تاريخ الميلاد، الصف)",
+)
+
+ADMISSION_FORM = FormSpec(
+    [
+        FieldSpec("full_name", "الاسم الرباعي", "أهلاً بك في استمارة طلب التقديم. يرجى إدخال الاسم الرباعي:",
+                  AdmissionForm.full_name),
+        FieldSpec("dob", "تاريخ الميلاد", "يرجى إدخال تاريخ الميلاد (مثال: 2005-01-15):", AdmissionForm.dob,
+                  validate=validate_date),
+        *applicant_fields(AdmissionForm),
+    ],
+    AdmissionForm.edit_field, AdmissionForm.edit_value,
+    review_title="يرجى مراجعة بيانات طلب التقديم:",
+    edit_callback="edit_admission_form", submit_callback="submit_admission_form",
+    edit_prompt="ما هو الحقل الذي تود تعديله في استمارة التقديم؟ (مثال: الاسم الرباعي، تاريخ الميلاد)",
+)
+# --- End forms.py content ---
+
+# --- routing.py content ---
+ANY_STATE = object() # index key of handlers registered without a state filter
+
+def exact_match_values(magic: MagicFilter):
+    """(attribute, values) for `F.attr == "x"` and `F.attr.in_({...})` filters over strings, else None."""
+    operations = magic._operations
+    if len(operations) != 2 or not isinstance(operations[0], GetAttributeOperation):
+        return None
+    attribute, test = operations[0].name, operations[1]
+    if isinstance(test, ComparatorOperation) and test.comparator is operator.eq and isinstance(test.right, str):
+        return attribute, (test.right,)
+    if (isinstance(test, FunctionOperation) and test.function is in_op and len(test.args) == 1 and not test.kwargs
+            and all(isinstance(value, str) for value in test.args[0])):
+        return attribute, tuple(test.args[0])
+    return None
+
+def exact_match_keys(handler: HandlerObject) -> list:
+    """The index keys of a handler filtered by one exact match and/or one State; [] for any other handler."""
+    state, match = ANY_STATE, None
+    for filter_object in handler.filters or ():
+        if isinstance(filter_object.callback, State) and state is ANY_STATE:
+            state = ANY_STATE if filter_object.callback.state == "*" else filter_object.callback.state
+        elif filter_object.magic is not None and match is None:
+            match = exact_match_values(filter_object.magic)
+            if match is None:
+                return []
+        else:
+            return []
+    if match is None:
+        # A handler for everything sent in one state is indexed by the state alone
+        return [(state, None, None)] if state is not ANY_STATE else []
+    attribute, values = match
+    return [(state, attribute, value) for value in values]
+
+class ExactMatchObserver(TelegramEventObserver):
+    """An event observer that finds exact-text/-data handlers by hash lookup instead of trying them in turn.
+
+    aiogram calls the first handler, in registration order, whose filters
+    pass. Handlers filtered only by `F.text == ...` (or `.in_(...)`) and/or
+    a State are indexed by (state, attribute, value); only the other
+    handlers still run their filters, and only those registered before the
+    indexed match, so the handler chosen is the one aiogram would choose.
+
+    trigger() mirrors TelegramEventObserver.trigger and uses its private
+    _resolve_middlewares(); aiogram is pinned in requirements.txt, and
+    test_routing.py checks the choice against stock dispatch.
+    """
+
+    def __init__(self, router: Router, event_name: str):
+        super().__init__(router, event_name)
+        self._index = {} # (state, attribute, value) -> position in self.handlers
+        self._attributes = set()
+        self._chain = [] # positions of the handlers that need their filters checked
+
+    def register(self, callback, *filters, flags: dict = None, **kwargs):
+        super().register(callback, *filters, flags=flags, **kwargs)
+        position = len(self.handlers) - 1
+        keys = exact_match_keys(self.handlers[position])
+        for key in keys:
+            self._index.setdefault(key, position) # an earlier handler for the same key wins, as in aiogram
+            if key[1] is not None:
+                self._attributes.add(key[1])
+        if not keys:
+            self._chain.append(position)
+        return callback
+
+    def _exact_match(self, event, raw_state) -> int:
+        best = self._index.get((raw_state, None, None))
+        for attribute in self._attributes:
+            value = getattr(event, attribute, None)
+            if not isinstance(value, str):
+                continue
+            for state in (raw_state, ANY_STATE):
+                position = self._index.get((state, attribute, value))
+                if position is not None and (best is None or position < best):
+                    best = position
+        return best
+
+    async def _call(self, handler: HandlerObject, event, kwargs: dict):
+        wrapped_inner = self.outer_middleware.wrap_middlewares(self._resolve_middlewares(), handler.call)
+        return await wrapped_inner(event, kwargs)
+
+    async def trigger(self, event, **kwargs):
+        exact = self._exact_match(event, kwargs.get("raw_state"))
+        for position in self._chain:
+            if exact is not None and position > exact:
+                break
+            handler = kwargs["handler"] = self.handlers[position]
+            result, data = await handler.check(event, **kwargs)
+            if result:
+                kwargs.update(data)
+                try:
+                    return await self._call(handler, event, kwargs)
+                except SkipHandler:
+                    continue
+        if exact is None:
+            return UNHANDLED
+
+        handler = kwargs["handler"] = self.handlers[exact]
+        try:
+            return await self._call(handler, event, kwargs)
+        except SkipHandler:
+            pass
+        # The matched handler passed the update on: carry on down the whole chain, as aiogram would
+        for handler in self.handlers[exact + 1:]:
+            kwargs["handler"] = handler
+            result, data = await handler.check(event, **kwargs)
+            if result:
+                kwargs.update(data)
+                try:
+                    return await self._call(handler, event, kwargs)
+                except SkipHandler:
+                    continue
+        return UNHANDLED
+
+def use_exact_match_dispatch(router: Router, event_names=("message", "callback_query")) -> None:
+    """Swaps the router's observers for ExactMatchObserver. Call it before registering handlers or middlewares."""
+    for event_name in event_names:
+        observer = ExactMatchObserver(router, event_name)
+        setattr(router, event_name, observer)
+        router.observers[event_name] = observer
+# --- End routing.py content ---
+
+# --- webhook.py content ---
+BOT_MODE = os.getenv("BOT_MODE", "polling") # polling or webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") # public https base URL; when unset the webhook is not (re)registered
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+class WebhookServer:
+    """Receives updates over HTTP and processes them on a fixed number of workers.
+
+    A request is answered as soon as its update is queued, so Telegram never
+    waits on a handler. When the queue is full the request gets a 503 and
+    Telegram delivers the update again later, instead of the bot buffering
+    without bound. Requests without the right secret token get a 401.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str, path: str = WEBHOOK_PATH,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.path = path
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.rejected = 0
+        self._worker_tasks = []
+        self._runner = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            return web.Response(status=401)
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _work(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                logging.exception("Update %s failed", update.update_id)
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp)
+        self._worker_tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info("Webhook server listening on %s:%d%s with %d workers", host, port, self.path, self.workers)
+
+    async def stop(self, drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT) -> None:
+        """Stops accepting updates, lets the workers finish the queued ones, then shuts the dispatcher down."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Dropping %d queued updates after waiting %d seconds", self.queue.qsize(), drain_timeout)
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp)
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """Serves the webhook until SIGINT/SIGTERM, registering it with Telegram when WEBHOOK_URL is set."""
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    if not WEBHOOK_URL and not WEBHOOK_SECRET:
+        logging.warning("Neither WEBHOOK_URL nor WEBHOOK_SECRET is set; Telegram can't be told the generated secret")
+    server = WebhookServer(dp, bot, secret)
+    await server.start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=secret,
+                              allowed_updates=dp.resolve_used_update_types(), max_connections=WEBHOOK_WORKERS)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError: # Windows
+            pass
+    try:
+        await stopping.wait()
+    finally:
+        await server.stop()
+# --- End webhook.py content ---
+
+# --- sharding.py content ---
+SHARD_WORKERS = int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 1)))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000")) # updates waiting per worker
+SHARD_CONCURRENCY = int(os.getenv("SHARD_CONCURRENCY", "16")) # updates handled at once by one worker
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "30"))
+SHARD_RESTART_WINDOW = 60 # seconds
+SHARD_MAX_RESTARTS = 5 # per worker within the window before restarts are delayed
+SHARD_RESTART_DELAY = 10
+POLLING_TIMEOUT = 30
+# The update types create_dispatcher() has handlers for, so the supervisor can poll without building one
+ALLOWED_UPDATES = ["callback_query", "message"]
+
+def shard_for(update: types.Update, workers: int) -> int:
+    """The worker that owns the update's user, so one user's FSM state and jobs always live in one process."""
+    user = getattr(update.event, "from_user", None)
+    if user is None:
+        return 0
+    return zlib.crc32(str(user.id).encode()) % workers
+
+def worker_share(budget: int, workers: int) -> int:
+    """One worker's part of a limit meant for the whole bot, at least 1."""
+    return max(1, budget // workers)
+
+def split_worker_budgets(workers: int) -> None:
+    """Replaces this process's job pool and photo downloader with ones sized to its share of the budgets.
+
+    The per-user job limit stays as it is: shard_for() sends all of a user's
+    updates to one worker.
+    """
+    global job_manager, photo_downloader
+    job_manager = JobManager(workers=worker_share(JOB_WORKERS, workers))
+    photo_downloader = PhotoDownloader(concurrency=worker_share(PHOTO_DOWNLOAD_CONCURRENCY, workers))
+
+def run_shard_worker(index: int, workers: int, updates) -> None:
+    """Entry point of a worker process."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # the supervisor decides when workers stop
+    asyncio.run(shard_worker_main(index, workers, updates))
+
+async def shard_worker_main(index: int, workers: int, updates) -> None:
+    """Handles the updates the supervisor routes to this worker until it receives None."""
+    bot = Bot(token=os.getenv("BOT_TOKEN"))
+    # The Bot API limits are per bot, so the workers split the global budget, and the job and download limits too
+    bot.session.middleware(OutboundRateLimiter(global_rate=TELEGRAM_GLOBAL_RATE / workers))
+    split_worker_budgets(workers)
+    dp = create_dispatcher(bot, background_tasks=index == 0, cache_sync=workers > 1)
+    stop_metrics = await start_metrics_exporters(
+        METRICS_PORT + 1 + index if METRICS_PORT else 0, f"{METRICS_FILE}.{index}" if METRICS_FILE else None)
+
+    loop = asyncio.get_running_loop()
+    inbox = asyncio.Queue()
+
+    def forward():
+        while True:
+            raw = updates.get()
+            loop.call_soon_threadsafe(inbox.put_nowait, raw)
+            if raw is None:
+                return
+
+    threading.Thread(target=forward, name="shard-inbox", daemon=True).start()
+    slots = asyncio.Semaphore(SHARD_CONCURRENCY)
+    running = set()
+
+    async def handle(raw: str):
+        try:
+            await dp.feed_update(bot, types.Update.model_validate_json(raw, context={"bot": bot}))
+        except Exception:
+            logging.exception("Worker %d failed to handle an update", index)
+        finally:
+            slots.release()
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    logging.info("Worker %d of %d started (pid %d)", index, workers, os.getpid())
+    try:
+        while (raw := await inbox.get()) is not None:
+            await slots.acquire()
+            task = asyncio.ensure_future(handle(raw))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        await asyncio.gather(*running)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await stop_metrics()
+        await bot.session.close()
+        job_manager.shutdown()
+        db_executor.shutdown(wait=True)
+        db_pool.close()
+
+class ShardSupervisor:
+    """Polls Telegram in this process and routes every update to one of `workers` processes.
+
+    Each worker has its own queue; a worker that dies is started again on
+    the same queue, so updates routed to it while it was down are not lost.
+    A worker that keeps crashing is restarted at most SHARD_MAX_RESTARTS times
+    a minute. On SIGINT/SIGTERM polling stops and each worker finishes its
+    queue before exiting.
+
+    A user's updates always reach the same worker, so their FSM state, login
+    session and throttling counters live in one process. Settings and the
+    supervisor list are cached in every worker; CacheSync carries changes
+    between them within CACHE_SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self, workers: int = SHARD_WORKERS):
+        self.workers = max(1, workers)
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(SHARD_QUEUE_SIZE) for _ in range(self.workers)]
+        self._processes = [None] * self.workers
+        self._restarts = [[] for _ in range(self.workers)]
+        self._stopping = False
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(target=run_shard_worker, args=(index, self.workers, self._queues[index]),
+                                        name=f"bot-worker-{index}")
+        process.start()
+        self._processes[index] = process
+
+    async def _monitor(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for index, process in enumerate(self._processes):
+                if self._stopping or process.is_alive():
+                    continue
+                restarts = self._restarts[index] = [t for t in self._restarts[index] if now - t < SHARD_RESTART_WINDOW]
+                if len(restarts) >= SHARD_MAX_RESTARTS and now - restarts[-1] < SHARD_RESTART_DELAY:
+                    continue
+                logging.error("Worker %d exited with code %s, restarting it", index, process.exitcode)
+                restarts.append(now)
+                self._spawn(index)
+
+    async def _route(self, update: types.Update) -> None:
+        inbox = self._queues[shard_for(update, self.workers)]
+        raw = update.model_dump_json(exclude_unset=True)
+        try:
+            inbox.put_nowait(raw)
+        except queue.Full: # the worker is behind; wait for room without blocking the loop, which slows polling down
+            await asyncio.get_running_loop().run_in_executor(None, inbox.put, raw)
+
+    async def _poll(self, bot: Bot) -> None:
+        await bot.delete_webhook() # left over from webhook mode, it would make every getUpdates fail with a conflict
+        offset, backoff = None, 1.0
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=ALLOWED_UPDATES)
+                backoff = 1.0
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logging.warning("Polling failed, retrying in %.0f seconds: %s", backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await self._route(update)
+
+    async def run(self, bot: Bot) -> None:
+        for index in range(self.workers):
+            self._spawn(index)
+        logging.info("Polling with %d worker processes", self.workers)
+
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stopping.set)
+            except NotImplementedError: # Windows
+                pass
+        tasks = [asyncio.ensure_future(self._poll(bot)), asyncio.ensure_future(self._monitor())]
+        try:
+            await asyncio.wait(tasks + [asyncio.ensure_future(stopping.wait())], return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task.done() and task.exception():
+                    raise task.exception()
+        finally:
+            self._stopping = True
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.stop()
+
+    async def stop(self, timeout: float = SHARD_STOP_TIMEOUT) -> None:
+        """Lets every worker finish its queue; a worker that hasn't exited after `timeout` seconds is terminated."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        async def stop_worker(index: int) -> None:
+            inbox, process = self._queues[index], self._processes[index]
+            if process is None:
+                return
+            try: # a full queue whose worker is stuck or dead must not keep the supervisor waiting
+                await loop.run_in_executor(None, functools.partial(inbox.put, None, timeout=timeout))
+            except queue.Full:
+                pass
+            else:
+                await loop.run_in_executor(None, process.join, max(0.0, deadline - loop.time()))
+            if process.is_alive():
+                logging.warning("Worker %d did not stop within %d seconds, terminating it", index, timeout)
+                process.terminate()
+                inbox.cancel_join_thread() # its unread updates would otherwise keep this process from exiting
+
+        await asyncio.gather(*(stop_worker(index) for index in range(self.workers)))
+# --- End sharding.py content ---
+
+def create_dispatcher(bot: Bot, storage: BaseStorage = None, throttle_rules: dict = THROTTLE_RULES,
+                      background_tasks: bool = True, cache_sync: bool = False) -> Dispatcher:
+    """Builds the dispatcher with every handler registered. `bot` is the one the handlers send files with.
+
+    `throttle_rules=None` turns inbound throttling off (for benchmarks). With
+    several worker processes only one should run the `background_tasks`
+    (notification digests and photo garbage collection), and every one needs
+    `cache_sync` so settings and supervisors changed by another worker are
+    picked up.
+    """
+    dp = Dispatcher(storage=storage or create_fsm_storage())
+    use_exact_match_dispatch(dp)
+    throttling = ThrottlingMiddleware(throttle_rules, exempt_ids=(ADMIN_TELEGRAM_ID,)) if throttle_rules else None
+    auth = Authenticator()
+    dp.shutdown.register(auth.close)
+    for observer in (dp.message, dp.callback_query):
+        if throttling:
+            observer.middleware(throttling) # before metrics, so dropped updates don't count as handler calls
+        observer.middleware(MetricsMiddleware())
+        observer.middleware(AuthMiddleware(auth))
+
+    dp.startup.register(photo_downloader.start)
+    if cache_sync:
+        sync = CacheSync()
+        sync.on("settings", settings_cache.invalidate)
+        sync.on("supervisors", supervisors_cache.invalidate)
+        sync.on("supervisors", auth.drop_removed_supervisors) # after the invalidation, so it sees the new list
+        dp.startup.register(sync.start)
+        dp.shutdown.register(sync.stop)
+    if background_tasks:
+        notifications = NotificationQueue(bot)
+        dp.startup.register(notifications.start)
+        dp.shutdown.register(notifications.stop)
+        photo_collector = PhotoCollector()
+        dp.startup.register(photo_collector.start)
+        dp.shutdown.register(photo_collector.stop)
 
     # Register handlers here after dp is initialized
     @dp.message(CommandStart())
@@ -363,9 +3781,84 @@ async def main() -> None:
         )
         await message.answer(f"مرحباً بك يا {message.from_user.full_name}! أنا بوت إدارة بيانات الطلاب لإعدادية المنتظر للبنين. كيف يمكنني مساعدتك اليوم؟", reply_markup=keyboard)
 
+    @dp.message(Command("jobs"))
+    async def cmd_jobs(message: types.Message):
+        """Lists the sender's queued and running import/export jobs"""
+        jobs = job_manager.active_jobs(message.from_user.id)
+        if not jobs:
+            await message.answer("لا توجد لديك مهام قيد التنفيذ.")
+            return
+        status_text = {"queued": "في الانتظار", "running": "قيد التنفيذ"}
+        lines = [f"#{job.id} {job.description}: {status_text.get(job.status, job.status)} {job.progress}" for job in jobs]
+        await message.answer("\n".join(lines))
+
+    def register_form_handlers(form: FormSpec):
+        """Registers the step and edit handlers shared by every state of `form`."""
+
+        @dp.message(form.in_step)
+        async def process_form_step(message: types.Message, state: FSMContext, raw_state: str):
+            index, spec = form.steps[raw_state]
+            data = await state.get_data()
+            try:
+                value = await spec.parse(message, data, bot)
+            except FieldError as e:
+                await message.answer(str(e))
+                return
+            if value is None:
+                await message.answer(spec.other_prompt)
+                return
+
+            data[spec.key] = value
+            if index + 1 < len(form.fields):
+                next_spec = form.fields[index + 1]
+                await save_form_step(state, next_spec.state, data)
+                await message.answer(next_spec.prompt, reply_markup=next_spec.reply_markup)
+            else:
+                await save_form_step(state, form.review_state, data)
+                await message.answer(f"{form.review_title}\n{form.render_review(data)}", reply_markup=form.review_keyboard)
+
+        @dp.callback_query(F.data == form.edit_callback)
+        async def edit_form(callback_query: types.CallbackQuery, state: FSMContext):
+            await state.set_state(form.edit_field)
+            await callback_query.message.answer(form.edit_prompt, reply_markup=form.edit_keyboard)
+            await callback_query.answer()
+
+        @dp.message(form.edit_field)
+        async def process_edit_field(message: types.Message, state: FSMContext):
+            spec = form.by_label.get((message.text or "").strip())
+            if spec is None:
+                await message.answer("هذا الحقل غير موجود أو لا يمكن تعديله حاليًا. يرجى إدخال اسم حقل صحيح.")
+                return
+            data = await state.get_data()
+            data["field_to_edit"] = spec.key
+            await save_form_step(state, form.edit_value, data)
+            await message.answer(spec.prompt, reply_markup=spec.reply_markup)
+
+        @dp.message(form.edit_value)
+        async def process_edit_value(message: types.Message, state: FSMContext):
+            data = await state.get_data()
+            spec = form.by_label.get(data.pop("field_to_edit", None))
+            if spec is None: # a conversation restored without the field being edited: back to the review
+                await save_form_step(state, form.review_state, data)
+                await message.answer(f"{form.review_title}\n{form.render_review(data)}", reply_markup=form.review_keyboard)
+                return
+            try:
+                value = await spec.parse(message, data, bot)
+            except FieldError as e:
+                await message.answer(str(e))
+                return
+            if value is None:
+                await message.answer(spec.other_prompt)
+                return
+
+            data[spec.key] = value
+            await save_form_step(state, form.review_state, data)
+            await message.answer(f"تم تحديث الحقل. يرجى مراجعة بياناتك مرة أخرى:\n{form.render_review(data)}",
+                                 reply_markup=form.review_keyboard)
+
     @dp.message(F.text == "تسجيل طالب جديد")
     async def cmd_register_student(message: types.Message, state: FSMContext):
-        form_status = get_setting("form_status")
+        form_status = await get_setting_async("form_status")
         if form_status == "closed":
             await message.answer("عذراً، استمارة التسجيل مغلقة حالياً.")
             await state.clear()
@@ -373,381 +3866,73 @@ async def main() -> None:
         await state.set_state(Form.full_name)
         await message.answer("أهلاً بك في استمارة تسجيل الطلاب. يرجى إدخال الاسم الرباعي:")
 
-    @dp.message(Form.full_name)
-    async def process_full_name(message: types.Message, state: FSMContext):
-        await state.update_data(full_name=message.text)
-        await state.set_state(Form.dob)
-        await message.answer("يرجى إدخال تاريخ الميلاد (مثال: 2005-01-15):")
-
-    @dp.message(Form.dob)
-    async def process_dob(message: types.Message, state: FSMContext):
-        try:
-            datetime.strptime(message.text, "%Y-%m-%d")
-            await state.update_data(dob=message.text)
-            await state.set_state(Form.grade)
-            await message.answer("يرجى إدخال الصف (الرابع، الخامس، السادس):")
-        except ValueError:
-            await message.answer("صيغة تاريخ الميلاد غير صحيحة. يرجى استخدام الصيغة YYYY-MM-DD (مثال: 2005-01-15):")
-
-    @dp.message(Form.grade)
-    async def process_grade(message: types.Message, state: FSMContext):
-        if message.text in ["الرابع", "الخامس", "السادس"]:
-            await state.update_data(grade=message.text)
-            await state.set_state(Form.section)
-            await message.answer("يرجى إدخال الشعبة (أ، ب، ج، د، هـ):")
-        else:
-            await message.answer("الصف غير صحيح. يرجى الاختيار من (الرابع، الخامس، السادس):")
-
-    @dp.message(Form.section)
-    async def process_section(message: types.Message, state: FSMContext):
-        if message.text in ["أ", "ب", "ج", "د", "هـ"]:
-            await state.update_data(section=message.text)
-            await state.set_state(Form.student_number)
-            await message.answer("يرجى إدخال الرقم (من 1 إلى 1000):")
-        else:
-            await message.answer("الشعبة غير صحيحة. يرجى الاختيار من (أ، ب، ج، د، هـ):")
-
-    @dp.message(Form.student_number)
-    async def process_student_number(message: types.Message, state: FSMContext):
-        try:
-            student_num = int(message.text)
-            if 1 <= student_num <= 1000:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM Students WHERE student_number = ?", (student_num,))
-                if cursor.fetchone():
-                    await message.answer("هذا الرقم مستخدم بالفعل. يرجى إدخال رقم آخر:")
-                else:
-                    await state.update_data(student_number=student_num)
-                    await state.set_state(Form.phone_number)
-                    await message.answer("يرجى إدخال رقم هاتف الطالب:")
-                conn.close()
-            else:
-                await message.answer("الرقم يجب أن يكون بين 1 و 1000. يرجى إدخال رقم صحيح:")
-        except ValueError:
-            await message.answer("الرقم غير صحيح. يرجى إدخال رقم:")
-
-    @dp.message(Form.phone_number)
-    async def process_phone_number(message: types.Message, state: FSMContext):
-        await state.update_data(phone_number=message.text)
-        await state.set_state(Form.parent_phone_number)
-        await message.answer("يرجى إدخال رقم هاتف ولي الأمر:")
-
-    @dp.message(Form.parent_phone_number)
-    async def process_parent_phone_number(message: types.Message, state: FSMContext):
-        await state.update_data(parent_phone_number=message.text)
-        await state.set_state(Form.middle_school)
-        keyboard = types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text="متوسطة المجتبى")],
-                [types.KeyboardButton(text="متوسطة الصناديد")],
-                [types.KeyboardButton(text="أخرى")]
-            ],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
-        await message.answer("يرجى اختيار المدرسة المتوسطة التي تخرج منها الطالب:", reply_markup=keyboard)
-
-    @dp.message(Form.middle_school)
-    async def process_middle_school(message: types.Message, state: FSMContext):
-        if message.text == "أخرى":
-            await state.set_state(Form.middle_school)
-            await message.answer("يرجى إدخال اسم المدرسة المتوسطة:")
-        else:
-            await state.update_data(middle_school=message.text)
-            await state.set_state(Form.location_link)
-            await message.answer("يرجى إرسال رابط الموقع الجغرافي أو اكتب \"لا يوجد\":")
-
-    @dp.message(Form.location_link)
-    async def process_location_link(message: types.Message, state: FSMContext):
-        await state.update_data(location_link=message.text)
-        await state.set_state(Form.address_description)
-        await message.answer("يرجى إدخال وصف السكن:")
-
-    @dp.message(Form.address_description)
-    async def process_address_description(message: types.Message, state: FSMContext):
-        await state.update_data(address_description=message.text)
-        await state.set_state(Form.personal_photo)
-        await message.answer("يرجى إرسال صورة شخصية واضحة (مباشرة من الكاميرا أو من المعرض):")
-
-    @dp.message(Form.personal_photo, F.photo)
-    async def process_personal_photo(message: types.Message, state: FSMContext):
-        file_id = message.photo[-1].file_id
-        photo_path = await download_photo(file_id, "photos/personal", bot)
-        if photo_path:
-            await state.update_data(personal_photo_path=photo_path)
-            await state.set_state(Form.student_card_photo)
-            await message.answer("يرجى إرسال صورة بطاقة الطالب:")
-        else:
-            await message.answer("حدث خطأ أثناء تحميل الصورة الشخصية. يرجى المحاولة مرة أخرى.")
-
-    @dp.message(Form.student_card_photo, F.photo)
-    async def process_student_card_photo(message: types.Message, state: FSMContext):
-        file_id = message.photo[-1].file_id
-        photo_path = await download_photo(file_id, "photos/student_cards", bot)
-        if photo_path:
-            await state.update_data(student_card_photo_path=photo_path)
-            await state.set_state(Form.father_card_photo)
-            await message.answer("يرجى إرسال صورة بطاقة الأب:")
-        else:
-            await message.answer("حدث خطأ أثناء تحميل صورة بطاقة الطالب. يرجى المحاولة مرة أخرى.")
-
-    @dp.message(Form.father_card_photo, F.photo)
-    async def process_father_card_photo(message: types.Message, state: FSMContext):
-        file_id = message.photo[-1].file_id
-        photo_path = await download_photo(file_id, "photos/father_cards", bot)
-        if photo_path:
-            await state.update_data(father_card_photo_path=photo_path)
-            await state.set_state(Form.mother_card_photo)
-            await message.answer("يرجى إرسال صورة بطاقة الأم:")
-        else:
-            await message.answer("حدث خطأ أثناء تحميل صورة بطاقة الأب. يرجى المحاولة مرة أخرى.")
-
-    @dp.message(Form.mother_card_photo, F.photo)
-    async def process_mother_card_photo(message: types.Message, state: FSMContext):
-        file_id = message.photo[-1].file_id
-        photo_path = await download_photo(file_id, "photos/mother_cards", bot)
-        if photo_path:
-            await state.update_data(mother_card_photo_path=photo_path)
-            await state.set_state(Form.status)
-            keyboard = types.ReplyKeyboardMarkup(
-                keyboard=[
-                    [types.KeyboardButton(text="ناجح")],
-                    [types.KeyboardButton(text="راسب")],
-                    [types.KeyboardButton(text="مكمل")]
-                ],
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-            await message.answer("يرجى تحديد حالة الطالب:", reply_markup=keyboard)
-        else:
-            await message.answer("حدث خطأ أثناء تحميل صورة بطاقة الأم. يرجى المحاولة مرة أخرى.")
-
-    @dp.message(Form.status)
-    async def process_status(message: types.Message, state: FSMContext):
-        if message.text in ["ناجح", "راسب", "مكمل"]:
-            await state.update_data(status=message.text)
-            await state.set_state(Form.role)
-            keyboard = types.ReplyKeyboardMarkup(
-                keyboard=[
-                    [types.KeyboardButton(text="أول")],
-                    [types.KeyboardButton(text="ثاني")],
-                    [types.KeyboardButton(text="ثالث")]
-                ],
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-            await message.answer("يرجى تحديد الدور:", reply_markup=keyboard)
-        else:
-            await message.answer("الدور غير صحيح. يرجى الاختيار من (أول، ثاني، ثالث):")
-
-    @dp.message(Form.role)
-    async def process_role(message: types.Message, state: FSMContext):
-        if message.text in ["أول", "ثاني", "ثالث"]:
-            await state.update_data(role=message.text)
-            await state.set_state(Form.academic_year)
-            await message.answer("يرجى إدخال العام الدراسي (مثال: 2024-2025):")
-        else:
-            await message.answer("الدور غير صحيح. يرجى الاختيار من (أول، ثاني، ثالث):")
-
-    @dp.message(Form.academic_year)
-    async def process_academic_year(message: types.Message, state: FSMContext):
-        await state.update_data(academic_year=message.text)
-        user_data = await state.get_data()
-
-        # Display collected data for review
-        review_message = "\n".join([
-            f'الاسم الرباعي: {user_data.get("full_name")}',
-            f'تاريخ الميلاد: {user_data.get("dob")}',
-            f'الصف: {user_data.get("grade")}',
-            f'الشعبة: {user_data.get("section")}',
-            f'الرقم: {user_data.get("student_number")}',
-            f'رقم الهاتف: {user_data.get("phone_number")}',
-            f'رقم هاتف ولي الأمر: {user_data.get("parent_phone_number")}',
-            f'المدرسة المتوسطة: {user_data.get("middle_school")}',
-            f'رابط الموقع الجغرافي: {user_data.get("location_link")}',
-            f'وصف السكن: {user_data.get("address_description")}',
-            f'الحالة: {user_data.get("status")}',
-            f'الدور: {user_data.get("role")}',
-            f'العام الدراسي: {user_data.get("academic_year")}'
-        ])
-
-        keyboard = types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [types.InlineKeyboardButton(text="تعديل قبل الإرسال", callback_data="edit_form")],
-                [types.InlineKeyboardButton(text="تأكيد وإرسال", callback_data="submit_form")]
-            ]
-        )
-        await message.answer(f"يرجى مراجعة بياناتك:\n{review_message}", reply_markup=keyboard)
-        await state.set_state(Form.academic_year) # Keep state for review/edit
+    register_form_handlers(STUDENT_FORM)
 
     @dp.callback_query(F.data == "submit_form")
     async def submit_form(callback_query: types.CallbackQuery, state: FSMContext):
         user_data = await state.get_data()
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            # Check if student exists by full_name and telegram_id is null
-            cursor.execute("SELECT id FROM Students WHERE full_name = ? AND telegram_id IS NULL", (user_data.get("full_name"),))
-            student_id_row = cursor.fetchone()
-
-            if student_id_row:
-                student_id = student_id_row[0]
-                cursor.execute("""
-                    UPDATE Students SET
-                        telegram_id = ?, dob = ?, grade = ?, section = ?, student_number = ?,
-                        phone_number = ?, parent_phone_number = ?, middle_school = ?, location_link = ?,
-                        address_description = ?, personal_photo_path = ?, student_card_photo_path = ?,
-                        father_card_photo_path = ?, mother_card_photo_path = ?, status = ?, role = ?,
-                        academic_year = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                """, (
-                    callback_query.from_user.id, user_data.get("dob"), user_data.get("grade"),
-                    user_data.get("section"), user_data.get("student_number"), user_data.get("phone_number"),
-                    user_data.get("parent_phone_number"), user_data.get("middle_school"),
-                    user_data.get("location_link"), user_data.get("address_description"),
-                    user_data.get("personal_photo_path"), user_data.get("student_card_photo_path"),
-                    user_data.get("father_card_photo_path"), user_data.get("mother_card_photo_path"),
-                    user_data.get("status"), user_data.get("role"), user_data.get("academic_year"),
-                    student_id
-                ))
+            updated = await run_db(save_student_form, callback_query.from_user.id, user_data)
+            if updated:
                 await callback_query.message.answer("تم تحديث بياناتك بنجاح!")
             else:
-                # If student does not exist or telegram_id is already set, insert as new
-                cursor.execute("""
-                    INSERT INTO Students (
-                        telegram_id, full_name, dob, grade, section, student_number, phone_number,
-                        parent_phone_number, middle_school, location_link, address_description,
-                        personal_photo_path, student_card_photo_path, father_card_photo_path,
-                        mother_card_photo_path, status, role, academic_year
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    callback_query.from_user.id, user_data.get("full_name"), user_data.get("dob"),
-                    user_data.get("grade"), user_data.get("section"), user_data.get("student_number"),
-                    user_data.get("phone_number"), user_data.get("parent_phone_number"),
-                    user_data.get("middle_school"), user_data.get("location_link"),
-                    user_data.get("address_description"), user_data.get("personal_photo_path"),
-                    user_data.get("student_card_photo_path"), user_data.get("father_card_photo_path"),
-                    user_data.get("mother_card_photo_path"), user_data.get("status"),
-                    user_data.get("role"), user_data.get("academic_year")
-                ))
                 await callback_query.message.answer("تم حفظ بياناتك بنجاح! سيتم مراجعتها من قبل الإدارة.")
-            conn.commit()
             await state.clear()
         except sqlite3.IntegrityError as e:
             await callback_query.message.answer(f"حدث خطأ أثناء حفظ البيانات: {e}. يرجى المحاولة مرة أخرى.")
-        finally:
-            conn.close()
         await callback_query.answer()
 
-    @dp.callback_query(F.data == "edit_form")
-    async def edit_form(callback_query: types.CallbackQuery, state: FSMContext):
-        await callback_query.message.answer("ما هو الحقل الذي تود تعديله؟ (مثال: الاسم الرباعي، تاريخ الميلاد، الصف)")
-        await state.set_state(Form.edit_field) # A new state for editing
-
-    @dp.message(Form.edit_field)
-    async def process_edit_field(message: types.Message, state: FSMContext):
-        field_name = message.text.strip()
-        user_data = await state.get_data()
-        if field_name in user_data:
-            await state.update_data(field_to_edit=field_name)
-            await state.set_state(Form.edit_value)
-            await message.answer(f"يرجى إدخال القيمة الجديدة للحقل \"{field_name}\":")
-        else:
-            await message.answer("هذا الحقل غير موجود أو لا يمكن تعديله حاليًا. يرجى إدخال اسم حقل صحيح.")
-
-    @dp.message(Form.edit_value)
-    async def process_edit_value(message: types.Message, state: FSMContext):
-        user_data = await state.get_data()
-        field_to_edit = user_data.get("field_to_edit")
-        new_value = message.text
-
-        await state.update_data(**{field_to_edit: new_value})
-        updated_data = await state.get_data()
-
-        review_message = "\n".join([
-            f'الاسم الرباعي: {updated_data.get("full_name")}',
-            f'تاريخ الميلاد: {updated_data.get("dob")}',
-            f'الصف: {updated_data.get("grade")}',
-            f'الشعبة: {updated_data.get("section")}',
-            f'الرقم: {updated_data.get("student_number")}',
-            f'رقم الهاتف: {updated_data.get("phone_number")}',
-            f'رقم هاتف ولي الأمر: {updated_data.get("parent_phone_number")}',
-            f'المدرسة المتوسطة: {updated_data.get("middle_school")}',
-            f'رابط الموقع الجغرافي: {updated_data.get("location_link")}',
-            f'وصف السكن: {updated_data.get("address_description")}',
-            f'الحالة: {updated_data.get("status")}',
-            f'الدور: {updated_data.get("role")}',
-            f'العام الدراسي: {updated_data.get("academic_year")}'
-        ])
-
-        keyboard = types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [types.InlineKeyboardButton(text="تعديل قبل الإرسال", callback_data="edit_form")],
-                [types.InlineKeyboardButton(text="تأكيد وإرسال", callback_data="submit_form")]
-            ]
-        )
-        await message.answer(f"تم تحديث الحقل. يرجى مراجعة بياناتك مرة أخرى:\n{review_message}", reply_markup=keyboard)
-        await state.set_state(Form.academic_year) # Return to review state
-
     # Search student functionality
     @dp.message(F.text == "البحث عن اسمي")
     async def cmd_search_student(message: types.Message, state: FSMContext):
         await state.set_state(Search.search_name)
         await message.answer("يرجى إدخال الاسم الرباعي للبحث عنه:")
 
-    @dp.message(Search.search_name)
+    async def start_claim(message: types.Message, state: FSMContext, student_data: dict):
+        # Only the name is carried over: the form asks for everything else again, and whatever an
+        # import or an earlier attempt stored for this student must not be shown to whoever claims it
+        await state.set_data({"full_name": student_data["full_name"]})
+        await state.set_state(Form.dob) # Start from dob to complete the form
+        await message.answer(f"تم العثور على اسمك: {student_data.get('full_name')}. يرجى استكمال بياناتك. يرجى إدخال تاريخ الميلاد (مثال: 2005-01-15):")
+
+    async def show_found_student(message: types.Message, state: FSMContext, student_data: dict):
+        # Check if telegram_id is null or if any required fields are missing
+        if student_data.get("telegram_id") is None or \
+           any(student_data.get(field) is None for field in REQUIRED_STUDENT_FIELDS):
+            # Student found but data is incomplete or telegram_id is null, offer to complete
+            await start_claim(message, state, student_data)
+        else:
+            # Student found and data is complete, display it
+            if student_data.get("can_view_data") == 0: # Check if can_view_data is FALSE (0)
+                await message.answer("عذراً، لا يمكنك عرض بياناتك حالياً. يرجى التواصل مع الإدارة.")
+                await state.clear()
+                return
+
+            review_message = STUDENT_FORM.render_review(student_data)
+            keyboard = types.InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [types.InlineKeyboardButton(text="تعديل بياناتي", callback_data=f'update_student_{student_data.get("telegram_id")}')]
+                ]
+            )
+            await message.answer(f"تم العثور على بياناتك:\n{review_message}", reply_markup=keyboard)
+            await state.clear()
+
+    @dp.message(Search.search_name, flags={"throttle": "search"})
     async def process_search_name(message: types.Message, state: FSMContext):
         full_name = message.text.strip()
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM Students WHERE full_name = ?", (full_name,))
-        student = cursor.fetchone()
-        conn.close()
-
-        if student:
-            student_data = dict(student)
-            # Check if telegram_id is null or if any required fields are missing
-            if student_data.get("telegram_id") is None or \
-               any(student_data.get(field) is None for field in [
-                   "dob", "grade", "section", "student_number", "phone_number", "parent_phone_number",
-                   "middle_school", "location_link", "address_description", "personal_photo_path",
-                   "student_card_photo_path", "father_card_photo_path", "mother_card_photo_path",
-                   "status", "role", "academic_year"
-               ]):
-                # Student found but data is incomplete or telegram_id is null, offer to complete
-                await state.set_data(student_data) # Load existing data into FSM context
-                await state.set_state(Form.dob) # Start from dob to complete the form
-                await message.answer(f"تم العثور على اسمك: {full_name}. يرجى استكمال بياناتك. يرجى إدخال تاريخ الميلاد (مثال: 2005-01-15):")
-            else:
-                # Student found and data is complete, display it
-                if student_data.get("can_view_data") == 0: # Check if can_view_data is FALSE (0)
-                    await message.answer("عذراً، لا يمكنك عرض بياناتك حالياً. يرجى التواصل مع الإدارة.")
-                    await state.clear()
-                    return
-
-                review_message = "\n".join([
-                    f'الاسم الرباعي: {student_data.get("full_name")}',
-                    f'تاريخ الميلاد: {student_data.get("dob")}',
-                    f'الصف: {student_data.get("grade")}',
-                    f'الشعبة: {student_data.get("section")}',
-                    f'الرقم: {student_data.get("student_number")}',
-                    f'رقم الهاتف: {student_data.get("phone_number")}',
-                    f'رقم هاتف ولي الأمر: {student_data.get("parent_phone_number")}',
-                    f'المدرسة المتوسطة: {student_data.get("middle_school")}',
-                    f'رابط الموقع الجغرافي: {student_data.get("location_link")}',
-                    f'وصف السكن: {student_data.get("address_description")}',
-                    f'الحالة: {student_data.get("status")}',
-                    f'الدور: {student_data.get("role")}',
-                    f'العام الدراسي: {student_data.get("academic_year")}'
-                ])
-                keyboard = types.InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [types.InlineKeyboardButton(text="تعديل بياناتي", callback_data=f'update_student_{student_data.get("telegram_id")}')]
-                    ]
-                )
-                await message.answer(f"تم العثور على بياناتك:\n{review_message}", reply_markup=keyboard)
-                await state.clear()
+        candidates = await run_db(search_students, full_name)
+
+        if len(candidates) == 1 and candidates[0]["name_key"] == normalize_arabic_name(full_name):
+            student_data = await run_db(find_student_by_id, candidates[0]["id"])
+            await show_found_student(message, state, student_data)
+        elif candidates:
+            keyboard = search_results_keyboard(candidates, "search_pick_")
+            keyboard.inline_keyboard.append(
+                [types.InlineKeyboardButton(text="اسمي غير موجود - تسجيل جديد", callback_data="register_new_student")]
+            )
+            await state.set_state(Search.pick)
+            await state.set_data({"offered": [candidate["id"] for candidate in candidates]})
+            await message.answer("يرجى اختيار اسمك من القائمة:", reply_markup=keyboard)
         else:
             keyboard = types.InlineKeyboardMarkup(
                 inline_keyboard=[
@@ -757,19 +3942,63 @@ async def main() -> None:
             await message.answer("لم يتم العثور على اسمك. هل ترغب في تسجيل جديد؟", reply_markup=keyboard)
             await state.clear()
 
+    async def offered_student(callback_query: types.CallbackQuery, state: FSMContext, prefix: str):
+        """The student a pick/claim button points at, if it is one the last search offered; else None."""
+        student_id = callback_query.data.removeprefix(prefix)
+        offered = (await state.get_data()).get("offered", ())
+        if not student_id.isdigit() or int(student_id) not in offered:
+            await callback_query.answer("هذا الخيار غير متاح. يرجى البحث عن اسمك مجدداً.", show_alert=True)
+            return None
+        student_data = await run_db(find_student_by_id, int(student_id))
+        if student_data is None:
+            await callback_query.message.answer("لم يتم العثور على بيانات الطالب.")
+            await callback_query.answer()
+        return student_data
+
+    @dp.callback_query(Search.pick, F.data.startswith("search_pick_"))
+    async def pick_search_result(callback_query: types.CallbackQuery, state: FSMContext):
+        student_data = await offered_student(callback_query, state, "search_pick_")
+        if student_data is None:
+            return
+        if student_data["telegram_id"] == callback_query.from_user.id:
+            await show_found_student(callback_query.message, state, student_data)
+        elif student_data["telegram_id"] is None:
+            # A near match may be someone else: show the name only, and let the user claim it
+            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+                [types.InlineKeyboardButton(text="نعم، هذا اسمي - استكمال البيانات",
+                                            callback_data=f"search_claim_{student_data['id']}")],
+                [types.InlineKeyboardButton(text="اسمي غير موجود - تسجيل جديد", callback_data="register_new_student")],
+            ])
+            await callback_query.message.answer(f"الاسم المختار: {student_data['full_name']}", reply_markup=keyboard)
+        else:
+            await callback_query.message.answer("هذا الاسم مسجل بحساب آخر. إذا كان اسمك، يرجى التواصل مع الإدارة.")
+            await state.clear()
+        await callback_query.answer()
+
+    @dp.callback_query(Search.pick, F.data.startswith("search_claim_"))
+    async def claim_search_result(callback_query: types.CallbackQuery, state: FSMContext):
+        student_data = await offered_student(callback_query, state, "search_claim_")
+        if student_data is None:
+            return
+        if student_data["telegram_id"] is None:
+            await start_claim(callback_query.message, state, student_data)
+        else:
+            await callback_query.message.answer("هذا الاسم مسجل بحساب آخر. إذا كان اسمك، يرجى التواصل مع الإدارة.")
+            await state.clear()
+        await callback_query.answer()
+
     @dp.callback_query(F.data.startswith("update_student_"))
     async def update_student_data(callback_query: types.CallbackQuery, state: FSMContext):
         telegram_id = int(callback_query.data.split("_")[2])
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM Students WHERE telegram_id = ?", (telegram_id,))
-        student_data = cursor.fetchone()
-        conn.close()
+        # The button only ever carries the sender's own id; a forged one must not open someone else's record
+        student_data = await run_db(find_student_by_telegram_id, telegram_id) \
+            if telegram_id == callback_query.from_user.id else None
 
         if student_data:
-            await state.set_data(dict(student_data)) # Load existing data into FSM context
+            await state.set_data(student_data) # Load existing data into FSM context
             await state.set_state(Form.edit_field)
-            await callback_query.message.answer("ما هو الحقل الذي تود تعديله؟ (مثال: رقم الهاتف، وصف السكن)")
+            await callback_query.message.answer("ما هو الحقل الذي تود تعديله؟ (مثال: رقم الهاتف، وصف السكن)",
+                                                reply_markup=STUDENT_FORM.edit_keyboard)
         else:
             await callback_query.message.answer("لم يتم العثور على بيانات الطالب.")
         await callback_query.answer()
@@ -783,7 +4012,7 @@ async def main() -> None:
     # Admission Form Handlers
     @dp.message(F.text == "طلب تقديم إلى إعدادية المنتظر للبنين")
     async def cmd_admission_form(message: types.Message, state: FSMContext):
-        form_status = get_setting("form_status")
+        form_status = await get_setting_async("form_status")
         if form_status == "closed":
             await message.answer("عذراً، استمارة التقديم مغلقة حالياً.")
             await state.clear()
@@ -791,214 +4020,35 @@ async def main() -> None:
         await state.set_state(AdmissionForm.full_name)
         await message.answer("أهلاً بك في استمارة طلب التقديم. يرجى إدخال الاسم الرباعي:")
 
-    @dp.message(AdmissionForm.full_name)
-    async def process_admission_full_name(message: types.Message, state: FSMContext):
-        await state.update_data(full_name=message.text)
-        await state.set_state(AdmissionForm.dob)
-        await message.answer("يرجى إدخال تاريخ الميلاد (مثال: 2005-01-15):")
-
-    @dp.message(AdmissionForm.dob)
-    async def process_admission_dob(message: types.Message, state: FSMContext):
-        try:
-            datetime.strptime(message.text, "%Y-%m-%d")
-            await state.update_data(dob=message.text)
-            await state.set_state(AdmissionForm.phone_number)
-            await message.answer("يرجى إدخال رقم هاتف الطالب:")
-        except ValueError:
-            await message.answer("صيغة تاريخ الميلاد غير صحيحة. يرجى استخدام الصيغة YYYY-MM-DD (مثال: 2005-01-15):")
-
-    @dp.message(AdmissionForm.phone_number)
-    async def process_admission_phone_number(message: types.Message, state: FSMContext):
-        await state.update_data(phone_number=message.text)
-        await state.set_state(AdmissionForm.parent_phone_number)
-        await message.answer("يرجى إدخال رقم هاتف ولي الأمر:")
-
-    @dp.message(AdmissionForm.parent_phone_number)
-    async def process_admission_parent_phone_number(message: types.Message, state: FSMContext):
-        await state.update_data(parent_phone_number=message.text)
-        await state.set_state(AdmissionForm.middle_school)
-        keyboard = types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text="متوسطة المجتبى")],
-                [types.KeyboardButton(text="متوسطة الصناديد")],
-                [types.KeyboardButton(text="أخرى")]
-            ],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
-        await message.answer("يرجى اختيار المدرسة المتوسطة التي تخرج منها الطالب:", reply_markup=keyboard)
-
-    @dp.message(AdmissionForm.middle_school)
-    async def process_admission_middle_school(message: types.Message, state: FSMContext):
-        if message.text == "أخرى":
-            await state.set_state(AdmissionForm.middle_school)
-            await message.answer("يرجى إدخال اسم المدرسة المتوسطة:")
-        else:
-            await state.update_data(middle_school=message.text)
-            await state.set_state(AdmissionForm.location_link)
-            await message.answer("يرجى إرسال رابط الموقع الجغرافي أو اكتب \"لا يوجد\":")
-
-    @dp.message(AdmissionForm.location_link)
-    async def process_admission_location_link(message: types.Message, state: FSMContext):
-        await state.update_data(location_link=message.text)
-        await state.set_state(AdmissionForm.address_description)
-        await message.answer("يرجى إدخال وصف السكن:")
-
-    @dp.message(AdmissionForm.address_description)
-    async def process_admission_address_description(message: types.Message, state: FSMContext):
-        await state.update_data(address_description=message.text)
-        await state.set_state(AdmissionForm.personal_photo)
-        await message.answer("يرجى إرسال صورة شخصية واضحة (مباشرة من الكاميرا أو من المعرض):")
-
-    @dp.message(AdmissionForm.personal_photo, F.photo)
-    async def process_admission_personal_photo(message: types.Message, state: FSMContext):
-        file_id = message.photo[-1].file_id
-        photo_path = await download_photo(file_id, "photos/admission_personal", bot)
-        if photo_path:
-            await state.update_data(personal_photo_path=photo_path)
-            await state.set_state(AdmissionForm.student_card_photo)
-            await message.answer("يرجى إرسال صورة بطاقة الطالب:")
-        else:
-            await message.answer("حدث خطأ أثناء تحميل الصورة الشخصية. يرجى المحاولة مرة أخرى.")
-
-    @dp.message(AdmissionForm.student_card_photo, F.photo)
-    async def process_admission_student_card_photo(message: types.Message, state: FSMContext):
-        file_id = message.photo[-1].file_id
-        photo_path = await download_photo(file_id, "photos/admission_student_cards", bot)
-        if photo_path:
-            await state.update_data(student_card_photo_path=photo_path)
-            await state.set_state(AdmissionForm.father_card_photo)
-            await message.answer("يرجى إرسال صورة بطاقة الأب:")
-        else:
-            await message.answer("حدث خطأ أثناء تحميل صورة بطاقة الطالب. يرجى المحاولة مرة أخرى.")
-
-    @dp.message(AdmissionForm.father_card_photo, F.photo)
-    async def process_admission_father_card_photo(message: types.Message, state: FSMContext):
-        file_id = message.photo[-1].file_id
-        photo_path = await download_photo(file_id, "photos/father_cards", bot)
-        if photo_path:
-            await state.update_data(father_card_photo_path=photo_path)
-            await state.set_state(AdmissionForm.mother_card_photo)
-            await message.answer("يرجى إرسال صورة بطاقة الأم:")
-        else:
-            await message.answer("حدث خطأ أثناء تحميل صورة بطاقة الأب. يرجى المحاولة مرة أخرى.")
-
-    @dp.message(AdmissionForm.mother_card_photo, F.photo)
-    async def process_admission_mother_card_photo(message: types.Message, state: FSMContext):
-        file_id = message.photo[-1].file_id
-        photo_path = await download_photo(file_id, "photos/admission_mother_cards", bot)
-        if photo_path:
-            await state.update_data(mother_card_photo_path=photo_path)
-            user_data = await state.get_data()
-
-            review_message = "\n".join([
-                f'الاسم الرباعي: {user_data.get("full_name")}',
-                f'تاريخ الميلاد: {user_data.get("dob")}',
-                f'رقم الهاتف: {user_data.get("phone_number")}',
-                f'رقم هاتف ولي الأمر: {user_data.get("parent_phone_number")}',
-                f'المدرسة المتوسطة: {user_data.get("middle_school")}',
-                f'رابط الموقع الجغرافي: {user_data.get("location_link")}',
-                f'وصف السكن: {user_data.get("address_description")}'
-            ])
-
-            keyboard = types.InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [types.InlineKeyboardButton(text="تعديل قبل الإرسال", callback_data="edit_admission_form")],
-                    [types.InlineKeyboardButton(text="تأكيد وإرسال", callback_data="submit_admission_form")]
-                ]
-            )
-            await message.answer(f"يرجى مراجعة بيانات طلب التقديم:\n{review_message}", reply_markup=keyboard)
-            await state.set_state(AdmissionForm.mother_card_photo) # Keep state for review/edit
-        else:
-            await message.answer("حدث خطأ أثناء تحميل صورة بطاقة الأم. يرجى المحاولة مرة أخرى.")
+    register_form_handlers(ADMISSION_FORM)
 
     @dp.callback_query(F.data == "submit_admission_form")
     async def submit_admission_form(callback_query: types.CallbackQuery, state: FSMContext):
         user_data = await state.get_data()
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute("""
-                INSERT INTO Admission_Requests (
-                    telegram_id, full_name, dob, phone_number, parent_phone_number,
-                    middle_school, location_link, address_description, personal_photo_path,
-                    student_card_photo_path, father_card_photo_path, mother_card_photo_path, status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                callback_query.from_user.id, user_data.get("full_name"), user_data.get("dob"),
-                user_data.get("phone_number"), user_data.get("parent_phone_number"),
-                user_data.get("middle_school"), user_data.get("location_link"),
-                user_data.get("address_description"), user_data.get("personal_photo_path"),
-                user_data.get("student_card_photo_path"), user_data.get("father_card_photo_path"),
-                user_data.get("mother_card_photo_path"), "قيد المراجعة"
-            ))
-            conn.commit()
+            await run_db(save_admission_request, callback_query.from_user.id, user_data)
+            await run_db(enqueue_notification, "admission",
+                         f'{user_data.get("full_name")} - {user_data.get("phone_number")} (ID: {callback_query.from_user.id})')
             await callback_query.message.answer("تم إرسال طلب التقديم بنجاح! سيتم مراجعته من قبل الإدارة.")
             await state.clear()
         except sqlite3.IntegrityError as e:
             await callback_query.message.answer(f"حدث خطأ أثناء حفظ البيانات: {e}. يرجى المحاولة مرة أخرى.")
-        finally:
-            conn.close()
         await callback_query.answer()
 
-    @dp.callback_query(F.data == "edit_admission_form")
-    async def edit_admission_form(callback_query: types.CallbackQuery, state: FSMContext):
-        await callback_query.message.answer("ما هو الحقل الذي تود تعديله في استمارة التقديم؟ (مثال: الاسم الرباعي، تاريخ الميلاد)")
-        await state.set_state(AdmissionForm.edit_field) # A new state for editing admission form
-
-    @dp.message(AdmissionForm.edit_field)
-    async def process_admission_edit_field(message: types.Message, state: FSMContext):
-        field_name = message.text.strip()
-        user_data = await state.get_data()
-        if field_name in user_data:
-            await state.update_data(field_to_edit=field_name)
-            await state.set_state(AdmissionForm.edit_value)
-            await message.answer(f"يرجى إدخال القيمة الجديدة للحقل \"{field_name}\":")
-        else:
-            await message.answer("هذا الحقل غير موجود أو لا يمكن تعديله حاليًا. يرجى إدخال اسم حقل صحيح.")
-
-    @dp.message(AdmissionForm.edit_value)
-    async def process_admission_edit_value(message: types.Message, state: FSMContext):
-        user_data = await state.get_data()
-        field_to_edit = user_data.get("field_to_edit")
-        new_value = message.text
-
-        await state.update_data(**{field_to_edit: new_value})
-        updated_data = await state.get_data()
-
-        review_message = "\n".join([
-            f'الاسم الرباعي: {updated_data.get("full_name")}',
-            f'تاريخ الميلاد: {updated_data.get("dob")}',
-            f'رقم الهاتف: {updated_data.get("phone_number")}',
-            f'رقم هاتف ولي الأمر: {updated_data.get("parent_phone_number")}',
-            f'المدرسة المتوسطة: {updated_data.get("middle_school")}',
-            f'رابط الموقع الجغرافي: {updated_data.get("location_link")}',
-            f'وصف السكن: {updated_data.get("address_description")}'
-        ])
-
-        keyboard = types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [types.InlineKeyboardButton(text="تعديل قبل الإرسال", callback_data="edit_admission_form")],
-                [types.InlineKeyboardButton(text="تأكيد وإرسال", callback_data="submit_admission_form")]
-            ]
-        )
-        await message.answer(f"تم تحديث الحقل. يرجى مراجعة بياناتك مرة أخرى:\n{review_message}", reply_markup=keyboard)
-        await state.set_state(AdmissionForm.mother_card_photo) # Return to review state
-
     # Contact Admin Handlers
     @dp.message(F.text == "تواصل مع الإدارة")
     async def cmd_contact_admin(message: types.Message, state: FSMContext):
         await state.set_state(ContactAdmin.message_text)
         await message.answer("يرجى كتابة رسالتك للإدارة:")
 
-    @dp.message(ContactAdmin.message_text)
+    @dp.message(ContactAdmin.message_text, flags={"throttle": "contact"})
     async def process_contact_admin_message(message: types.Message, state: FSMContext):
         user_message = message.text
         user_info = f"From: {message.from_user.full_name} (ID: {message.from_user.id})\n"
         full_message = f"{user_info}Message: {user_message}"
 
         try:
-            await bot.send_message(ADMIN_TELEGRAM_ID, full_message)
+            await run_db(enqueue_notification, "contact", full_message)
             await message.answer("تم إرسال رسالتك إلى الإدارة بنجاح.")
         except Exception as e:
             await message.answer(f"حدث خطأ أثناء إرسال رسالتك: {e}")
@@ -1009,47 +4059,83 @@ async def main() -> None:
     @dp.message(F.text == "رفع ملف بيانات")
     async def cmd_upload_file(message: types.Message, state: FSMContext):
         await state.set_state(FileUpload.waiting_for_file)
-        await message.answer("يرجى إرسال ملف Excel (.xlsx) أو Word (.docx) الذي يحتوي على بيانات الطلاب.")
+        await message.answer(
+            "يرجى إرسال ملف Excel (.xlsx) أو Word (.docx) الذي يحتوي على بيانات الطلاب.\n"
+            "لملفات Excel يمكنك تحديد الورقة وعمود الأسماء في وصف الملف، مثال:\n"
+            "الورقة: الصف الرابع\nالعمود: الاسم الرباعي\n"
+            "في ملفات Word تُقرأ الأسماء من جداول المستند (أو من فقراته إن لم تكن فيه جداول)، "
+            "ويمكن تحديد عمود الأسماء بالطريقة نفسها.\n"
+            "للمشرفين: أضف \"الوضع: دمج\" إلى وصف ملف Excel فيه صف عناوين (الاسم الرباعي، الرقم، الصف، الشعبة...) "
+            "لتحديث بيانات الطلاب الموجودين وإضافة الجدد."
+        )
 
-    @dp.message(FileUpload.waiting_for_file, F.document)
+    @dp.message(FileUpload.waiting_for_file, F.document, flags={"throttle": ("upload", "upload_all")})
     async def process_uploaded_file(message: types.Message, state: FSMContext):
         file_id = message.document.file_id
-        file_name = message.document.file_name
-        file_path = f"downloads/{file_name}"
-
-        # Ensure the downloads directory exists
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-        await bot.download_file_by_id(file_id, file_path)
+        file_name = message.document.file_name or ""
+        # Prefixed with the unique file id so two uploads with the same name can't overwrite each other
+        file_path = f"downloads/{message.document.file_unique_id}_{file_name}"
 
         if file_name.endswith(".xlsx"):
-            await message.answer(f"تم استلام ملف Excel: {file_name}. جاري معالجة البيانات...")
-            try:
-                process_excel_file(file_path)
-                await message.answer("تمت معالجة ملف Excel بنجاح.")
-            except Exception as e:
-                await message.answer(f"حدث خطأ أثناء معالجة ملف Excel: {e}")
+            kind, import_func, options = "Excel", process_excel_file, parse_import_options(message.caption)
+            if options.pop("mode", "").lower() in IMPORT_MERGE_MODES:
+                if not auth.role(message.from_user.id):
+                    await message.answer("دمج بيانات الطلاب متاح للمشرفين فقط. يرجى تسجيل الدخول أولاً من خيار \"مشرف\".")
+                    await state.clear()
+                    return
+                options.pop("column", None) # columns are found by their headers
+                import_func = merge_excel_file
         elif file_name.endswith(".docx"):
-            await message.answer(f"تم استلام ملف Word: {file_name}. جاري معالجة البيانات...")
-            try:
-                process_word_file(file_path)
-                await message.answer("تمت معالجة ملف Word بنجاح.")
-            except Exception as e:
-                await message.answer(f"حدث خطأ أثناء معالجة ملف Word: {e}")
+            options = parse_import_options(message.caption)
+            options.pop("sheet_name", None) # Word documents have no sheets
+            options.pop("mode", None)
+            kind, import_func = "Word", process_word_file
         else:
             await message.answer("صيغة الملف غير مدعومة. يرجى إرسال ملف Excel (.xlsx) أو Word (.docx).")
+            await state.clear()
+            return
+
+        # Ensure the downloads directory exists
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        await bot.download(file_id, destination=file_path)
+
+        async def report_progress(job: Job):
+            await bot.send_message(message.chat.id, f"المهمة #{job.id}: {job.progress}")
+
+        async def report_done(job: Job):
+            if job.error:
+                await bot.send_message(message.chat.id, f"حدث خطأ أثناء معالجة ملف {kind}: {job.error}")
+            else:
+                summary = f"\n{job.result.summary()}" if job.result else ""
+                await bot.send_message(message.chat.id, f"تمت معالجة ملف {kind}: {file_name} بنجاح.{summary}")
+
+        try:
+            job = job_manager.submit(message.from_user.id, f"استيراد {file_name}", import_func, file_path,
+                                     on_progress=report_progress, on_done=report_done, **options)
+            await message.answer(f"تم استلام ملف {kind}: {file_name}. جاري معالجة البيانات في الخلفية (المهمة #{job.id})...")
+        except JobLimitError as e:
+            await message.answer(str(e))
 
         await state.clear()
 
     # Admin Handlers
     @dp.message(F.text == "مشرف")
     async def cmd_admin(message: types.Message, state: FSMContext):
+        if auth.role(message.from_user.id):
+            await back_to_admin_menu(message, state) # still logged in
+            return
         await state.set_state(Admin.waiting_for_password)
         await message.answer("يرجى إدخال كلمة مرور المشرف:")
 
-    @dp.message(Admin.waiting_for_password)
+    @dp.message(Admin.waiting_for_password, flags={"throttle": "login"})
     async def process_admin_password(message: types.Message, state: FSMContext):
-        if message.text == ADMIN_PASSWORD:
+        wait = auth.locked_for(message.from_user.id)
+        if wait:
+            await message.answer(f"تم إيقاف تسجيل الدخول مؤقتاً بسبب تكرار كلمة مرور خاطئة. يرجى المحاولة بعد {math.ceil(wait / 60)} دقيقة.")
+            await state.clear()
+            return
+        if await auth.login(message.from_user.id, message.text or ""):
             await state.set_state(Admin.main_menu)
             keyboard = types.ReplyKeyboardMarkup(
                 keyboard=[
@@ -1057,6 +4143,7 @@ async def main() -> None:
                     [types.KeyboardButton(text="تصدير بيانات الطلاب")],
                     [types.KeyboardButton(text="إغلاق/فتح استمارة التقديم")],
                     [types.KeyboardButton(text="السماح/منع عرض بيانات الطلاب")],
+                    [types.KeyboardButton(text="مراجعة طلبات التقديم")],
                     [types.KeyboardButton(text="إدارة المشرفين")],
                     [types.KeyboardButton(text="العودة للقائمة الرئيسية")]
                 ],
@@ -1070,33 +4157,87 @@ async def main() -> None:
 
     @dp.message(Admin.main_menu, F.text == "عرض إحصائيات الطلاب")
     async def show_student_statistics(message: types.Message, state: FSMContext):
-        stats = get_student_statistics()
+        stats = await run_db(get_student_statistics)
+        total = stats.get("total_students", 0)
+        complete = stats.get("complete_students", 0)
+        unknown = "غير محدد"
         response_message = "إحصائيات الطلاب:\n"
-        response_message += f'العدد الكلي للطلاب: {stats.get("total_students", 0)}\n'
-        response_message += "الطلاب حسب الصف:\n"
+        response_message += f'العدد الكلي للطلاب: {total}\n'
+        response_message += f"المكتملة بياناتهم: {complete} ({complete * 100 // total if total else 0}%)\n"
+        response_message += "الطلاب حسب الصف (المكتملة بياناتهم):\n"
         for grade, count in stats.get("students_by_grade", {}).items():
-            response_message += f"  {grade}: {count}\n"
+            grade_complete, _ = stats["completion_by_grade"].get(grade, (0, 0))
+            response_message += f"  {grade or unknown}: {count} ({grade_complete})\n"
         response_message += "الطلاب حسب الشعبة:\n"
         for section, count in stats.get("students_by_section", {}).items():
-            response_message += f"  {section}: {count}\n"
+            response_message += f"  {section or unknown}: {count}\n"
+        response_message += "الطلاب حسب العام الدراسي:\n"
+        for year, count in stats.get("students_by_year", {}).items():
+            response_message += f"  {year or unknown}: {count}\n"
+        response_message += "الطلاب حسب الحالة:\n"
+        for status, count in stats.get("students_by_status", {}).items():
+            response_message += f"  {status or unknown}: {count}\n"
+        response_message += "الصف / الشعبة / العام الدراسي:\n"
+        for (grade, section, year), count in sorted(stats.get("students_by_grade_section_year", {}).items(),
+                                                    key=lambda item: tuple(value or "" for value in item[0])):
+            response_message += f"  {grade or unknown} / {section or unknown} / {year or unknown}: {count}\n"
+        admissions = stats.get("admissions_by_day", {})
+        response_message += f"طلبات التقديم في آخر {STATS_ADMISSION_DAYS} يوماً: {sum(admissions.values())}\n"
+        for day, count in admissions.items():
+            response_message += f"  {day}: {count}\n"
         await message.answer(response_message)
 
     @dp.message(Admin.main_menu, F.text == "تصدير بيانات الطلاب")
     async def export_student_data(message: types.Message, state: FSMContext):
-        file_name = "students_data.xlsx"
-        file_path = os.path.join("exports", file_name)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        await state.set_state(Admin.export_options)
+        keyboard = types.ReplyKeyboardMarkup(
+            keyboard=[
+                [types.KeyboardButton(text="تصدير Excel")],
+                [types.KeyboardButton(text="تصدير CSV")]
+            ],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        )
+        await message.answer(
+            "اختر صيغة التصدير لجميع الطلاب، أو أرسل الفلاتر المطلوبة، مثال:\n"
+            "الصف: الرابع\nالشعبة: أ\nالعام الدراسي: 2024-2025\nالصيغة: csv",
+            reply_markup=keyboard
+        )
 
-        if export_students_to_excel(file_path):
-            await message.answer_document(types.FSInputFile(file_path), caption="تم تصدير بيانات الطلاب بنجاح.")
+    @dp.message(Admin.export_options, F.text, flags={"throttle": "export"})
+    async def process_export_options(message: types.Message, state: FSMContext):
+        if message.text == "تصدير CSV":
+            options = {"fmt": "csv"}
+        elif message.text == "تصدير Excel":
+            options = {"fmt": "xlsx"}
         else:
-            await message.answer("لا توجد بيانات لتصديرها.")
+            options = parse_export_options(message.text)
+        await state.set_state(Admin.main_menu)
+
+        async def send_export(job: Job):
+            if job.error:
+                await message.answer(f"حدث خطأ أثناء تصدير البيانات: {job.error}")
+            elif job.result:
+                try:
+                    await message.answer_document(types.FSInputFile(job.result, filename=f"students_data.{options['fmt']}"),
+                                                  caption="تم تصدير بيانات الطلاب بنجاح.")
+                finally:
+                    os.remove(job.result)
+            else:
+                await message.answer("لا توجد بيانات لتصديرها.")
+
+        try:
+            job = job_manager.submit(message.from_user.id, "تصدير بيانات الطلاب", export_students,
+                                     on_done=send_export, **options)
+            await message.answer(f"جاري تصدير بيانات الطلاب في الخلفية (المهمة #{job.id})...")
+        except JobLimitError as e:
+            await message.answer(str(e))
 
     @dp.message(Admin.main_menu, F.text == "إغلاق/فتح استمارة التقديم")
     async def toggle_form_status(message: types.Message, state: FSMContext):
-        current_status = get_setting("form_status")
+        current_status = await get_setting_async("form_status")
         new_status = "closed" if current_status == "open" else "open"
-        update_setting("form_status", new_status)
+        await run_db(update_setting, "form_status", new_status)
         await message.answer(f"تم {new_status} استمارة التقديم بنجاح.")
 
     @dp.message(Admin.main_menu, F.text == "السماح/منع عرض بيانات الطلاب")
@@ -1107,26 +4248,124 @@ async def main() -> None:
     @dp.message(Admin.toggle_view_data_name)
     async def process_toggle_view_data_name(message: types.Message, state: FSMContext):
         full_name = message.text.strip()
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, full_name, can_view_data FROM Students WHERE full_name = ?", (full_name,))
-        student = cursor.fetchone()
+        candidates = await run_db(search_students, full_name)
 
-        if student:
-            student_id = student["id"]
-            current_permission = student["can_view_data"]
-            new_permission = 0 if current_permission == 1 else 1 # Toggle 0 (False) or 1 (True)
+        if len(candidates) == 1 and candidates[0]["name_key"] == normalize_arabic_name(full_name):
+            new_permission = await run_db(toggle_student_view_permission, candidates[0]["id"])
             permission_text = "السماح" if new_permission == 1 else "المنع"
-
-            cursor.execute("UPDATE Students SET can_view_data = ? WHERE id = ?", (new_permission, student_id))
-            conn.commit()
-            await message.answer(f"تم {permission_text} للطالب {full_name} من عرض بياناته.")
+            await message.answer(f"تم {permission_text} للطالب {candidates[0]['full_name']} من عرض بياناته.")
+        elif candidates:
+            await message.answer("يرجى اختيار الطالب:", reply_markup=search_results_keyboard(candidates, "toggle_view_"))
         else:
             await message.answer(f"لم يتم العثور على الطالب {full_name}.")
-        conn.close()
-        await state.clear()
+        await state.set_state(Admin.main_menu)
+
+    @dp.callback_query(Admin.main_menu, F.data.startswith("toggle_view_"))
+    async def pick_toggle_view_student(callback_query: types.CallbackQuery, state: FSMContext):
+        student_id = int(callback_query.data.removeprefix("toggle_view_"))
+        new_permission = await run_db(toggle_student_view_permission, student_id)
+        if new_permission is None:
+            await callback_query.message.answer("لم يتم العثور على الطالب.")
+        else:
+            student_data = await run_db(find_student_by_id, student_id)
+            permission_text = "السماح" if new_permission == 1 else "المنع"
+            await callback_query.message.answer(f"تم {permission_text} للطالب {student_data['full_name']} من عرض بياناته.")
+        await callback_query.answer()
+
+    @dp.message(Admin.main_menu, F.text == "مراجعة طلبات التقديم")
+    async def review_admission_requests_menu(message: types.Message, state: FSMContext):
+        await state.update_data(review_selected=[])
+        await show_admission_page(message, state)
+
+    async def show_admission_page(message: types.Message, state: FSMContext, anchor: list = None,
+                                  direction: str = "from", edit: bool = False):
+        rows = await run_db(get_admission_page, ADMISSION_PENDING, anchor, direction)
+        if not rows and anchor is not None: # everything from here on was reviewed; go back to the start
+            rows = await run_db(get_admission_page, ADMISSION_PENDING)
+        if rows:
+            first, last = admission_anchor(rows[0]), admission_anchor(rows[-1])
+            has_previous = await run_db(has_admission_rows, ADMISSION_PENDING, first, "previous")
+            has_next = await run_db(has_admission_rows, ADMISSION_PENDING, last, "next")
+            data = await state.update_data(review_first=first, review_last=last)
+            text = "طلبات التقديم قيد المراجعة (اضغط على الاسم لتحديده):"
+            keyboard = admission_page_keyboard(rows, set(data.get("review_selected", [])), has_previous, has_next)
+        else:
+            text, keyboard = "لا توجد طلبات تقديم قيد المراجعة.", None
+
+        if edit:
+            try:
+                await message.edit_text(text, reply_markup=keyboard)
+            except TelegramBadRequest: # unchanged page, or a message too old to edit
+                pass
+        else:
+            await message.answer(text, reply_markup=keyboard)
+
+    @dp.callback_query(Admin.main_menu, F.data.in_({"ar:n", "ar:b"}))
+    async def page_admission_requests(callback_query: types.CallbackQuery, state: FSMContext):
+        data = await state.get_data()
+        if callback_query.data == "ar:n":
+            await show_admission_page(callback_query.message, state, data.get("review_last"), "next", edit=True)
+        else:
+            await show_admission_page(callback_query.message, state, data.get("review_first"), "previous", edit=True)
+        await callback_query.answer()
+
+    @dp.callback_query(Admin.main_menu, F.data.startswith("ar:t:") | F.data.in_({"ar:all", "ar:none"}))
+    async def select_admission_requests(callback_query: types.CallbackQuery, state: FSMContext):
+        data = await state.get_data()
+        selected = set(data.get("review_selected", []))
+        if callback_query.data == "ar:none":
+            selected.clear()
+        elif callback_query.data == "ar:all":
+            page = await run_db(get_admission_page, ADMISSION_PENDING, data.get("review_first"))
+            selected.update(row["id"] for row in page)
+        else:
+            selected ^= {int(callback_query.data.removeprefix("ar:t:"))}
+        await state.update_data(review_selected=sorted(selected))
+        await show_admission_page(callback_query.message, state, data.get("review_first"), edit=True)
+        await callback_query.answer()
+
+    @dp.callback_query(Admin.main_menu, F.data.in_({"ar:ok", "ar:no"}))
+    async def review_selected_admission_requests(callback_query: types.CallbackQuery, state: FSMContext):
+        data = await state.get_data()
+        selected = data.get("review_selected", [])
+        if not selected:
+            await callback_query.answer("لم يتم تحديد أي طلب.")
+            return
+        accept = callback_query.data == "ar:ok"
+        reviewed = await run_db(review_admission_requests, selected, accept, callback_query.from_user.id)
+        await state.update_data(review_selected=[])
+        await show_admission_page(callback_query.message, state, data.get("review_first"), edit=True)
+        await callback_query.answer(f"تم {'قبول' if accept else 'رفض'} {len(reviewed)} من الطلبات.")
+
+    @dp.callback_query(Admin.main_menu, F.data.startswith("ar:v:"))
+    async def view_admission_request(callback_query: types.CallbackQuery, state: FSMContext):
+        request = await run_db(find_admission_request, int(callback_query.data.removeprefix("ar:v:")))
+        if not request:
+            await callback_query.answer("لم يتم العثور على الطلب.")
+            return
+        photos = [
+            types.InputMediaPhoto(media=types.FSInputFile(get_photo_thumbnail(request[column])))
+            for column in PHOTO_COLUMNS if request[column] and os.path.exists(request[column])
+        ]
+        if photos:
+            await callback_query.message.answer_media_group(photos)
+        keyboard = admission_request_keyboard(request["id"]) if request["status"] == ADMISSION_PENDING else None
+        await callback_query.message.answer(format_admission_request(request), reply_markup=keyboard)
+        await callback_query.answer()
+
+    @dp.callback_query(Admin.main_menu, F.data.startswith("ar:a:") | F.data.startswith("ar:r:"))
+    async def review_single_admission_request(callback_query: types.CallbackQuery, state: FSMContext):
+        accept = callback_query.data.startswith("ar:a:")
+        request_id = int(callback_query.data[5:])
+        reviewed = await run_db(review_admission_requests, [request_id], accept, callback_query.from_user.id)
+        if reviewed:
+            result = "تم قبول الطلب وإضافة الطالب." if accept else "تم رفض الطلب."
+        else:
+            result = "تمت مراجعة هذا الطلب مسبقاً."
+        await callback_query.message.edit_text(f"{callback_query.message.text}\n\n{result}")
+        await callback_query.answer()
 
-    @dp.message(Admin.main_menu, F.text == "إدارة المشرفين")
+    @dp.message(Admin.main_menu, F.text == "إدارة المشرفين", flags={"auth": "admin"})
     async def manage_supervisors(message: types.Message, state: FSMContext):
         keyboard = types.ReplyKeyboardMarkup(
             keyboard=[
@@ -1141,12 +4380,12 @@ async def main() -> None:
         await message.answer("خيارات إدارة المشرفين:", reply_markup=keyboard)
         await state.set_state(Admin.supervisor_management)
 
-    @dp.message(Admin.supervisor_management, F.text == "إضافة مشرف")
+    @dp.message(Admin.supervisor_management, F.text == "إضافة مشرف", flags={"auth": "admin"})
     async def add_supervisor_start(message: types.Message, state: FSMContext):
         await state.set_state(Admin.add_supervisor_telegram_id)
         await message.answer("يرجى إدخال Telegram ID للمشرف الجديد:")
 
-    @dp.message(Admin.add_supervisor_telegram_id)
+    @dp.message(Admin.add_supervisor_telegram_id, flags={"auth": "admin"})
     async def process_add_supervisor_telegram_id(message: types.Message, state: FSMContext):
         try:
             telegram_id = int(message.text)
@@ -1156,7 +4395,7 @@ async def main() -> None:
         except ValueError:
             await message.answer("Telegram ID غير صحيح. يرجى إدخال رقم صحيح.")
 
-    @dp.message(Admin.add_supervisor_username)
+    @dp.message(Admin.add_supervisor_username, flags={"auth": "admin"})
     async def process_add_supervisor_username(message: types.Message, state: FSMContext):
         username = message.text.strip()
         if username == 'لا يوجد':
@@ -1165,14 +4404,14 @@ async def main() -> None:
         await state.set_state(Admin.add_supervisor_full_name)
         await message.answer("يرجى إدخال الاسم الكامل للمشرف الجديد:")
 
-    @dp.message(Admin.add_supervisor_full_name)
+    @dp.message(Admin.add_supervisor_full_name, flags={"auth": "admin"})
     async def process_add_supervisor_full_name(message: types.Message, state: FSMContext):
         full_name = message.text.strip()
         await state.update_data(new_supervisor_full_name=full_name)
         await state.set_state(Admin.add_supervisor_password)
         await message.answer("يرجى إدخال كلمة المرور للمشرف الجديد:")
 
-    @dp.message(Admin.add_supervisor_password)
+    @dp.message(Admin.add_supervisor_password, flags={"auth": "admin"})
     async def process_add_supervisor_password(message: types.Message, state: FSMContext):
         password = message.text.strip()
         user_data = await state.get_data()
@@ -1180,23 +4419,24 @@ async def main() -> None:
         username = user_data.get("new_supervisor_username")
         full_name = user_data.get("new_supervisor_full_name")
 
-        if add_supervisor(telegram_id, username, full_name, password):
+        if await run_db(add_supervisor, telegram_id, username, full_name, await auth.hash(password)):
             await message.answer(f"تم إضافة المشرف {full_name} بنجاح.")
         else:
             await message.answer("حدث خطأ أثناء إضافة المشرف. قد يكون Telegram ID مستخدمًا بالفعل.")
         await state.clear()
         await manage_supervisors(message, state) # Return to supervisor management menu
 
-    @dp.message(Admin.supervisor_management, F.text == "حذف مشرف")
+    @dp.message(Admin.supervisor_management, F.text == "حذف مشرف", flags={"auth": "admin"})
     async def remove_supervisor_start(message: types.Message, state: FSMContext):
         await state.set_state(Admin.remove_supervisor_telegram_id)
         await message.answer("يرجى إدخال Telegram ID للمشرف الذي تود حذفه:")
 
-    @dp.message(Admin.remove_supervisor_telegram_id)
+    @dp.message(Admin.remove_supervisor_telegram_id, flags={"auth": "admin"})
     async def process_remove_supervisor_telegram_id(message: types.Message, state: FSMContext):
         try:
             telegram_id = int(message.text)
-            if remove_supervisor(telegram_id):
+            if await run_db(remove_supervisor, telegram_id):
+                auth.logout(telegram_id)
                 await message.answer(f"تم حذف المشرف ذو Telegram ID: {telegram_id} بنجاح.")
             else:
                 await message.answer("لم يتم العثور على مشرف بهذا Telegram ID.")
@@ -1205,9 +4445,9 @@ async def main() -> None:
         await state.clear()
         await manage_supervisors(message, state) # Return to supervisor management menu
 
-    @dp.message(Admin.supervisor_management, F.text == "عرض المشرفين")
+    @dp.message(Admin.supervisor_management, F.text == "عرض المشرفين", flags={"auth": "admin"})
     async def view_supervisors(message: types.Message, state: FSMContext):
-        supervisors = get_all_supervisors()
+        supervisors = await supervisors_cache.aget()
         if supervisors:
             response_message = "قائمة المشرفين:\n"
             for sup in supervisors:
@@ -1218,7 +4458,7 @@ async def main() -> None:
         await state.clear()
         await manage_supervisors(message, state) # Return to supervisor management menu
 
-    @dp.message(Admin.supervisor_management, F.text == "العودة لقائمة المشرف")
+    @dp.message(Admin.supervisor_management, F.text == "العودة لقائمة المشرف", flags={"auth": "admin"})
     async def back_to_admin_menu(message: types.Message, state: FSMContext):
         await state.set_state(Admin.main_menu)
         keyboard = types.ReplyKeyboardMarkup(
@@ -1227,6 +4467,7 @@ async def main() -> None:
                 [types.KeyboardButton(text="تصدير بيانات الطلاب")],
                 [types.KeyboardButton(text="إغلاق/فتح استمارة التقديم")],
                 [types.KeyboardButton(text="السماح/منع عرض بيانات الطلاب")],
+                [types.KeyboardButton(text="مراجعة طلبات التقديم")],
                 [types.KeyboardButton(text="إدارة المشرفين")],
                 [types.KeyboardButton(text="العودة للقائمة الرئيسية")]
             ],
@@ -1240,13 +4481,59 @@ async def main() -> None:
         await state.clear()
         await command_start_handler(message)
 
-    # Start polling
-    await dp.start_polling(bot)
+    return dp
 
-if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+async def main(mode: str = BOT_MODE, workers: int = SHARD_WORKERS) -> None:
+    # Ensure database is created before starting the bot
+    await run_db(create_database)
 
+    BOT_TOKEN = os.getenv("BOT_TOKEN")
+    if not BOT_TOKEN:
+        print("Error: BOT_TOKEN environment variable is not set. Please set it to run the bot.")
+        return
 
+    bot = Bot(token=BOT_TOKEN)
+    if mode == "sharded":
+        try:
+            await ShardSupervisor(workers).run(bot)
+        finally:
+            await bot.session.close()
+            db_executor.shutdown(wait=True)
+            db_pool.close()
+        return
 
+    bot.session.middleware(OutboundRateLimiter())
+    dp = create_dispatcher(bot)
+    stop_metrics = await start_metrics_exporters()
 
+    try:
+        if mode == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook() # getUpdates conflicts with a webhook left over from webhook mode
+            await dp.start_polling(bot)
+    finally:
+        await stop_metrics()
+        job_manager.shutdown()
+        db_executor.shutdown(wait=True)
+        db_pool.close()
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Students data bot")
+    parser.add_argument("--check-query-plans", action="store_true",
+                        help="create/migrate the database, print the plan of every query the bot runs and exit "
+                             "with status 1 if any of them scans a table without an index")
+    parser.add_argument("--mode", choices=("polling", "webhook", "sharded"), default=BOT_MODE,
+                        help="how updates are received (default: the BOT_MODE environment variable, else polling); "
+                             "sharded polls in this process and handles updates in --workers processes")
+    parser.add_argument("--workers", type=int, default=SHARD_WORKERS,
+                        help="worker processes in sharded mode (default: BOT_WORKERS, else the number of CPUs)")
+    args = parser.parse_args()
+
+    if args.check_query_plans:
+        create_database()
+        sys.exit(0 if print_query_plans() else 1)
+    asyncio.run(main(args.mode, args.workers))
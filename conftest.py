@@ -0,0 +1,83 @@
+"""Shared fixtures. Every test that touches the database gets its own file and working directory."""
+import itertools
+
+import pytest
+from aiogram import Bot
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+import bench_bot
+import bot_combined as bc
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Points the bot's connection pool at a fresh database with the full schema."""
+    monkeypatch.chdir(tmp_path) # photos/, downloads/ and exports/ are relative to the working directory
+    pool = bc.ConnectionPool(str(tmp_path / "test.db"))
+    monkeypatch.setattr(bc, "db_pool", pool)
+    bc.create_database()
+    bc.settings_cache.invalidate()
+    bc.supervisors_cache.invalidate()
+    yield pool
+    pool.close()
+
+
+
+class RecordingSession(bench_bot.FakeTelegramSession):
+    """Keeps every Bot API request, so a test can see what the user was sent."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        return await super().make_request(bot, method, timeout)
+
+
+class Chat:
+    """The bot's own dispatcher, answering one user through a fake Telegram.
+
+    text(), photo() and press() feed a message or a button press and return the Bot
+    API requests the bot made in reply.
+    """
+
+    def __init__(self, user_id: int = 5):
+        self.user_id = user_id
+        self.session = RecordingSession()
+        self.bot = Bot(bench_bot.BENCH_TOKEN, session=self.session)
+        self.dp = bc.create_dispatcher(self.bot, storage=MemoryStorage(), throttle_rules=None, background_tasks=False)
+        self.key = StorageKey(bot_id=self.bot.id, chat_id=user_id, user_id=user_id)
+        self._update_ids = itertools.count(1)
+
+    async def _feed(self, update: dict) -> list:
+        start = len(self.session.requests)
+        await self.dp.feed_update(self.bot, Update.model_validate(update, context={"bot": self.bot}))
+        return self.session.requests[start:]
+
+    async def text(self, value: str) -> list:
+        return await self._feed(bench_bot.message_update(next(self._update_ids), self.user_id, value))
+
+    async def photo(self, file_id: str) -> list:
+        return await self._feed(bench_bot.photo_update(next(self._update_ids), self.user_id, file_id))
+
+    async def press(self, data: str) -> list:
+        return await self._feed(bench_bot.callback_update(next(self._update_ids), self.user_id, data))
+
+    async def state(self):
+        return await self.dp.storage.get_state(self.key)
+
+    async def data(self) -> dict:
+        return await self.dp.storage.get_data(self.key)
+
+    @staticmethod
+    def texts(requests: list) -> list:
+        """The text of every message among `requests`."""
+        return [method.text for method in requests if getattr(method, "text", None)]
+
+
+@pytest.fixture
+def chat(db):
+    return Chat()
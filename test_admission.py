@@ -0,0 +1,83 @@
+"""Paging through admission requests and reviewing them in bulk."""
+import asyncio
+
+import bot_combined as bc
+from test_auth import FAST, add_supervisor
+
+
+def add_requests(count: int, created_at: str = "2024-09-01 10:00:00") -> list:
+    """`count` pending requests sharing one created_at, so only the id orders them."""
+    for number in range(count):
+        bc.save_admission_request(1000 + number, {"full_name": f"متقدم {number}"})
+    with bc.get_db_connection() as conn:
+        conn.execute("UPDATE Admission_Requests SET created_at = ?", (created_at,))
+        conn.commit()
+        return [row[0] for row in conn.execute("SELECT id FROM Admission_Requests ORDER BY id")]
+
+
+def ids(page: list) -> list:
+    return [row["id"] for row in page]
+
+
+def walk(direction: str, page: list, limit: int) -> list:
+    pages = [ids(page)]
+    while page:
+        anchor = page[-1] if direction == "next" else page[0]
+        page = bc.get_admission_page(bc.ADMISSION_PENDING, bc.admission_anchor(anchor), direction, limit)
+        if page:
+            pages.append(ids(page))
+    return pages
+
+
+def test_pages_with_tied_timestamps_neither_skip_nor_repeat(db):
+    expected = add_requests(23)
+
+    forward = walk("next", bc.get_admission_page(limit=5), 5)
+    assert [request_id for page in forward for request_id in page] == expected
+    assert [len(page) for page in forward] == [5, 5, 5, 5, 3]
+
+    last = bc.get_admission_page(bc.ADMISSION_PENDING, ["2024-09-01 10:00:00", expected[-3]], limit=5)
+    backward = walk("previous", last, 5)
+    assert [request_id for page in reversed(backward) for request_id in page] == expected
+
+
+def test_rows_reviewed_or_deleted_between_pages(db):
+    expected = add_requests(12)
+    first = bc.get_admission_page(limit=4)
+    with bc.get_db_connection() as conn:
+        # the page's own last row (the anchor) and the first row of the next page disappear
+        conn.execute("DELETE FROM Admission_Requests WHERE id IN (?, ?)", (expected[3], expected[4]))
+        conn.commit()
+    bc.review_admission_requests(expected[5:7], accept=False, reviewer_id=1)
+
+    second = bc.get_admission_page(bc.ADMISSION_PENDING, bc.admission_anchor(first[-1]), "next", 4)
+    assert ids(second) == expected[7:11]
+    back = bc.get_admission_page(bc.ADMISSION_PENDING, bc.admission_anchor(second[0]), "previous", 4)
+    assert ids(back) == expected[:3]
+
+
+def test_bulk_accept_promotes_exactly_the_selected_rows(chat):
+    expected = add_requests(6)
+    add_supervisor(chat.user_id, bc.hash_password("right", n=FAST))
+
+    async def run():
+        await chat.text("مشرف")
+        await chat.text("right")
+        await chat.text("مراجعة طلبات التقديم")
+        for request_id in (expected[1], expected[3], expected[4]):
+            await chat.press(f"ar:t:{request_id}")
+        await chat.press(f"ar:t:{expected[3]}") # and unselect one again
+        selected = (await chat.data())["review_selected"]
+        replies = await chat.press("ar:ok")
+        return selected, replies, await chat.data()
+
+    selected, replies, data = asyncio.run(run())
+    assert selected == [expected[1], expected[4]]
+    assert [method.text for method in replies if hasattr(method, "callback_query_id")] == ["تم قبول 2 من الطلبات."]
+    assert data["review_selected"] == []
+    with bc.get_db_connection() as conn:
+        statuses = dict(conn.execute("SELECT id, status FROM Admission_Requests").fetchall())
+        students = [row[0] for row in conn.execute("SELECT telegram_id FROM Students ORDER BY id")]
+    assert statuses == {request_id: bc.ADMISSION_ACCEPTED if request_id in selected else bc.ADMISSION_PENDING
+                        for request_id in expected}
+    assert students == [1001, 1004]
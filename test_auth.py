@@ -0,0 +1,88 @@
+"""Password hashing, the login lockout and the admin menu's session check."""
+import asyncio
+import time
+
+import bot_combined as bc
+
+FAST = 2 ** 4 # scrypt cost for hashes the tests write themselves
+
+
+def add_supervisor(telegram_id: int, password: str):
+    with bc.get_db_connection() as conn:
+        conn.execute("INSERT INTO Supervisors (telegram_id, full_name, password) VALUES (?, 'مشرف', ?)",
+                     (telegram_id, password))
+        conn.commit()
+
+
+def test_hash_round_trip():
+    stored = bc.hash_password("كلمة سر", n=FAST)
+    assert bc.is_password_hash(stored) and "كلمة سر" not in stored
+    assert bc.verify_password("كلمة سر", stored)
+    assert not bc.verify_password("كلمة سر ", stored)
+    assert bc.hash_password("كلمة سر", n=FAST) != stored # salted
+    assert not bc.verify_password("plain", "plain") # plaintext never verifies
+    assert not bc.verify_password("x", "scrypt$bad$8$1$00$00")
+
+
+def test_wrong_password_is_rejected(db):
+    add_supervisor(42, bc.hash_password("right", n=FAST))
+    auth = bc.Authenticator()
+    try:
+        assert asyncio.run(auth.login(42, "wrong")) is None
+        assert auth.role(42) is None
+        assert asyncio.run(auth.login(42, "right")) == "supervisor"
+        assert auth.role(42) == "supervisor"
+    finally:
+        auth.close()
+
+
+def test_legacy_rows_are_hashed_on_first_login(db):
+    add_supervisor(42, "plain password")
+    add_supervisor(43, bc.hash_password("old cost", n=FAST))
+    auth = bc.Authenticator()
+    try:
+        assert asyncio.run(auth.login(42, "plain")) is None
+        assert bc.get_supervisor_password_hash(42) == "plain password" # a failed login changes nothing
+        assert asyncio.run(auth.login(42, "plain password")) == "supervisor"
+        assert asyncio.run(auth.login(43, "old cost")) == "supervisor"
+    finally:
+        auth.close()
+    for telegram_id, password in ((42, "plain password"), (43, "old cost")):
+        stored = bc.get_supervisor_password_hash(telegram_id)
+        assert bc.verify_password(password, stored) and not bc.password_needs_rehash(stored)
+
+
+def test_lockout_after_repeated_failures_and_its_expiry(db):
+    add_supervisor(42, bc.hash_password("right", n=FAST))
+    auth = bc.Authenticator(max_failures=3, lockout=0.5)
+    try:
+        for _ in range(3):
+            assert asyncio.run(auth.login(42, "wrong")) is None
+        assert 0 < auth.locked_for(42) <= 0.5
+        assert asyncio.run(auth.login(42, "right")) is None # refused while locked out
+        assert auth.locked_for(7) == 0 # other users are not affected
+        time.sleep(0.6)
+        assert auth.locked_for(42) == 0
+        assert asyncio.run(auth.login(42, "right")) == "supervisor"
+    finally:
+        auth.close()
+
+
+def test_admin_menu_needs_a_session(chat):
+    add_supervisor(chat.user_id, bc.hash_password("right", n=FAST))
+
+    async def run():
+        await chat.dp.storage.set_state(chat.key, bc.Admin.main_menu)
+        without_session = await chat.text("عرض إحصائيات الطلاب")
+        state_after = await chat.state()
+        await chat.text("مشرف")
+        await chat.text("right")
+        logged_in = await chat.text("عرض إحصائيات الطلاب")
+        admin_only = await chat.text("إدارة المشرفين")
+        return without_session, state_after, logged_in, admin_only
+
+    without_session, state_after, logged_in, admin_only = asyncio.run(run())
+    assert chat.texts(without_session) == ["انتهت جلسة المشرف. يرجى تسجيل الدخول مجدداً."]
+    assert state_after is None
+    assert chat.texts(logged_in)[0].startswith("إحصائيات الطلاب:")
+    assert chat.texts(admin_only) == ["هذا الخيار متاح لمدير النظام فقط."] # a supervisor, not the admin
@@ -0,0 +1,48 @@
+"""The benchmark harness drives the real dispatcher end to end and compares result files."""
+import argparse
+import asyncio
+import json
+
+import bench_bot
+import bot_combined as bc
+
+
+def load_args(**overrides):
+    args = dict(seed=1, form_users=3, search_users=3, admins=1, imports=1, import_rows=20, students=50,
+                typo_ratio=0.5, ramp=0.0, think_ms=0.0, api_ms=0.0, throttle=False)
+    return argparse.Namespace(**{**args, **overrides})
+
+
+def test_load_runs_every_flow_without_errors(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(bc, "photo_downloader", bc.PhotoDownloader())
+    results = asyncio.run(bench_bot.bench_load(load_args()))
+
+    assert results["flows"] == {"form": 3, "search": 3, "admin": 1, "import": 1}
+    assert results["errors"] == {}
+    handlers = results["handlers"]
+    assert {"submit_form", "process_search_name", "process_uploaded_file"} <= handlers.keys()
+    assert handlers["submit_form"]["count"] == 3
+    assert all(stats["p99_ms"] >= stats["p50_ms"] and "db" in stats for stats in handlers.values())
+    assert results["jobs"].keys() == {"export_students", "process_excel_file"} # background jobs finished too
+    assert results["api_calls"]["SendDocument"] == 1 and results["api_calls"]["GetFile"] > 0
+    json.loads(json.dumps(results)) # saved with --output
+
+
+def test_compare_reports_regressions(tmp_path):
+    def write(name, p95, throughput):
+        path = tmp_path / name
+        path.write_text(json.dumps({"command": "load", "results": {
+            "updates_per_second": throughput, "handlers": {"h": {"p50_ms": 1.0, "p95_ms": p95, "p99_ms": 3.0}}}}))
+        return str(path)
+
+    before = write("before.json", 2.0, 100.0)
+    assert bench_bot.compare_results(before, write("same.json", 2.1, 98.0), 10) == []
+    assert bench_bot.compare_results(before, write("slower.json", 4.0, 50.0), 10) == [
+        "handlers.h.p95_ms", "updates_per_second"]
+
+
+def test_percentiles():
+    samples = [i / 1000 for i in range(1, 101)]
+    assert bench_bot.summarize(samples) == {"count": 100, "p50_ms": 50.0, "p95_ms": 95.0, "p99_ms": 99.0,
+                                            "max_ms": 100.0}
+    assert bench_bot.percentile([], 99) == 0.0
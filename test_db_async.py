@@ -0,0 +1,77 @@
+"""run_db keeps blocking database work off the event loop."""
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import bot_combined as bc
+
+
+def test_run_db_runs_on_a_db_thread_and_leaves_the_loop_free(db):
+    def slow_query():
+        with bc.get_db_connection() as conn:
+            conn.execute("SELECT COUNT(*) FROM Students").fetchone()
+        time.sleep(0.3) # stands in for a lock wait
+        return threading.current_thread().name
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.ensure_future(ticker())
+        thread = await bc.run_db(slow_query)
+        task.cancel()
+        return thread, ticks
+
+    thread, ticks = asyncio.run(run())
+    assert thread.startswith("db") and thread != threading.current_thread().name
+    assert ticks >= 10 # the loop kept running while the query blocked
+
+
+def test_locked_database_is_retried(monkeypatch):
+    monkeypatch.setattr(bc, "DB_LOCK_BACKOFF", 0)
+    attempts = []
+
+    def write():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise sqlite3.OperationalError("database is locked")
+        return "done"
+
+    assert asyncio.run(bc.run_db(write)) == "done"
+    assert len(attempts) == 3
+
+
+def test_other_errors_are_not_retried(monkeypatch):
+    monkeypatch.setattr(bc, "DB_LOCK_BACKOFF", 0)
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise sqlite3.OperationalError("no such table: Missing")
+
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(bc.run_db(broken))
+    assert len(attempts) == 1
+
+
+def test_cold_cache_loads_on_a_db_thread(db, monkeypatch):
+    threads = []
+    loader = bc.settings_cache._loader
+
+    def load():
+        threads.append(threading.current_thread().name)
+        return loader()
+
+    monkeypatch.setattr(bc.settings_cache, "_loader", load)
+    bc.settings_cache.invalidate()
+    assert asyncio.run(bc.get_setting_async("form_status")) == "open"
+    assert asyncio.run(bc.get_setting_async("form_status")) == "open" # fresh now: no second load
+    assert len(threads) == 1 and threads[0].startswith("db")
@@ -0,0 +1,79 @@
+"""Student exports stream into their own files, filtered, as .xlsx or .csv."""
+import csv
+import os
+import threading
+
+import pytest
+from openpyxl import load_workbook
+
+import bot_combined as bc
+
+
+def add_students(rows):
+    with bc.get_db_connection() as conn:
+        conn.executemany("""
+            INSERT INTO Students (full_name, name_key, grade, section, academic_year) VALUES (?, ?, ?, ?, ?)
+        """, [(name, bc.normalize_arabic_name(name), grade, section, year) for name, grade, section, year in rows])
+        conn.commit()
+
+
+STUDENTS = [
+    ("علي حسن", "الرابع", "أ", "2024-2025"),
+    ("زينب كاظم", "الرابع", "ب", "2024-2025"),
+    ("مريم جاسم", "الخامس", "أ", "2024-2025"),
+    ("حسين علي", "الرابع", "أ", "2023-2024"),
+    ("سارة عادل", "الرابع", "أ", "2024-2025"),
+]
+
+
+def csv_names(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    return [row["full_name"] for row in rows]
+
+
+def test_csv_export_with_filters_in_fetch_sized_chunks(db, monkeypatch):
+    add_students(STUDENTS)
+    monkeypatch.setattr(bc, "EXPORT_FETCH_SIZE", 2)
+    reports = []
+
+    path = bc.export_students("csv", grade="الرابع", section="أ", progress=reports.append)
+    assert csv_names(path) == ["علي حسن", "حسين علي", "سارة عادل"]
+    assert reports == ["تمت كتابة 2 صف.", "تمت كتابة 3 صف."]
+
+    path = bc.export_students("csv", grade="الرابع", academic_year="2024-2025")
+    assert csv_names(path) == ["علي حسن", "زينب كاظم", "سارة عادل"]
+
+
+def test_xlsx_export_is_a_readable_workbook(db):
+    add_students(STUDENTS)
+    path = bc.export_students("xlsx", grade="الخامس")
+    rows = list(load_workbook(path, read_only=True).active.iter_rows(values_only=True))
+    header = list(rows[0])
+    assert [row[header.index("full_name")] for row in rows[1:]] == ["مريم جاسم"]
+
+
+def test_concurrent_exports_write_separate_files(db):
+    add_students(STUDENTS * 200)
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(bc.export_students("csv"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(paths)) == 4
+    assert all(len(csv_names(path)) == 1000 for path in paths)
+
+
+def test_empty_or_unknown_export(db):
+    add_students(STUDENTS)
+    assert bc.export_students("csv", grade="السادس") is None
+    assert os.listdir(bc.EXPORT_DIR) == [] # no file is left behind
+    with pytest.raises(ValueError):
+        bc.export_students("pdf")
+
+
+def test_parse_export_options():
+    assert bc.parse_export_options("الصف: الرابع\nالشعبة: أ\nالصيغة: CSV") == {
+        "grade": "الرابع", "section": "أ", "fmt": "csv"}
+    assert bc.parse_export_options("العام الدراسي: 2024-2025") == {"academic_year": "2024-2025", "fmt": "xlsx"}
@@ -0,0 +1,85 @@
+"""The registration form: field order, validation, the review and editing one field."""
+import asyncio
+
+import pytest
+
+import bot_combined as bc
+
+ANSWERS = {
+    "full_name": "علي حسن محمد جاسم", "dob": "2008-01-01", "grade": "الرابع", "section": "أ", "student_number": "7",
+    "phone_number": "07700000000", "parent_phone_number": "07800000000", "middle_school": "متوسطة المجتبى",
+    "location_link": "لا يوجد", "address_description": "بغداد", "status": "ناجح", "role": "أول",
+    "academic_year": "2024-2025",
+}
+BAD_ANSWERS = { # a wrong answer for every validated field, and the reply it gets
+    "dob": ("15-01-2008", "صيغة تاريخ الميلاد غير صحيحة. يرجى استخدام الصيغة YYYY-MM-DD (مثال: 2005-01-15):"),
+    "grade": ("العاشر", "الصف غير صحيح. يرجى الاختيار من (الرابع، الخامس، السادس):"),
+    "student_number": ("2000", "الرقم يجب أن يكون بين 1 و 1000. يرجى إدخال رقم صحيح:"),
+    "personal_photo_path": ("ليست صورة", "يرجى إرسال الصورة الشخصية."),
+    "status": ("ممتاز", "الحالة غير صحيحة. يرجى الاختيار من (ناجح، راسب، مكمل):"),
+}
+
+
+@pytest.fixture
+def form_chat(chat, monkeypatch):
+    monkeypatch.setattr(bc, "photo_downloader", bc.PhotoDownloader(backoff=0))
+    return chat
+
+
+async def answer(chat, spec):
+    if spec.photo:
+        return await chat.photo(f"{spec.key}-{chat.user_id}")
+    return await chat.text(ANSWERS[spec.key])
+
+
+async def fill_form(chat):
+    """Answers every step, checking what the bot asks next and that bad answers are refused."""
+    fields = bc.STUDENT_FORM.fields
+    replies = chat.texts(await chat.text("تسجيل طالب جديد"))
+    assert replies == [fields[0].prompt]
+    for index, spec in enumerate(fields):
+        if spec.key in BAD_ANSWERS:
+            bad, error = BAD_ANSWERS[spec.key]
+            assert chat.texts(await chat.text(bad)) == [error]
+            assert await chat.state() == spec.state.state # still on the same step
+        replies = chat.texts(await answer(chat, spec))
+        if index + 1 < len(fields):
+            assert replies == [fields[index + 1].prompt]
+            assert await chat.state() == fields[index + 1].state.state
+    return replies
+
+
+def test_steps_in_order_with_validation_and_review(form_chat):
+    review = asyncio.run(fill_form(form_chat))
+    data = asyncio.run(form_chat.data())
+
+    assert review == [f"{bc.STUDENT_FORM.review_title}\n{bc.STUDENT_FORM.render_review(data)}"]
+    assert asyncio.run(form_chat.state()) == bc.STUDENT_FORM.review_state.state
+    assert {key: data[key] for key in ANSWERS} == {**ANSWERS, "student_number": 7}
+    assert all(data[spec.key].startswith(bc.PHOTO_STORE_DIR) for spec in bc.STUDENT_FORM.fields if spec.photo)
+
+
+def test_render_review():
+    review = bc.STUDENT_FORM.render_review({"full_name": "علي", "grade": "الرابع", "personal_photo_path": "a.jpg"})
+    lines = review.split("\n")
+    assert lines[:3] == ["الاسم الرباعي: علي", "تاريخ الميلاد: None", "الصف: الرابع"]
+    assert len(lines) == sum(spec.in_review for spec in bc.STUDENT_FORM.fields)
+    assert "a.jpg" not in review # photos are not listed
+
+
+def test_editing_one_field_keeps_the_others(form_chat):
+    async def run():
+        await fill_form(form_chat)
+        before = await form_chat.data()
+        await form_chat.press("edit_form")
+        assert chat_texts(await form_chat.text("حقل غير موجود"))[0].startswith("هذا الحقل غير موجود")
+        assert chat_texts(await form_chat.text("الصف")) == [bc.STUDENT_FORM.by_label["grade"].prompt]
+        assert chat_texts(await form_chat.text("العاشر"))[0].startswith("الصف غير صحيح")
+        replies = chat_texts(await form_chat.text("السادس"))
+        return before, replies, await form_chat.state(), await form_chat.data()
+
+    chat_texts = form_chat.texts
+    before, replies, state, after = asyncio.run(run())
+    assert after == {**before, "grade": "السادس"}
+    assert state == bc.STUDENT_FORM.review_state.state
+    assert replies == [f"تم تحديث الحقل. يرجى مراجعة بياناتك مرة أخرى:\n{bc.STUDENT_FORM.render_review(after)}"]
@@ -0,0 +1,102 @@
+"""Conversations kept in memory and written back to SQLite in batches."""
+import asyncio
+import time
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+import bot_combined as bc
+
+KEY = StorageKey(bot_id=1, chat_id=5, user_id=5)
+
+
+def stored_rows(db):
+    with db.connection() as conn:
+        return [tuple(row) for row in conn.execute("SELECT storage_key, state FROM FSM_Storage")]
+
+
+def test_set_and_get(db):
+    async def run():
+        storage = bc.SQLiteStorage(flush_interval=60)
+        await storage.set_state(KEY, bc.Form.dob)
+        await storage.set_data(KEY, {"full_name": "علي"})
+        data = await storage.get_data(KEY)
+        data["full_name"] = "changed by the caller"
+        result = await storage.get_state(KEY), await storage.get_data(KEY)
+        await storage.close()
+        return result
+
+    assert asyncio.run(run()) == (bc.Form.dob.state, {"full_name": "علي"})
+
+
+def test_conversation_survives_a_restart(db):
+    async def first_run():
+        storage = bc.SQLiteStorage(flush_interval=60)
+        await storage.set_state_and_data(KEY, bc.Form.grade, {"full_name": "علي", "dob": "2008-01-01"})
+        await storage.set_state(StorageKey(bot_id=1, chat_id=6, user_id=6), None) # nothing to keep
+        await storage.close()
+
+    async def second_run():
+        storage = bc.SQLiteStorage(flush_interval=60)
+        result = await storage.get_state(KEY), await storage.get_data(KEY)
+        await storage.close()
+        return result
+
+    asyncio.run(first_run())
+    assert len(stored_rows(db)) == 1
+    assert asyncio.run(second_run()) == (bc.Form.grade.state, {"full_name": "علي", "dob": "2008-01-01"})
+
+
+def test_expired_conversations_are_dropped(db):
+    async def write():
+        storage = bc.SQLiteStorage(flush_interval=60)
+        await storage.set_state(KEY, bc.Form.grade)
+        await storage.close()
+
+    async def restart():
+        storage = bc.SQLiteStorage(flush_interval=60, ttl=10)
+        state = await storage.get_state(KEY)
+        await storage._expire()
+        await storage.close()
+        return state
+
+    asyncio.run(write())
+    with db.connection() as conn:
+        conn.execute("UPDATE FSM_Storage SET updated_at = ?", (time.time() - 100,))
+        conn.commit()
+    assert asyncio.run(restart()) is None
+    assert stored_rows(db) == []
+
+
+def test_flush_cancelled_mid_write_keeps_its_keys(db, monkeypatch):
+    write_fsm_records = bc.write_fsm_records
+
+    def slow_write(upserts, deletes):
+        time.sleep(0.2) # cancelled meanwhile; this attempt writes nothing
+
+    async def run():
+        storage = bc.SQLiteStorage(flush_interval=60)
+        await storage.set_state(KEY, bc.Form.grade)
+        monkeypatch.setattr(bc, "write_fsm_records", slow_write)
+        flush = asyncio.ensure_future(storage.flush())
+        await asyncio.sleep(0.05)
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+        monkeypatch.setattr(bc, "write_fsm_records", write_fsm_records)
+        await storage.close()
+
+    asyncio.run(run())
+    assert stored_rows(db) == [(bc.SQLiteStorage().key_builder.build(KEY), bc.Form.grade.state)]
+
+
+def test_edit_without_a_field_returns_to_the_review(chat):
+    async def run():
+        await chat.dp.storage.set_state(chat.key, bc.Form.edit_value) # restored, but the field was never stored
+        await chat.dp.storage.set_data(chat.key, {"full_name": "علي حسن", "grade": "الرابع"})
+        return await chat.text("الخامس"), await chat.state(), await chat.data()
+
+    replies, state, data = asyncio.run(run())
+    assert chat.texts(replies)[0].startswith(bc.STUDENT_FORM.review_title)
+    assert state == bc.STUDENT_FORM.review_state.state
+    assert data == {"full_name": "علي حسن", "grade": "الرابع"}
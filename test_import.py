@@ -0,0 +1,45 @@
+"""A name-only roster import is written in one transaction: all of it or none of it."""
+import pytest
+
+import bot_combined as bc
+
+
+def names(conn):
+    return sorted(row[0] for row in conn.execute("SELECT full_name FROM Students"))
+
+
+def test_import_inserts_new_names_once(db):
+    with db.connection() as conn:
+        conn.execute("INSERT INTO Students (full_name, name_key) VALUES (?, ?)",
+                     ("علي حسن", bc.normalize_arabic_name("علي حسن")))
+        conn.commit()
+
+    report = bc.import_student_names([["علي حسن", "زينب كاظم", None], ["  زينب كاظم ", 7, "مريم جاسم"]])
+
+    assert (report.inserted, report.skipped, len(report.failed)) == (2, 2, 1)
+    with db.connection() as conn:
+        assert names(conn) == ["زينب كاظم", "علي حسن", "مريم جاسم"]
+
+
+def test_failed_insert_leaves_students_untouched(db):
+    with db.connection() as conn:
+        conn.execute("""CREATE TRIGGER reject_name BEFORE INSERT ON Students WHEN NEW.full_name = 'مرفوض'
+                        BEGIN SELECT RAISE(ABORT, 'rejected'); END""")
+        conn.commit()
+
+    report = bc.import_student_names([["أحمد علي", "حسين محمد"], ["مرفوض", "سارة عادل"]])
+
+    assert report.inserted == 0 and len(report.failed) == 1
+    with db.connection() as conn:
+        assert names(conn) == []
+
+
+def test_unreadable_file_leaves_students_untouched(db):
+    def chunks():
+        yield ["أحمد علي", "حسين محمد"]
+        raise ValueError("corrupt sheet")
+
+    with pytest.raises(ValueError):
+        bc.import_student_names(chunks())
+    with db.connection() as conn:
+        assert names(conn) == []
@@ -0,0 +1,92 @@
+"""Imports and exports run as background jobs, off the event loop and within limits."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import bot_combined as bc
+
+
+def test_job_runs_off_the_loop_and_reports_progress_and_result():
+    manager = bc.JobManager(workers=1, progress_interval=0)
+    reports, finished = [], asyncio.Event()
+
+    def work(count, progress):
+        for step in range(count):
+            progress(f"{step + 1}/{count}")
+        return threading.current_thread().name
+
+    async def on_progress(job):
+        reports.append(job.progress)
+
+    async def on_done(job):
+        finished.set()
+
+    async def run():
+        job = manager.submit(1, "عمل", work, 3, on_progress=on_progress, on_done=on_done)
+        assert manager.active_jobs(1) == [job]
+        await asyncio.wait_for(finished.wait(), 5)
+        await asyncio.sleep(0) # let the last progress callbacks run
+        return job
+
+    job = asyncio.run(run())
+    manager.shutdown()
+    assert job.status == "done" and job.result.startswith("job")
+    assert reports and reports[-1] == "3/3"
+    assert manager.active_jobs() == []
+
+
+def test_failed_job_is_reported():
+    manager = bc.JobManager(workers=1)
+    done = []
+
+    def work(progress):
+        raise ValueError("ملف تالف")
+
+    async def run():
+        finished = asyncio.Event()
+
+        async def on_done(job):
+            done.append(job)
+            finished.set()
+
+        manager.submit(1, "عمل", work, on_done=on_done)
+        await asyncio.wait_for(finished.wait(), 5)
+
+    asyncio.run(run())
+    manager.shutdown()
+    assert [(job.status, job.error) for job in done] == [("failed", "ملف تالف")]
+
+
+def test_per_user_and_concurrency_limits():
+    manager = bc.JobManager(workers=2, per_user_limit=2)
+    release, running, peak = threading.Event(), [], [0]
+    lock = threading.Lock()
+
+    def work(progress):
+        with lock:
+            running.append(1)
+            peak[0] = max(peak[0], len(running))
+        release.wait(5)
+        with lock:
+            running.pop()
+
+    async def run():
+        jobs = [manager.submit(owner, "عمل", work) for owner in (1, 1, 2, 3)]
+        with pytest.raises(bc.JobLimitError):
+            manager.submit(1, "عمل", work) # a third unfinished job for the same user
+        await asyncio.sleep(0.2)
+        started = sum(job.status == "running" for job in jobs)
+        loop_latency = time.monotonic()
+        await asyncio.sleep(0)
+        loop_latency = time.monotonic() - loop_latency
+        release.set()
+        while manager.active_jobs():
+            await asyncio.sleep(0.01)
+        return started, loop_latency
+
+    started, loop_latency = asyncio.run(run())
+    manager.shutdown()
+    assert started == 2 and peak[0] == 2 # four jobs queued, two workers
+    assert loop_latency < 0.1 # the event loop stayed free while the jobs ran
@@ -0,0 +1,84 @@
+"""Merge imports write only the cells that changed, and nothing for an unchanged roster."""
+import bot_combined as bc
+
+
+class TracingPool(bc.ConnectionPool):
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.statements = []
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.set_trace_callback(self.statements.append)
+        return conn
+
+    def writes(self):
+        """The distinct writes to Students (the trace repeats a statement once per trigger it fires)."""
+        return sorted({" ".join(sql.split()) for sql in self.statements
+                       if sql.lstrip().startswith(("INSERT INTO Students ", "UPDATE Students "))})
+
+
+def roster(count, **overrides):
+    """One chunk of (row number, cells) records for `count` students; overrides map index -> changed cells."""
+    return [[(i + 2, {"student_number": i + 1, "full_name": f"طالب رقم {i + 1}", "grade": "الرابع",
+                      "section": "أ", "phone_number": f"0770{i:07d}", **overrides.get(f"s{i}", {})})
+             for i in range(count)]]
+
+
+def students(conn):
+    return {row["student_number"]: dict(row) for row in conn.execute("SELECT * FROM Students")}
+
+
+def test_unchanged_reimport_writes_nothing(db, monkeypatch):
+    first = bc.merge_student_rows(roster(50))
+    assert (first.inserted, first.updated, first.failed) == (50, 0, [])
+
+    pool = TracingPool(db.db_path)
+    monkeypatch.setattr(bc, "db_pool", pool)
+    again = bc.merge_student_rows(roster(50))
+    pool.close()
+
+    assert (again.inserted, again.updated, again.unchanged) == (0, 0, 50)
+    assert pool.writes() == []
+
+
+def test_only_changed_columns_are_written(db, monkeypatch):
+    bc.merge_student_rows(roster(50))
+    with db.connection() as conn:
+        before = students(conn)
+
+    pool = TracingPool(db.db_path)
+    monkeypatch.setattr(bc, "db_pool", pool)
+    report = bc.merge_student_rows(roster(50, s3={"section": "ب"}, s7={"section": "ج"}, s9={"phone_number": "0780"}))
+    pool.close()
+
+    assert (report.updated, report.unchanged) == (3, 47)
+    assert report.changed_columns == {"section": 2, "phone_number": 1}
+    writes = pool.writes()
+    # one executemany per set of changed columns, naming only those columns
+    assert writes == sorted([
+        "UPDATE Students SET section = 'ب', updated_at = CURRENT_TIMESTAMP WHERE id = 4",
+        "UPDATE Students SET section = 'ج', updated_at = CURRENT_TIMESTAMP WHERE id = 8",
+        "UPDATE Students SET phone_number = '0780', updated_at = CURRENT_TIMESTAMP WHERE id = 10",
+    ])
+    with db.connection() as conn:
+        after = students(conn)
+    changed = {number for number in before if before[number] != after[number]}
+    assert changed == {4, 8, 10}
+
+
+def test_empty_cells_keep_stored_values_and_names_claim_numbers(db):
+    with db.connection() as conn:
+        conn.execute("INSERT INTO Students (full_name, name_key, grade) VALUES ('علي حسن', ?, 'الخامس')",
+                     (bc.normalize_arabic_name("علي حسن"),))
+        conn.commit()
+
+    report = bc.merge_student_rows([[
+        (2, {"student_number": 5, "full_name": "علي حسن", "grade": "", "section": "ب"}),
+        (3, {"student_number": 5, "full_name": "علي حسن", "section": "ج"}),
+    ]])
+
+    assert (report.inserted, report.updated, len(report.failed)) == (0, 1, 1)
+    with db.connection() as conn:
+        (row,) = conn.execute("SELECT student_number, grade, section FROM Students").fetchall()
+    assert tuple(row) == (5, "الخامس", "ب")
@@ -0,0 +1,67 @@
+"""Prometheus metrics: bounded SQL statement labels and the cache counters."""
+import asyncio
+
+import pytest
+
+import bot_combined as bc
+
+
+@pytest.fixture
+def labels(monkeypatch):
+    monkeypatch.setattr(bc, "_query_labels", set())
+    monkeypatch.setattr(bc, "metrics", bc.MetricsRegistry())
+    bc.query_label.cache_clear()
+    yield
+    bc.query_label.cache_clear()
+
+
+def exported_labels() -> set:
+    return {dict(labels)["query"] for name, labels in bc.metrics._histograms if name == "bot_db_query_seconds"}
+
+
+def test_placeholder_lists_share_one_label(labels):
+    seen = {bc.query_label(f"SELECT * FROM Students WHERE id IN ({', '.join('?' * count)})") for count in range(1, 50)}
+    assert seen == {"SELECT * FROM Students WHERE id IN (?)", "SELECT * FROM Students WHERE id IN (?, ...)"}
+    assert (bc.query_label("INSERT INTO Photos (digest, path,\n size) VALUES (?,?, ?)")
+            == "INSERT INTO Photos (digest, path, size) VALUES (?, ...)")
+
+
+def test_label_set_is_capped(db, labels, monkeypatch):
+    monkeypatch.setattr(bc, "DB_QUERY_LABEL_LIMIT", 5)
+
+    with bc.get_db_connection() as conn:
+        for number in range(100): # statements whose text differs every time
+            conn.execute(f"SELECT {number} FROM Students").fetchall()
+
+    assert len(exported_labels()) == 6 and "other" in exported_labels()
+    assert len(bc._query_labels) == 5
+
+
+def test_cache_counters_follow_invalidation_by_another_worker(db, monkeypatch):
+    rendered = bc.metrics.render()
+    assert "# TYPE bot_cache_hits_total counter" in rendered
+    assert 'bot_cache_misses_total{cache="settings"}' in rendered and 'cache="supervisors"' in rendered
+
+    monkeypatch.setattr(bc, "metrics", bc.MetricsRegistry())
+    writer = bc.CachedLookup(bc.load_settings, name="writer")
+    reader = bc.CachedLookup(bc.load_settings, name="reader")
+    sync = bc.CacheSync()
+    sync.on("settings", reader.invalidate)
+    asyncio.run(sync.check()) # the first check invalidates everything once
+
+    assert reader.get()["form_status"] == "open" # miss
+    assert reader.get()["form_status"] == "open" # hit
+    with db.connection() as conn: # the writer's process changes the setting
+        conn.execute("UPDATE Settings SET setting_value = 'closed' WHERE setting_name = 'form_status'")
+        conn.commit()
+    writer.invalidate()
+    assert reader.get()["form_status"] == "open" # still cached until the sync runs
+    asyncio.run(sync.check())
+    assert reader.get()["form_status"] == "closed"
+
+    assert reader.stats() == {"hits": 2, "misses": 2, "invalidations": 2}
+    rendered = bc.metrics.render().splitlines()
+    assert 'bot_cache_hits_total{cache="reader"} 2' in rendered
+    assert 'bot_cache_misses_total{cache="reader"} 2' in rendered
+    assert 'bot_cache_invalidations_total{cache="reader"} 2' in rendered
+    assert 'bot_cache_invalidations_total{cache="writer"} 1' in rendered
@@ -0,0 +1,17 @@
+"""Queued admin notifications."""
+import bot_combined as bc
+
+
+def test_enqueue_with_cold_cache_needs_one_connection(db, tmp_path, monkeypatch):
+    with bc.get_db_connection() as conn:
+        conn.execute("INSERT INTO Supervisors (telegram_id, full_name, password) VALUES (42, 'مشرف', 'x')")
+        conn.commit()
+    # With a single connection, a nested checkout would wait out the pool timeout and raise
+    monkeypatch.setattr(bc, "db_pool", bc.ConnectionPool(str(tmp_path / "test.db"), size=1, timeout=1))
+    bc.supervisors_cache.invalidate()
+
+    bc.enqueue_notification("contact", "رسالة")
+
+    with bc.get_db_connection() as conn:
+        recipients = [row[0] for row in conn.execute("SELECT recipient_id FROM Notification_Outbox ORDER BY id")]
+    assert recipients == [bc.ADMIN_TELEGRAM_ID, 42]
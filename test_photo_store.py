@@ -0,0 +1,181 @@
+"""Photo downloads into the content-addressed store."""
+import asyncio
+import os
+import threading
+
+from aiogram import types
+
+import bot_combined as bc
+
+
+class FakeBot:
+    """Serves get_file/download_file from a dict of file_id -> bytes and counts the downloads."""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.downloads = []
+
+    async def get_file(self, file_id):
+        return types.File(file_id=file_id, file_unique_id=file_id, file_path=f"photos/{file_id}.jpg")
+
+    async def download_file(self, file_path, destination):
+        file_id = os.path.splitext(os.path.basename(file_path))[0]
+        self.downloads.append(file_id)
+        with open(destination, "wb") as f:
+            f.write(self.contents[file_id])
+
+
+def photo(file_id):
+    return types.PhotoSize(file_id=file_id, file_unique_id=file_id, width=1, height=1)
+
+
+def stored_photos():
+    with bc.get_db_connection() as conn:
+        return [tuple(row) for row in conn.execute("SELECT path, refcount FROM Photos ORDER BY path")]
+
+
+def test_same_photo_is_fetched_once_and_stored_once(db):
+    bot = FakeBot({"a": b"same bytes", "b": b"same bytes"})
+    downloader = bc.PhotoDownloader(backoff=0)
+
+    async def run():
+        return await asyncio.gather(downloader.download(bot, photo("a")), downloader.download(bot, photo("a")),
+                                    downloader.download(bot, photo("b")))
+
+    paths = asyncio.run(run())
+    assert len(set(paths)) == 1 and os.path.exists(paths[0])
+    assert sorted(bot.downloads) == ["a", "b"] # "a" twice at once is one download
+    assert stored_photos() == [(paths[0], 0)]
+
+    assert asyncio.run(downloader.download(bot, photo("a"))) == paths[0]
+    assert sorted(bot.downloads) == ["a", "b"]
+
+
+def test_collected_photo_is_downloaded_again(db):
+    bot = FakeBot({"a": b"photo"})
+    downloader = bc.PhotoDownloader(backoff=0)
+    path = asyncio.run(downloader.download(bot, photo("a")))
+    with bc.get_db_connection() as conn:
+        conn.execute("UPDATE Photos SET touched_at = datetime('now', '-30 days')")
+        conn.commit()
+    assert bc.collect_photo_garbage()[0] >= 1
+    assert not os.path.exists(path) and stored_photos() == []
+
+    assert asyncio.run(downloader.download(bot, photo("a"))) == path
+    assert bot.downloads == ["a", "a"]
+    assert os.path.exists(path) and stored_photos() == [(path, 0)]
+
+
+def test_remembered_photos_are_bounded(db):
+    bot = FakeBot({name: name.encode() for name in "abc"})
+    downloader = bc.PhotoDownloader(backoff=0, cache_size=2)
+
+    async def run():
+        for name in "abca":
+            await downloader.download(bot, photo(name))
+
+    asyncio.run(run())
+    assert len(downloader._saved) == 2
+    assert bot.downloads == ["a", "b", "c", "a"] # "a" was the least recently used when "c" came in
+
+
+def store(digest, content=b"x"):
+    """Writes a file and its thumbnail into the store and registers it, as place_photo() would."""
+    path = bc.photo_store_path(digest)
+    for target in (path, bc.photo_thumbnail_path(digest)):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(content)
+    bc.register_photo(digest, path, len(content))
+    return path
+
+
+def refcounts():
+    return dict(stored_photos())
+
+
+def test_refcounts_follow_every_photo_column(db):
+    a, b = store("aa" * 32), store("bb" * 32)
+    with bc.get_db_connection() as conn:
+        student = conn.execute("""
+            INSERT INTO Students (full_name, name_key, personal_photo_path, student_card_photo_path, father_card_photo_path)
+            VALUES ('طالب', 'طالب', ?, ?, ?)
+        """, (a, a, b)).lastrowid
+        conn.execute("INSERT INTO Admission_Requests (full_name, personal_photo_path) VALUES ('متقدم', ?)", (a,))
+        conn.commit()
+        assert refcounts() == {a: 3, b: 1}
+
+        conn.execute("UPDATE Students SET personal_photo_path = ? WHERE id = ?", (b, student))
+        conn.execute("UPDATE Students SET grade = 'الرابع' WHERE id = ?", (student,))
+        conn.commit()
+        assert refcounts() == {a: 2, b: 2}
+
+        conn.execute("DELETE FROM Students WHERE id = ?", (student,))
+        conn.commit()
+    assert refcounts() == {a: 1, b: 0}
+
+
+def test_garbage_collection_keeps_referenced_and_recent_photos(db):
+    referenced, recent, orphan = store("aa" * 32), store("bb" * 32), store("cc" * 32, b"12345")
+    with bc.get_db_connection() as conn:
+        conn.execute("INSERT INTO Students (full_name, name_key, personal_photo_path) VALUES ('طالب', 'طالب', ?)",
+                     (referenced,))
+        conn.execute("UPDATE Photos SET touched_at = datetime('now', '-30 days') WHERE path IN (?, ?)",
+                     (referenced, orphan))
+        conn.commit()
+    stray, fresh_stray = bc.photo_store_path("dd" * 32), bc.photo_store_path("ee" * 32)
+    for path in (stray, fresh_stray): # files left behind by interrupted downloads
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"123")
+    old = os.path.getmtime(stray) - 30 * 86400
+    os.utime(stray, (old, old))
+
+    removed, freed = bc.collect_photo_garbage()
+
+    assert (removed, freed) == (3, 8) # the orphan, its thumbnail and the old stray file
+    assert not os.path.exists(orphan) and not os.path.exists(bc.photo_thumbnail_path("cc" * 32))
+    assert not os.path.exists(stray)
+    assert all(os.path.exists(path) for path in (referenced, recent, fresh_stray))
+    assert set(refcounts()) == {referenced, recent}
+
+
+def test_download_during_collection_keeps_its_file(db, monkeypatch):
+    """A download of a photo the collector is removing waits for it, then places the file again."""
+    bot = FakeBot({"a": b"photo"})
+    downloader = bc.PhotoDownloader(backoff=0)
+    path = asyncio.run(downloader.download(bot, photo("a")))
+    with bc.get_db_connection() as conn:
+        conn.execute("UPDATE Photos SET touched_at = datetime('now', '-30 days')")
+        conn.commit()
+
+    remove, downloads = os.remove, []
+
+    def remove_while_downloading(target):
+        if not downloads: # the collector is about to delete the file: the same photo comes in again
+            download = bc.PhotoDownloader(backoff=0).download(bot, photo("a"))
+            downloads.append(threading.Thread(target=asyncio.run, args=(download,)))
+            downloads[0].start()
+            downloads[0].join(0.5)
+            assert downloads[0].is_alive() # registering the photo waits for the collection to commit
+        remove(target)
+
+    monkeypatch.setattr(bc.os, "remove", remove_while_downloading)
+    bc.collect_photo_garbage()
+    downloads[0].join()
+    monkeypatch.setattr(bc.os, "remove", remove)
+
+    assert os.path.exists(path) and stored_photos() == [(path, 0)]
+
+
+def test_failed_thumbnail_is_not_retried(db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(bc, "make_thumbnail", lambda source, destination: calls.append(source) and False)
+    monkeypatch.setattr(bc, "_thumbnail_failures", set())
+    for attempt in range(3):
+        temp_path = f"upload-{attempt}.part"
+        with open(temp_path, "wb") as f:
+            f.write(b"not an image")
+        path = bc.place_photo(temp_path, "ff" * 32, ".pdf")
+    assert calls == [path] and os.path.exists(path)
+    assert bc.get_photo_thumbnail(path) == path
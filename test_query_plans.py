@@ -0,0 +1,91 @@
+"""Every query the bot runs must be answered from an index, unless it is listed as a deliberate full scan."""
+import re
+
+import bot_combined as bc
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|x'[0-9a-fA-F]*'|\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b")
+
+
+def normalize(sql):
+    """The statement with its literals replaced by ? and its whitespace collapsed."""
+    return " ".join(_LITERALS.sub("?", sql).split())
+
+
+class TracingPool(bc.ConnectionPool):
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.statements = []
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.set_trace_callback(self.statements.append)
+        return conn
+
+
+def test_registered_queries_use_indexes(db):
+    assert bc.check_query_plans() == []
+
+
+def test_scan_steps_are_caught(db, monkeypatch):
+    monkeypatch.setitem(bc.INDEXED_QUERIES, "covering scan", ("SELECT name_key FROM Students", ()))
+    monkeypatch.setitem(bc.INDEXED_QUERIES, "index walk", (
+        "SELECT id FROM Notification_Outbox ORDER BY recipient_id, id LIMIT ?", (10,)))
+    assert {name for name, _ in bc.check_query_plans()} == {"covering scan", "index walk"}
+
+
+def test_queries_run_by_the_bot_use_indexes(db, monkeypatch):
+    pool = TracingPool(db.db_path)
+    monkeypatch.setattr(bc, "db_pool", pool)
+
+    form = {"full_name": "أحمد علي حسن", "dob": "2008-01-01", "grade": "الرابع", "section": "أ", "student_number": 7}
+    bc.import_student_names([["أحمد علي حسن", "سارة محمد"]])
+    bc.save_student_form(100, form)
+    bc.save_student_form(101, {**form, "full_name": "طالب جديد", "student_number": 8})
+    bc.search_students("احمد علي")
+    bc.search_students("احمد عل")
+    bc.is_student_number_taken(7)
+    student = bc.find_student_by_telegram_id(100)
+    bc.find_student_by_id(student["id"])
+    bc.toggle_student_view_permission(student["id"])
+    bc.get_student_statistics()
+    bc.update_setting("form_status", "closed")
+    bc.load_settings()
+    bc.read_cache_versions()
+    bc.export_students(grade="الرابع", section="أ")
+
+    bc.add_supervisor(55, None, "مشرف", bc.hash_password("x", n=2 ** 4))
+    bc.get_supervisor_password_hash(55)
+    bc.set_supervisor_password_hash(55, "x")
+    bc.get_all_supervisors()
+    bc.enqueue_notification("contact", "رسالة")
+    pending = bc.fetch_pending_notifications()
+    bc.finish_notifications([pending[0]["id"]], [pending[1]["id"]])
+    bc.remove_supervisor(55)
+
+    bc.save_admission_request(200, {"full_name": "متقدم"})
+    page = bc.get_admission_page()
+    bc.has_admission_rows(bc.ADMISSION_PENDING, bc.admission_anchor(page[0]), "next")
+    bc.get_admission_page(anchor=bc.admission_anchor(page[0]), direction="previous")
+    bc.find_admission_request(page[0]["id"])
+    bc.review_admission_requests([page[0]["id"]], True, 1)
+
+    bc.register_photo("ab" * 32, bc.photo_store_path("ab" * 32), 1)
+    bc.collect_photo_garbage()
+    bc.write_fsm_records([("fsm:1:1:default", "Form:dob", b"{}", 1.0)], ["fsm:2:2:default"])
+    bc.load_fsm_record("fsm:1:1:default")
+    bc.delete_expired_fsm_records(0.0)
+    bc.merge_student_rows([[(2, {"full_name": "سارة محمد", "grade": "الخامس"})]])
+
+    allowed = {normalize(sql) for sql, _ in bc.FULL_SCAN_QUERIES.values()}
+    scans = {}
+    with bc.get_db_connection() as conn:
+        conn.set_trace_callback(None)
+        for statement in dict.fromkeys(pool.statements):
+            if not statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE")):
+                continue
+            if "Students_fts_" in statement: # FTS5 reading its own shadow tables
+                continue
+            plan = bc.explain_query(conn, statement)
+            if any(bc.is_scan_step(step) for step in plan) and normalize(statement) not in allowed:
+                scans[normalize(statement)] = plan
+    assert scans == {}
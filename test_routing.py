@@ -0,0 +1,146 @@
+"""ExactMatchObserver must pick the handler aiogram's own observer would pick."""
+import asyncio
+from datetime import datetime
+
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, types
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import bot_combined as bc
+
+USER_ID = 5
+
+
+class Form(StatesGroup):
+    name = State()
+    age = State()
+
+
+class Trace(BaseMiddleware):
+    """Records the handler each update reaches and whatever data its filters added."""
+
+    def __init__(self, calls: list, call_handler: bool = True):
+        self.calls = calls
+        self.call_handler = call_handler
+
+    async def __call__(self, handler, event, data):
+        self.calls.append((data["handler"].callback.__name__, data.get("length")))
+        if self.call_handler:
+            return await handler(event, data)
+
+
+def message(update_id: int, text: str) -> types.Update:
+    return types.Update(update_id=update_id, message=types.Message(
+        message_id=update_id, date=datetime.now(), chat=types.Chat(id=USER_ID, type="private"),
+        from_user=types.User(id=USER_ID, is_bot=False, first_name="x"), text=text))
+
+
+def callback(update_id: int, data: str) -> types.Update:
+    user = types.User(id=USER_ID, is_bot=False, first_name="x")
+    return types.Update(update_id=update_id, callback_query=types.CallbackQuery(
+        id=str(update_id), from_user=user, chat_instance="x", data=data, message=types.Message(
+            message_id=update_id, date=datetime.now(), chat=types.Chat(id=USER_ID, type="private"), from_user=user)))
+
+
+async def dispatch(dp: Dispatcher, bot: Bot, calls: list, states, updates) -> list:
+    """Feeds every update in every state and returns the trace of each."""
+    key = StorageKey(bot_id=bot.id, chat_id=USER_ID, user_id=USER_ID)
+    traces = []
+    for state in states:
+        for update in updates:
+            await dp.storage.set_state(key, state)
+            calls.clear()
+            await dp.feed_update(bot, update)
+            traces.append((state, update.model_dump_json(exclude_unset=True), list(calls)))
+    return traces
+
+
+def build_sample(indexed: bool, calls: list) -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    if indexed:
+        bc.use_exact_match_dispatch(dp)
+    dp.message.middleware(Trace(calls))
+
+    def handler(name: str, skip: bool = False):
+        async def callback(event, **kwargs):
+            calls.append(name)
+            if skip:
+                raise SkipHandler()
+        callback.__name__ = name
+        return callback
+
+    register = dp.message.register
+    register(handler("start"), Command("start"))
+    register(handler("starts_with_z"), lambda m: bool(m.text) and m.text.startswith("z"))
+    register(handler("menu"), F.text == "menu")
+    register(handler("menu_again"), F.text == "menu")
+    register(handler("passes_on", skip=True), Form.name, F.text == "skip")
+    register(handler("any_name"), Form.name)
+    register(handler("choice"), F.text.in_({"a", "b", "zz"}))
+    register(handler("age_choice"), Form.age, F.text == "a")
+    register(handler("help"), StateFilter("*"), F.text == "help")
+    register(handler("menu_skips", skip=True), F.text == "b")
+    register(handler("with_data"), lambda m: {"length": len(m.text)} if m.text else False)
+    register(handler("fallback"))
+    return dp
+
+
+def test_sample_handlers_match_stock_dispatch():
+    texts = ["menu", "a", "b", "zz", "zmenu", "skip", "help", "/start", "other", ""]
+    updates = [message(i, text) for i, text in enumerate(texts, 1)]
+    states = [None, Form.name.state, Form.age.state]
+
+    async def run(indexed: bool):
+        calls = []
+        bot = Bot(token="42:test")
+        try:
+            return await dispatch(build_sample(indexed, calls), bot, calls, states, updates)
+        finally:
+            await bot.session.close()
+
+    assert asyncio.run(run(True)) == asyncio.run(run(False))
+
+
+def test_bot_handlers_match_stock_dispatch(db, monkeypatch):
+    # Every admin state is reachable, and handlers are only traced, never run
+    monkeypatch.setattr(bc.Authenticator, "role", lambda self, telegram_id: "admin")
+    bot = Bot(token="42:test")
+
+    def build(indexed: bool, calls: list) -> Dispatcher:
+        with monkeypatch.context() as patch:
+            if not indexed:
+                patch.setattr(bc, "use_exact_match_dispatch", lambda dp: None)
+            dp = bc.create_dispatcher(bot, storage=MemoryStorage(), throttle_rules=None, background_tasks=False)
+        for observer in (dp.message, dp.callback_query):
+            observer.middleware(Trace(calls, call_handler=False))
+        return dp
+
+    indexed_calls, stock_calls = [], []
+    indexed, stock = build(True, indexed_calls), build(False, stock_calls)
+    assert isinstance(indexed.message, bc.ExactMatchObserver) and not isinstance(stock.message, bc.ExactMatchObserver)
+
+    states = [None] + sorted({state.state for group in StatesGroup.__subclasses__() if group.__module__ == bc.__name__
+                              for state in group.__all_states__})
+    values = {}
+    for observer in (indexed.message, indexed.callback_query):
+        for _, attribute, value in observer._index:
+            values.setdefault(attribute, set()).add(value)
+    texts = sorted(values["text"]) + ["/start", "/jobs", "نص آخر"]
+    data = sorted(values["data"]) + ["search_pick_1", "update_student_1", "toggle_view_1", "ar:t:1", "ar:v:1",
+                                     "ar:a:1", "غير معروف"]
+    updates = [message(i, text) for i, text in enumerate(texts, 1)]
+    updates += [callback(i, value) for i, value in enumerate(data, len(updates) + 1)]
+
+    async def run():
+        try:
+            return (await dispatch(indexed, bot, indexed_calls, states, updates),
+                    await dispatch(stock, bot, stock_calls, states, updates))
+        finally:
+            await bot.session.close()
+
+    indexed_traces, stock_traces = asyncio.run(run())
+    assert indexed_traces == stock_traces
+    assert sum(bool(calls) for _, _, calls in indexed_traces) > len(updates)
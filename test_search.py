@@ -0,0 +1,69 @@
+"""Name search, and picking a result only from the candidates the search offered."""
+import asyncio
+
+import bot_combined as bc
+
+
+def add_students(*rows):
+    ids = []
+    with bc.get_db_connection() as conn:
+        for full_name, telegram_id, phone in rows:
+            ids.append(conn.execute(
+                "INSERT INTO Students (full_name, name_key, telegram_id, phone_number) VALUES (?, ?, ?, ?)",
+                (full_name, bc.normalize_arabic_name(full_name), telegram_id, phone)).lastrowid)
+        conn.commit()
+    return ids
+
+
+def test_normalize_arabic_name():
+    assert bc.normalize_arabic_name("  أحمد   إبراهيم ") == "احمد ابراهيم"
+    assert bc.normalize_arabic_name("فاطمة مصطفى") == "فاطمه مصطفي"
+    assert bc.normalize_arabic_name("مُحَمَّد عبد الله") == "محمد عبدالله"
+    assert bc.normalize_arabic_name("محـــمد") == "محمد"
+    assert bc.normalize_arabic_name("") == bc.normalize_arabic_name(None) == ""
+
+
+def test_search_exact_fuzzy_and_any_word(db):
+    add_students(("أحمد علي حسن", None, None), ("احمد علي حسين", None, None), ("زينب كاظم جواد", None, None))
+
+    exact = bc.search_students("احمد علي حسن")
+    assert [row["full_name"] for row in exact] == ["أحمد علي حسن"]
+    # both names have every word; the closer spelling comes first
+    assert [row["full_name"] for row in bc.search_students("احمد علي")] == ["أحمد علي حسن", "احمد علي حسين"]
+    # a misspelled word matches nothing, so the other words are enough; ranked by similarity
+    assert [row["full_name"] for row in bc.search_students("احمد علي حسبن")] == ["أحمد علي حسن", "احمد علي حسين"]
+    # no name has every word, so any word is enough
+    assert [row["full_name"] for row in bc.search_students("زينب عباس")] == ["زينب كاظم جواد"]
+    assert bc.search_students("خالد") == []
+    assert bc.search_students("ز") == [] # too short for the trigram index
+
+
+def test_pick_accepts_only_offered_students(chat):
+    claimable, taken, other = add_students(
+        ("محمد علي حسن", None, "07701111111"), ("محمد علي حسين", 999, "07702222222"), ("زينب كاظم جواد", None, None))
+
+    async def run():
+        forged_before_search = await chat.press(f"search_pick_{claimable}")
+        await chat.text("البحث عن اسمي")
+        await chat.text("محمد علي")
+        offered = (await chat.data())["offered"]
+        not_offered = await chat.press(f"search_pick_{other}")
+        claim_not_offered = await chat.press(f"search_claim_{other}")
+        taken_pick = await chat.press(f"search_pick_{taken}")
+
+        await chat.text("البحث عن اسمي")
+        await chat.text("محمد علي")
+        claimable_pick = await chat.press(f"search_pick_{claimable}")
+        await chat.press(f"search_claim_{claimable}")
+        return (forged_before_search, offered, not_offered, claim_not_offered, taken_pick, claimable_pick,
+                await chat.state(), await chat.data())
+
+    forged, offered, not_offered, claim_not_offered, taken_pick, claimable_pick, state, data = asyncio.run(run())
+    assert forged == [] # no search, no pick state: nothing handles it
+    assert sorted(offered) == sorted([claimable, taken])
+    for requests in (not_offered, claim_not_offered):
+        assert [type(method).__name__ for method in requests] == ["AnswerCallbackQuery"]
+        assert requests[0].show_alert
+    assert chat.texts(taken_pick) == ["هذا الاسم مسجل بحساب آخر. إذا كان اسمك، يرجى التواصل مع الإدارة."]
+    assert chat.texts(claimable_pick) == ["الاسم المختار: محمد علي حسن"] # the name only, not the stored phone number
+    assert state == bc.Form.dob.state and data == {"full_name": "محمد علي حسن"}
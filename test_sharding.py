@@ -0,0 +1,112 @@
+"""The sharded supervisor and its worker processes."""
+import asyncio
+import time
+
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import GetUpdates
+
+import bench_bot
+import bot_combined as bc
+
+
+def test_allowed_updates_match_the_dispatcher(db):
+    dp = bc.create_dispatcher(bc.Bot(token="1:test"), storage=MemoryStorage(), background_tasks=False)
+    assert sorted(dp.resolve_used_update_types()) == sorted(bc.ALLOWED_UPDATES)
+
+
+class FakeProcess:
+    """Stands in for a worker process; a stuck one never exits until it is terminated."""
+
+    def __init__(self, stuck: bool):
+        self.alive = True
+        self.stuck = stuck
+        self.terminated = False
+
+    def join(self, timeout=None):
+        if not self.stuck:
+            self.alive = False
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.terminated = True
+        self.alive = False
+
+
+def test_stop_terminates_a_worker_whose_queue_is_full():
+    supervisor = bc.ShardSupervisor(workers=2)
+    supervisor._queues = [supervisor._context.Queue(1) for _ in range(2)]
+    supervisor._queues[0].put("update the stuck worker never reads")
+    supervisor._processes = [FakeProcess(stuck=True), FakeProcess(stuck=False)]
+
+    started = time.monotonic()
+    asyncio.run(supervisor.stop(timeout=0.5))
+
+    assert time.monotonic() - started < 5
+    assert [process.terminated for process in supervisor._processes] == [True, False]
+    assert supervisor._queues[1].get(timeout=1) is None
+
+
+def test_cache_sync_picks_up_writes_from_another_worker(db):
+    auth = bc.Authenticator()
+    sync = bc.CacheSync()
+    sync.on("settings", bc.settings_cache.invalidate)
+    sync.on("supervisors", bc.supervisors_cache.invalidate)
+    sync.on("supervisors", auth.drop_removed_supervisors)
+    bc.add_supervisor(42, None, "مشرف", "x")
+    auth._sessions[42] = ("supervisor", time.monotonic() + 60)
+    asyncio.run(sync.check())
+    assert bc.get_setting("form_status") == "open" and auth.role(42) == "supervisor"
+
+    # Another worker writes straight to the database; this process's caches don't know yet
+    with db.connection() as conn:
+        conn.execute("UPDATE Settings SET setting_value = 'closed' WHERE setting_name = 'form_status'")
+        conn.execute("DELETE FROM Supervisors WHERE telegram_id = 42")
+        conn.commit()
+    assert bc.get_setting("form_status") == "open"
+
+    asyncio.run(sync.check())
+    assert bc.get_setting("form_status") == "closed"
+    assert auth.role(42) is None
+    auth.close()
+
+
+def test_workers_split_the_job_and_download_budgets(monkeypatch):
+    monkeypatch.setattr(bc, "job_manager", bc.job_manager)
+    monkeypatch.setattr(bc, "photo_downloader", bc.photo_downloader)
+    monkeypatch.setattr(bc, "JOB_WORKERS", 4)
+    monkeypatch.setattr(bc, "PHOTO_DOWNLOAD_CONCURRENCY", 8)
+
+    bc.split_worker_budgets(3)
+
+    assert bc.job_manager._executor._max_workers == 1
+    assert bc.job_manager.per_user_limit == bc.MAX_JOBS_PER_USER # one user's jobs all run in one worker
+    assert bc.photo_downloader._semaphore._value == 2
+    assert bc.worker_share(4, 8) == 1
+    bc.job_manager.shutdown()
+
+
+def test_polling_removes_a_leftover_webhook():
+    class Session(bench_bot.FakeTelegramSession):
+        def __init__(self):
+            super().__init__()
+            self.methods = []
+
+        async def make_request(self, bot, method, timeout=None):
+            self.methods.append(method.__api_method__)
+            if isinstance(method, GetUpdates):
+                await asyncio.sleep(0.01)
+                return []
+            return await super().make_request(bot, method, timeout)
+
+    session = Session()
+
+    async def run():
+        poll = asyncio.ensure_future(bc.ShardSupervisor(1)._poll(bc.Bot(token=bench_bot.BENCH_TOKEN, session=session)))
+        await asyncio.sleep(0.05)
+        poll.cancel()
+        await asyncio.gather(poll, return_exceptions=True)
+
+    asyncio.run(run())
+    assert session.methods[0] == "deleteWebhook" and set(session.methods[1:]) == {"getUpdates"}
@@ -0,0 +1,80 @@
+"""Student_Stats must always match a recount of Students, whatever columns an update touches."""
+import bot_combined as bc
+
+COMPLETE = {
+    "telegram_id": 1, "dob": "2008-01-01", "grade": "الرابع", "section": "أ", "student_number": 1,
+    "phone_number": "0770", "parent_phone_number": "0771", "middle_school": "متوسطة", "location_link": "لا يوجد",
+    "address_description": "بغداد", "personal_photo_path": "a.jpg", "student_card_photo_path": "b.jpg",
+    "father_card_photo_path": "c.jpg", "mother_card_photo_path": "d.jpg", "status": "ناجح", "role": "أول",
+    "academic_year": "2024-2025",
+}
+
+
+def insert_student(conn, full_name, **columns):
+    columns = {"full_name": full_name, "name_key": bc.normalize_arabic_name(full_name), **columns}
+    cursor = conn.execute(f"INSERT INTO Students ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                          tuple(columns.values()))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def counters(conn):
+    return sorted(tuple(row) for row in conn.execute("SELECT * FROM Student_Stats WHERE students != 0"))
+
+
+def recount(conn):
+    return sorted(tuple(row) for row in conn.execute(
+        f"SELECT {bc._student_stats_key('Students')}, COUNT(*) FROM Students GROUP BY 1, 2, 3, 4, 5"))
+
+
+def test_counters_follow_insert_update_delete(db):
+    with bc.get_db_connection() as conn:
+        complete_id = insert_student(conn, "طالب مكتمل", **COMPLETE)
+        partial_id = insert_student(conn, "طالب ناقص", grade="الخامس")
+        assert counters(conn) == recount(conn)
+        assert bc.get_student_statistics()["complete_students"] == 1
+
+        conn.execute("UPDATE Students SET section = 'ب', grade = 'السادس' WHERE id = ?", (complete_id,))
+        conn.execute("UPDATE Students SET phone_number = NULL WHERE id = ?", (complete_id,))
+        conn.commit()
+        assert counters(conn) == recount(conn)
+        assert bc.get_student_statistics()["complete_students"] == 0
+
+        conn.execute("DELETE FROM Students WHERE id = ?", (partial_id,))
+        conn.commit()
+        assert counters(conn) == recount(conn)
+        assert bc.get_student_statistics()["total_students"] == 1
+
+
+def test_dob_only_update_completes_a_student(db):
+    with bc.get_db_connection() as conn:
+        student_id = insert_student(conn, "طالب بلا ميلاد", **{**COMPLETE, "dob": None})
+        assert bc.get_student_statistics()["complete_students"] == 0
+
+        conn.execute("UPDATE Students SET dob = '2005-01-01' WHERE id = ?", (student_id,))
+        conn.commit()
+        assert bc.get_student_statistics()["complete_students"] == 1
+
+        conn.execute("DELETE FROM Students")
+        conn.commit()
+        assert counters(conn) == []
+
+
+def test_migration_repairs_the_old_trigger_and_counters(db):
+    with bc.get_db_connection() as conn:
+        student_id = insert_student(conn, "طالب قديم", **{**COMPLETE, "dob": None})
+        # The trigger as first shipped, which missed dob
+        conn.execute("DROP TRIGGER student_stats_update")
+        conn.execute("""
+            CREATE TRIGGER student_stats_update AFTER UPDATE OF grade ON Students BEGIN SELECT 1; END
+        """)
+        conn.execute("UPDATE Students SET dob = '2005-01-01' WHERE id = ?", (student_id,))
+        conn.execute("PRAGMA user_version = 8")
+        conn.commit()
+        assert counters(conn) != recount(conn)
+
+        bc.run_migrations(conn)
+        assert counters(conn) == recount(conn)
+        conn.execute("UPDATE Students SET dob = NULL WHERE id = ?", (student_id,))
+        conn.commit()
+        assert counters(conn) == recount(conn)
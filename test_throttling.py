@@ -0,0 +1,32 @@
+"""The outbound rate limiter spends tokens on message methods only."""
+import asyncio
+import time
+
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, GetFile, SendChatAction, SendMessage
+
+import bot_combined as bc
+
+
+def test_only_message_methods_wait_for_tokens():
+    limiter = bc.OutboundRateLimiter(global_rate=2, chat_rate=100, chat_burst=100)
+    sent = []
+
+    async def make_request(bot, method):
+        sent.append(method.__api_method__)
+
+    async def run():
+        started = time.monotonic()
+        await limiter(make_request, None, SendMessage(chat_id=1, text="x"))
+        await limiter(make_request, None, EditMessageText(chat_id=1, message_id=1, text="x"))
+        for _ in range(20): # the global bucket is empty now; these must not wait for it
+            await limiter(make_request, None, GetFile(file_id="x"))
+            await limiter(make_request, None, AnswerCallbackQuery(callback_query_id="1"))
+            await limiter(make_request, None, SendChatAction(chat_id=1, action="typing"))
+        unlimited = time.monotonic() - started
+        await limiter(make_request, None, SendMessage(chat_id=2, text="x"))
+        return unlimited, time.monotonic() - started
+
+    unlimited, total = asyncio.run(run())
+    assert unlimited < 0.2
+    assert total >= 0.4 # the third message waited for a token
+    assert len(sent) == 63
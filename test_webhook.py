@@ -0,0 +1,67 @@
+"""The webhook server checks the secret, bounds its queue and drains it on shutdown."""
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, F, types
+from aiohttp.test_utils import TestClient, TestServer
+
+import bot_combined as bc
+
+SECRET = "s3cret"
+HEADERS = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+WRONG_HEADERS = {"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+
+
+def update(update_id: int, text: str = "hi") -> dict:
+    return types.Update(update_id=update_id, message=types.Message(
+        message_id=update_id, date=datetime.now(), chat=types.Chat(id=1, type="private"),
+        from_user=types.User(id=1, is_bot=False, first_name="x"), text=text)).model_dump(mode="json", exclude_none=True)
+
+
+def recording_dispatcher(handled: list, delay: float = 0) -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message(F.text)
+    async def record(message: types.Message):
+        await asyncio.sleep(delay)
+        handled.append(message.text)
+
+    return dp
+
+
+def test_requests_are_checked_and_queued():
+    async def run():
+        bot = Bot(token="42:test")
+        server = bc.WebhookServer(recording_dispatcher([]), bot, SECRET, queue_size=2)
+        async with TestClient(TestServer(server.make_app())) as client:
+            statuses = [
+                (await client.post(bc.WEBHOOK_PATH, json=update(1))).status,
+                (await client.post(bc.WEBHOOK_PATH, json=update(2), headers=WRONG_HEADERS)).status,
+                (await client.post(bc.WEBHOOK_PATH, data=b"not json", headers=HEADERS)).status,
+                (await client.post(bc.WEBHOOK_PATH, json=update(3), headers=HEADERS)).status,
+                (await client.post(bc.WEBHOOK_PATH, json=update(4), headers=HEADERS)).status,
+                (await client.post(bc.WEBHOOK_PATH, json=update(5), headers=HEADERS)).status, # queue is full
+            ]
+        await bot.session.close()
+        return statuses, [server.queue.get_nowait().update_id for _ in range(server.queue.qsize())], server.rejected
+
+    statuses, queued, rejected = asyncio.run(run())
+    assert statuses == [401, 401, 400, 200, 200, 503]
+    assert queued == [3, 4]
+    assert rejected == 1
+
+
+def test_stop_drains_queued_updates():
+    handled = []
+
+    async def run():
+        bot = Bot(token="42:test")
+        server = bc.WebhookServer(recording_dispatcher(handled, delay=0.05), bot, SECRET, workers=2)
+        await server.start(host="127.0.0.1", port=0)
+        for update_id in range(1, 7):
+            server.queue.put_nowait(types.Update.model_validate(update(update_id, f"m{update_id}"), context={"bot": bot}))
+        await server.stop(drain_timeout=5)
+        await bot.session.close()
+
+    asyncio.run(run())
+    assert sorted(handled) == [f"m{i}" for i in range(1, 7)]
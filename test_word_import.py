@@ -0,0 +1,83 @@
+"""Word (.docx) rosters: paragraphs and tables are streamed into the batched name import."""
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+import pytest
+from openpyxl import Workbook
+
+import bot_combined as bc
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+def paragraph(text: str) -> str:
+    return f"<w:p><w:r><w:t>{escape(text)}</w:t></w:r></w:p>"
+
+
+def table(rows: list) -> str:
+    cells = ("".join(f"<w:tc>{paragraph(cell)}</w:tc>" for cell in row) for row in rows)
+    return "<w:tbl>" + "".join(f"<w:tr>{row}</w:tr>" for row in cells) + "</w:tbl>"
+
+
+def write_docx(path, *body: str) -> str:
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("word/document.xml", f'<w:document xmlns:w="{W}"><w:body>{"".join(body)}</w:body></w:document>')
+    return str(path)
+
+
+def test_paragraphs_lose_their_numbering(tmp_path):
+    path = write_docx(tmp_path / "a.docx", paragraph("1- علي حسن محمد"), paragraph(""), paragraph("٢) زينب كاظم جواد"))
+    assert list(bc.iter_word_lines(path)) == ["علي حسن محمد", "زينب كاظم جواد"]
+
+
+def test_tables_yield_their_names_column(tmp_path):
+    headed = table([["ت", "الاسم الرباعي", "الصف"], ["1", "علي حسن محمد", "الرابع"], ["2", "زينب كاظم جواد", "الخامس"]])
+    unheaded = table([["3", "مريم جاسم علي", "السادس"]])
+    path = write_docx(tmp_path / "a.docx", paragraph("قائمة الطلبة"), headed, unheaded)
+    # With tables, paragraphs outside them are titles, not names
+    assert list(bc.iter_word_lines(path)) == ["علي حسن محمد", "زينب كاظم جواد", "مريم جاسم علي"]
+    assert list(bc.iter_word_lines(path, column="الصف")) == ["الرابع", "الخامس"]
+    with pytest.raises(ValueError):
+        list(bc.iter_word_lines(path, column="العنوان"))
+
+
+def test_not_a_docx(tmp_path):
+    path = tmp_path / "a.docx"
+    path.write_bytes(b"not a zip")
+    with pytest.raises(ValueError):
+        list(bc.iter_word_lines(str(path)))
+
+
+def test_word_and_excel_imports_report_alike(db, tmp_path):
+    names = ["علي حسن محمد", "زينب كاظم جواد", "علي  حسن محمد", "عَلي حسن محمد", "مريم جاسم علي"]
+    docx = write_docx(tmp_path / "a.docx", table([["الاسم"], *([name] for name in names)]))
+    word = bc.process_word_file(docx)
+
+    with bc.get_db_connection() as conn:
+        conn.execute("DELETE FROM Students")
+        conn.commit()
+    workbook = Workbook()
+    workbook.active.append(["الاسم"])
+    for name in names:
+        workbook.active.append([name])
+    workbook.save(tmp_path / "a.xlsx")
+    excel = bc.process_excel_file(str(tmp_path / "a.xlsx"), column="الاسم")
+
+    assert (word.inserted, word.skipped, word.failed) == (excel.inserted, excel.skipped, excel.failed) == (3, 2, [])
+    assert bc.process_word_file(docx).inserted == 0 # everything is already there
+
+
+def test_large_roster_imports_quickly(db, tmp_path):
+    rows = [[str(number), f"طالب {number} حسن علي"] for number in range(10000)]
+    path = write_docx(tmp_path / "a.docx", table([["ت", "الاسم"], *rows]))
+    started = time.monotonic()
+    report = bc.process_word_file(path)
+    assert report.inserted == 10000
+    assert time.monotonic() - started < 10
+
+
+def test_names_containing_the_header_word_are_not_headers(tmp_path):
+    path = write_docx(tmp_path / "a.docx", table([["1", "باسم جاسم قاسم"], ["2", "علي حسن محمد"]]),
+                      table([["ت", "الأسم الكامل"], ["1", "مريم كاظم علي"]]))
+    assert list(bc.iter_word_lines(path)) == ["باسم جاسم قاسم", "علي حسن محمد", "مريم كاظم علي"]